@@ -1,33 +1,90 @@
-from flask import Flask, jsonify, request
+import functools
+
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
-import sqlite3
-from datetime import datetime
-import re
+import clusters
+import db
+import export
+import fleet
+import geo
+import heatmap
+import history
+import partitions
+import presence
+import rollup
+import schema
+from downsample import downsample
+from ingest import COLUMNS, IngestBusy, make_row, parse_device, parse_upload, writer
+from logquery import build_filters, partition_bounds
+from lora import parse_frame
+import snapshot
+import track
+from snapshot import latest
+from stream import CHANNELS, broker, format_event, resume_position
+from timeutil import now_us, parse_duration, parse_json_time, parse_time, to_iso
 
 app = Flask(__name__)
-CORS(app)
-DB = 'telemetry.db'
+# Let browser clients read the pagination cursors
+CORS(app, expose_headers=["X-Next-Since-Id", "X-Next-Before-Id", "X-Total-Count", "X-Total-Count-Exact"])
+
+STREAM_RETRY_MS = 3000
+STREAM_RESUME_LIMIT = 5000
+
+# Rollups are written in the same transaction as the raw rows
+writer.add_transaction_hook(rollup.apply)
+# ... and so are the per-device latest values the snapshot is seeded from
+writer.add_transaction_hook(snapshot.store)
+# ... and the heatmap cell counts and map marker clusters
+writer.add_transaction_hook(heatmap.apply)
+writer.add_transaction_hook(clusters.apply)
+# Keep the in-memory latest values in step with every commit
+writer.add_listener(latest.apply)
+# Cached heatmap tiles that got new fixes are rendered again on request
+writer.add_listener(heatmap.tiles.invalidate)
+
+# Hand each request's SQLite connection back to the pool when it finishes
+@app.teardown_appcontext
+def release_connection(exc):
+    db.release()
 
-# Update init_db() with new schema
 def init_db():
-    with sqlite3.connect(DB) as conn:
-        c = conn.cursor()
-        c.execute(
-            "CREATE TABLE IF NOT EXISTS telemetry ("
-            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
-            "timestamp TEXT, "
-            "source TEXT, "  # New column to identify sensor source
-            "temperature REAL, "
-            "humidity REAL, "
-            "latitude REAL, "
-            "longitude REAL, "
-            "pressure REAL, "
-            "gx REAL, gy REAL, gz REAL)"
-        )
-        conn.commit()
+    conn = db.connect()
+    schema.init_db(conn)
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        partitions.expire(conn)
+    latest.seed(conn)
+    heatmap.tiles.reset()
+    broker.reset(partitions.last_id(conn))
+    # Devices from before the restart get a full timeout to report again
+    presence.monitor.track(latest.fleet()[1])
+    conn.close()
+
+def lora_row(frame, timestamp=None, device=None):
+    return make_row(now_us() if timestamp is None else timestamp, "arduino", device, **frame._asdict())
+
+def item_timestamp(item):
+    """Capture time of a batch item, or None to stamp it on arrival"""
+    value = item.get('timestamp')
+    if value is None:
+        return None
+    try:
+        return parse_json_time(value)
+    except ValueError:
+        raise ValueError("Invalid timestamp")
 
-# Endpoint for LoRa data (ard.py) - extract only pressure and gyro
-# Modify /data endpoint to include source
+def batch_response(rows, results):
+    return jsonify({
+        "success": bool(rows),
+        "accepted": len(rows),
+        "rejected": len(results) - len(rows),
+        "results": results
+    }), 200 if rows else 400
+
+def busy_response():
+    return jsonify({"error": "Ingest queue is full, retry later"}), 503
+
+# Endpoint for LoRa data (ard.py) - stores every channel of the frame
 @app.route("/data", methods=['POST'])
 def receive_lora_data():
     try:
@@ -36,32 +93,72 @@ def receive_lora_data():
             return jsonify({"error": "No data provided"}), 400
         
         try:
-            pressure_match = re.search(r"P:([\d.]+)hPa", data)
-            pressure = float(pressure_match.group(1)) if pressure_match else None
-            
-            gx_match = re.search(r"GX:([\d.-]+)", data)
-            gy_match = re.search(r"GY:([\d.-]+)", data)
-            gz_match = re.search(r"GZ:([\d.-]+)", data)
-            
-            gx = float(gx_match.group(1)) if gx_match else None
-            gy = float(gy_match.group(1)) if gy_match else None
-            gz = float(gz_match.group(1)) if gz_match else None
-            
-            if None in [pressure, gx, gy, gz]:
-                return jsonify({"error": "Missing required fields"}), 400
-        except Exception:
-            return jsonify({"error": "Invalid data format"}), 400
+            frame = parse_frame(data)
+            device = parse_device(request.json.get('device'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
-        with sqlite3.connect(DB) as conn:
-            c = conn.cursor()
-            c.execute(
-                "INSERT INTO telemetry (timestamp, source, pressure, gx, gy, gz) "
-                "VALUES (?, ?, ?, ?, ?, ?)",
-                (datetime.now().isoformat(), "arduino", pressure, gx, gy, gz)
-            )
-            conn.commit()
+        writer.write([lora_row(frame, device=device)])
         
         return jsonify({"success": True}), 200
+    except IngestBusy:
+        return busy_response()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# Batch endpoint for LoRa gateways - many frames per POST, one transaction
+# Accepts a JSON array of frames, {"data": [...]}, or a newline-delimited text body.
+# JSON items may also be {"data": frame, "timestamp": t} (epoch seconds or
+# ISO 8601) so store-and-forward clients keep each frame's capture time.
+# The sending device is ?device=, a top-level "device" next to "data", or a
+# per-item "device" (for gateways relaying several nodes).
+@app.route("/data/batch", methods=['POST'])
+def receive_lora_batch():
+    try:
+        try:
+            batch_device = parse_device(request.args.get('device'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if request.is_json:
+            frames = request.json
+            if isinstance(frames, dict):
+                try:
+                    batch_device = parse_device(frames.get('device')) or batch_device
+                except ValueError as e:
+                    return jsonify({"error": str(e)}), 400
+                frames = frames.get('data')
+        else:
+            frames = request.get_data(as_text=True).splitlines()
+            frames = [f for f in frames if f.strip()]
+        
+        if not frames or not isinstance(frames, list):
+            return jsonify({"error": "No data provided"}), 400
+        
+        rows = []
+        results = []
+        for index, frame in enumerate(frames):
+            try:
+                timestamp = None
+                device = batch_device
+                if isinstance(frame, dict):
+                    timestamp = item_timestamp(frame)
+                    device = parse_device(frame.get('device')) or batch_device
+                    frame = frame.get('data')
+                if not frame:
+                    raise ValueError("No data provided")
+                parsed = parse_frame(frame)
+            except ValueError as e:
+                results.append({"index": index, "success": False, "error": str(e)})
+                continue
+            rows.append(lora_row(parsed, timestamp, device))
+            results.append({"index": index, "success": True})
+        
+        # The writer stores the whole batch in a single transaction
+        writer.write(rows)
+        
+        return batch_response(rows, results)
+    except IngestBusy:
+        return busy_response()
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -76,120 +173,667 @@ def receive_upload_data():
         
         try:
             # Safely handle null/missing values
-            temperature = float(data.get('temperature', 0.0))
-            humidity = float(data.get('humidity', 0.0))
-            latitude = float(data['latitude']) if 'latitude' in data and data['latitude'] is not None else None
-            longitude = float(data['longitude']) if 'longitude' in data and data['longitude'] is not None else None
-        except ValueError:
-            return jsonify({"error": "Invalid numeric values"}), 400
-        
-        with sqlite3.connect(DB) as conn:
-            c = conn.cursor()
-            c.execute(
-                "INSERT INTO telemetry (timestamp, source, temperature, humidity, latitude, longitude) "
-                "VALUES (?, ?, ?, ?, ?, ?)",
-                (datetime.now().isoformat(), "GPS", temperature, humidity, latitude, longitude)
-            )
-            conn.commit()
+            channels = parse_upload(data)
+            device = parse_device(data.get('device'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        writer.write([make_row(now_us(), "GPS", device, **channels)])
         
         return jsonify({"success": True}), 200
+    except IngestBusy:
+        return busy_response()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# Batch endpoint for buffered Pi uploads - a JSON array of /upload payloads,
+# one transaction. A payload's "timestamp" (epoch seconds or ISO 8601) is
+# kept as its capture time; payloads without one are stamped on arrival.
+@app.route("/upload/batch", methods=['POST'])
+def receive_upload_batch():
+    try:
+        payloads = request.json
+        if not payloads or not isinstance(payloads, list):
+            return jsonify({"error": "No data provided"}), 400
+
+        rows = []
+        results = []
+        for index, data in enumerate(payloads):
+            try:
+                if not data or not isinstance(data, dict):
+                    raise ValueError("No data provided")
+                timestamp = item_timestamp(data)
+                channels = parse_upload(data)
+                device = parse_device(data.get('device'))
+            except ValueError as e:
+                results.append({"index": index, "success": False, "error": str(e)})
+                continue
+            rows.append(make_row(now_us() if timestamp is None else timestamp, "GPS", device, **channels))
+            results.append({"index": index, "success": True})
+
+        writer.write(rows)
+
+        return batch_response(rows, results)
+    except IngestBusy:
+        return busy_response()
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 # ================= API Endpoints (for frontend) =================
+# Read endpoints answer from committed data only, so a body cannot change
+# until the next commit: their ETag is the ingest writer's commit count,
+# prefixed with the process start so tags from before a restart (which may
+# have expired partitions or followed a load.py run) never match.
+DATA_EPOCH = format(now_us(), "x")
+
+def conditional(pinned=None):
+    """ETag a read endpoint by data version and answer If-None-Match with 304.
+
+    A matching tag is answered before the view runs, without touching
+    SQLite or building JSON. The tag is read first, so a commit landing
+    while the view runs can only make the body newer than its tag. Views
+    whose body follows the clock (default time ranges) pass ``pinned``, the
+    query parameter without which the response is not tagged.
+    """
+    def decorate(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if pinned is not None and not request.args.get(pinned):
+                return view(*args, **kwargs)
+            etag = f"{DATA_EPOCH}-{writer.version}"
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            # Browsers revalidate on every poll instead of guessing a lifetime
+            response.headers["Cache-Control"] = "no-cache"
+            return response
+        return wrapper
+    return decorate
+
+# Columns of a /api/logs row, in SELECT order
+LOG_COLUMNS = ("id",) + COLUMNS
+
+def log_entry(row):
+    """Render a telemetry row (LOG_COLUMNS order) as a /api/logs entry"""
+    entry = {column: value if value is not None else "N/A" for column, value in zip(LOG_COLUMNS, row)}
+    entry["timestamp"] = to_iso(row[1])
+    return entry
+
+def device_arg():
+    """The ?device= of a read endpoint, or None for the whole fleet"""
+    device = parse_device(request.args.get("device"))
+    if device is not None and not latest.has_device(device):
+        raise LookupError(f"Unknown device: {device}")
+    return device
+
+def telemetry_body(device=None):
+    # Served from the in-memory snapshot; SQLite is only read at startup
+    temperature = latest.get("temperature", device)
+    humidity = latest.get("humidity", device)
+    pressure = latest.get("pressure", device)
+    location = latest.get("location", device)
+
+    return {
+        "temperature": temperature[0] if temperature else 0.0,
+        "humidity": humidity[0] if humidity else 0.0,
+        "pressure": pressure[0] if pressure else 0.0,
+        "location": {
+            "lat": location[0] if location else 0.0,
+            "lon": location[1] if location else 0.0
+        }
+    }
+
+def gyro_body(device=None):
+    gyro = latest.get("gyro", device)
+
+    if gyro:
+        return {
+            "roll": gyro[0],   # gx → roll
+            "pitch": gyro[1],  # gy → pitch
+            "yaw": gyro[2]     # gz → yaw
+        }
+    
+    return {
+        "roll": 0.0,
+        "pitch": 0.0,
+        "yaw": 0.0
+    }
+
+# ?device= narrows /api/telemetry and /api/gyro to one device's latest values
 @app.route("/api/telemetry")
+@conditional()
 def api_telemetry():
-    with sqlite3.connect(DB) as conn:
-        c = conn.cursor()
-        # Get the most recent complete set of data
-        c.execute("""
-            SELECT 
-                (SELECT temperature FROM telemetry WHERE temperature IS NOT NULL ORDER BY timestamp DESC LIMIT 1),
-                (SELECT humidity FROM telemetry WHERE humidity IS NOT NULL ORDER BY timestamp DESC LIMIT 1),
-                (SELECT pressure FROM telemetry WHERE pressure IS NOT NULL ORDER BY timestamp DESC LIMIT 1),
-                (SELECT latitude FROM telemetry WHERE latitude IS NOT NULL ORDER BY timestamp DESC LIMIT 1),
-                (SELECT longitude FROM telemetry WHERE longitude IS NOT NULL ORDER BY timestamp DESC LIMIT 1)
-        """)
-        row = c.fetchone()
-        
-        if row:
-            return jsonify({
-                "temperature": row[0] if row[0] is not None else 0.0,
-                "humidity": row[1] if row[1] is not None else 0.0,
-                "pressure": row[2] if row[2] is not None else 0.0,
-                "location": {
-                    "lat": row[3] if row[3] is not None else 0.0,
-                    "lon": row[4] if row[4] is not None else 0.0
-                }
-            })
-    
-    return jsonify({
-        "temperature": 0.0,
-        "humidity": 0.0,
-        "pressure": 0.0,
-        "location": {"lat": 0.0, "lon": 0.0}
-    })
+    try:
+        device = device_arg()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    return jsonify(telemetry_body(device))
 
-# Update /api/logs endpoint
+LOGS_DEFAULT_LIMIT = 300
+LOGS_MAX_LIMIT = 1000
+LOGS_COUNT_LIMIT = 10000
+
+def int_arg(name, default=None, minimum=0, maximum=None):
+    """Read an integer query parameter, raising ValueError with a client-facing message"""
+    value = request.args.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer")
+    if value < minimum or (maximum is not None and value > maximum):
+        raise ValueError(f"{name} must be between {minimum} and {maximum}" if maximum is not None
+                         else f"{name} must be at least {minimum}")
+    return value
+
+# Keyset pagination over the primary key, so every page costs the same
+# however deep it is:
+#   /api/logs                  newest rows first
+#   /api/logs?before_id=N      the next older page (rows with id < N)
+#   /api/logs?since_id=N       rows added after id N, oldest first, for pollers
+# Cursors for the next request come back in X-Next-Before-Id / X-Next-Since-Id.
+# source / device / from / to / filter narrow the rows (see logquery.py), and count=1
+# adds X-Total-Count, capped at LOGS_COUNT_LIMIT to stay cheap.
 @app.route("/api/logs")
+@conditional()
 def api_logs():
-    with sqlite3.connect(DB) as conn:
-        c = conn.cursor()
-        c.execute("""
-            SELECT 
-                id, 
-                timestamp,
-                source,
-                temperature,
-                humidity,
-                pressure,
-                latitude,
-                longitude,
-                gx, gy, gz
-            FROM telemetry 
-            ORDER BY timestamp DESC 
-            LIMIT 300
-        """)
-        logs = c.fetchall()
+    try:
+        limit = int_arg("limit", LOGS_DEFAULT_LIMIT, minimum=1, maximum=LOGS_MAX_LIMIT)
+        since_id = int_arg("since_id")
+        before_id = int_arg("before_id")
+        where, params = build_filters(request.args)
+        bounds = partition_bounds(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    filters = list(where)
+    filter_params = list(params)
+    if since_id is not None:
+        where.append("id > ?")
+        params.append(since_id)
+    if before_id is not None:
+        where.append("id < ?")
+        params.append(before_id)
+    # Pollers walk forward from since_id; everyone else walks back from the newest row
+    ascending = since_id is not None and before_id is None
+
+    conn = db.get_connection()
+    c = conn.cursor()
+    c.execute(f"""
+        SELECT {', '.join(LOG_COLUMNS)}
+        FROM {partitions.source(conn, after_id=since_id, before_id=before_id, **bounds)}
+        {'WHERE ' + ' AND '.join(where) if where else ''}
+        ORDER BY id {'ASC' if ascending else 'DESC'}
+        LIMIT ?
+    """, params + [limit])
+    logs = c.fetchall()
     
-    return jsonify([{
-        "id": row[0],
-        "timestamp": row[1],
-        "source": row[2],
-        "temperature": row[3] if row[3] is not None else "N/A",
-        "humidity": row[4] if row[4] is not None else "N/A",
-        "pressure": row[5] if row[5] is not None else "N/A",
-        "latitude": row[6] if row[6] is not None else "N/A",
-        "longitude": row[7] if row[7] is not None else "N/A",
-        "gx": row[8] if row[8] is not None else "N/A",
-        "gy": row[9] if row[9] is not None else "N/A",
-        "gz": row[10] if row[10] is not None else "N/A"
-    } for row in logs])
+    response = jsonify([log_entry(row) for row in logs])
+    ids = [row[0] for row in logs]
+    newest = max(ids) if ids else since_id
+    if newest is not None:
+        response.headers["X-Next-Since-Id"] = str(newest)
+    if not ascending and len(logs) == limit:
+        response.headers["X-Next-Before-Id"] = str(min(ids))
+    if request.args.get("count") in ("1", "true"):
+        total, exact = count_logs(c, filters, filter_params, partitions.source(conn, **bounds))
+        response.headers["X-Total-Count"] = str(total)
+        response.headers["X-Total-Count-Exact"] = "true" if exact else "false"
+    return response
+
+def count_logs(c, where, params, source="telemetry"):
+    """Matching row count (ignoring cursors) as (count, exact)"""
+    if not where:
+        # Unfiltered: the partition registry keeps exact row counts
+        return partitions.row_count(c.connection), True
+    c.execute(f"""
+        SELECT COUNT(*) FROM (
+            SELECT 1 FROM {source} WHERE {' AND '.join(where)} LIMIT ?
+        )
+    """, params + [LOGS_COUNT_LIMIT + 1])
+    count = c.fetchone()[0]
+    if count > LOGS_COUNT_LIMIT:
+        return LOGS_COUNT_LIMIT, False
+    return count, True
+
+@app.route("/api/ingest/stats")
+def api_ingest_stats():
+    return jsonify(writer.stats())
+
+# Retention policy (seconds per source, null = keep forever) and the
+# partitions currently on disk
+@app.route("/api/retention")
+def api_retention():
+    return jsonify({
+        "policy": {source: us / 1_000_000 for source, us in partitions.RETENTION.items()},
+        "partitions": [{
+            "name": name,
+            "source": source,
+            "day": to_iso(day),
+            "rows": rows,
+            "min_id": min_id,
+            "max_id": max_id,
+            "detached": to_iso(detached),
+        } for name, source, day, rows, min_id, max_id, detached in partitions.listing(db.get_connection())],
+    })
 
 @app.route("/api/gyro")
+@conditional()
 def api_gyro():
-    with sqlite3.connect(DB) as conn:
-        c = conn.cursor()
-        c.execute("""
-            SELECT gx, gy, gz 
-            FROM telemetry 
-            WHERE gx IS NOT NULL AND gy IS NOT NULL AND gz IS NOT NULL
-            ORDER BY timestamp DESC 
-            LIMIT 1
-        """)
-        row = c.fetchone()
-        
-        if row:
-            return jsonify({
-                "roll": row[0],   # gx → roll
-                "pitch": row[1],  # gy → pitch
-                "yaw": row[2]     # gz → yaw
-            })
-    
+    try:
+        device = device_arg()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    return jsonify(gyro_body(device))
+
+# /api/fleet?sort=staleness&order=desc&limit=100&offset=0
+# One row per device: last seen, staleness and the latest value of every
+# channel, sorted by staleness, last_seen, device or any channel and paged
+# server-side. Served from memory (see fleet.py); total is the device count.
+FLEET_DEFAULT_LIMIT = 100
+FLEET_MAX_LIMIT = 1000
+
+@app.route("/api/fleet")
+def api_fleet():
+    try:
+        sort, descending = fleet.parse_sort(request.args.get("sort"), request.args.get("order"))
+        limit = int_arg("limit", FLEET_DEFAULT_LIMIT, minimum=1, maximum=FLEET_MAX_LIMIT)
+        offset = int_arg("offset", 0)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    now = now_us()
+    total, devices = fleet.view.page(sort, descending, offset, limit, now)
     return jsonify({
-        "roll": 0.0,
-        "pitch": 0.0,
-        "yaw": 0.0
+        "now": to_iso(now),
+        "total": total,
+        "sort": sort,
+        "order": "desc" if descending else "asc",
+        "offset": offset,
+        "devices": devices,
+    })
+
+def status_entry(status):
+    """Render a presence.monitor status dict with ISO times"""
+    return dict(status, since=to_iso(status["since"]), last_arrival=to_iso(status["last_arrival"]))
+
+def status_body(limit=None):
+    summary = presence.monitor.summary()
+    summary["offline_devices"] = [status_entry(status) for status in summary["offline_devices"][:limit]]
+    return summary
+
+STATUS_DEFAULT_LIMIT = 1000
+STATUS_MAX_LIMIT = 10000
+
+# /api/status: online / offline device counts and the offline devices,
+# longest offline first (up to ?limit=). /api/status?device=X: one device.
+# A device is offline once nothing arrived for its timeout (see presence.py);
+# transitions are pushed on the stream's "status" channel.
+@app.route("/api/status")
+def api_status():
+    try:
+        device = parse_device(request.args.get("device"))
+        limit = int_arg("limit", STATUS_DEFAULT_LIMIT, minimum=0, maximum=STATUS_MAX_LIMIT)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if device is None:
+        return jsonify(status_body(limit))
+    status = presence.monitor.status(device)
+    if status is None:
+        return jsonify({"error": f"Unknown device: {device}"}), 404
+    return jsonify(status_entry(status))
+
+# ================= Aggregated history =================
+HISTORY_DEFAULT_RANGE = 24 * 3600 * 1_000_000
+HISTORY_DEFAULT_BUCKET = "5m"
+
+def time_arg(name, default=None):
+    """Read a time query parameter (ISO 8601 or epoch seconds) as epoch microseconds"""
+    value = request.args.get(name)
+    if not value:
+        return default
+    try:
+        return parse_time(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO 8601 time or epoch seconds")
+
+# /api/history?from=&to=&bucket=5m&channels=temperature,pressure
+# Per-bucket min/max/mean/count/last for each channel, as parallel arrays
+# (one entry per non-empty bucket). Defaults to the last 24 hours. "rollup"
+# names the rollup table that answered, or is null for a raw-row scan (always
+# the case with ?device=, as rollups are fleet-wide, so a device's range is
+# capped at history.DEVICE_MAX_RANGE, 7 days). A raw-row scan of more than
+# history.MAX_RAW_ROWS rows is refused with 400.
+# max_points=N downsamples each channel with LTTB (see downsample.py); the
+# channels then keep different buckets, so each gets its own "time" list
+# and the top-level one is left out.
+@app.route("/api/history")
+@conditional(pinned="to")
+def api_history():
+    try:
+        to_us = time_arg("to", now_us())
+        from_us = time_arg("from", to_us - HISTORY_DEFAULT_RANGE)
+        bucket_us = parse_duration(request.args.get("bucket") or HISTORY_DEFAULT_BUCKET)
+        channels = history.parse_channels(request.args.get("channels"))
+        device = parse_device(request.args.get("device"))
+        max_points = int_arg("max_points", minimum=3, maximum=history.MAX_BUCKETS)
+        if from_us >= to_us:
+            raise ValueError("from must be before to")
+        limit = history.MAX_BUCKETS if max_points is None else history.MAX_DOWNSAMPLED_BUCKETS
+        from_us, to_us = history.align(from_us, to_us, bucket_us, limit)
+        level, starts, series = history.aggregate(db.get_connection(), from_us, to_us, bucket_us, channels, device)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    body = {
+        "from": to_iso(from_us),
+        "to": to_iso(to_us),
+        "bucket": bucket_us / 1_000_000,
+        "rollup": level,
+    }
+    if max_points is None:
+        body["time"] = [to_iso(start) for start in starts.tolist()]
+    else:
+        series = downsample(starts, series, max_points)
+    body["channels"] = {
+        channel: {
+            stat: [to_iso(start) for start in values.tolist()] if stat == "time" else history.as_list(values)
+            for stat, values in stats.items()
+        }
+        for channel, stats in series.items()
+    }
+    return jsonify(body)
+
+# ================= GPS fixes by area =================
+GEO_DEFAULT_LIMIT = 1000
+GEO_MAX_LIMIT = 10000
+GEO_MAX_K = 1000
+
+def fix_entry(fix):
+    row_id, timestamp, device, lat, lon = fix
+    return {"id": row_id, "timestamp": to_iso(timestamp), "device": device, "lat": lat, "lon": lon}
+
+def float_arg(name, minimum, maximum):
+    """Read a required float query parameter, raising ValueError with a client-facing message"""
+    try:
+        value = float(request.args.get(name, ""))
+    except ValueError:
+        raise ValueError(f"{name} must be a number")
+    if not minimum <= value <= maximum:
+        raise ValueError(f"{name} must be between {minimum} and {maximum}")
+    return value
+
+# /api/geo?bbox=west,south,east,north: the newest fixes inside the box (up
+# to ?limit=), via each partition's R*Tree (see geo.py). from= / to= and
+# device= narrow it; "truncated" says whether more fixes matched.
+@app.route("/api/geo")
+@conditional()
+def api_geo():
+    try:
+        south, west, north, east = geo.parse_bbox(request.args.get("bbox"))
+        limit = int_arg("limit", GEO_DEFAULT_LIMIT, minimum=1, maximum=GEO_MAX_LIMIT)
+        from_us = time_arg("from")
+        to_us = time_arg("to")
+        device = parse_device(request.args.get("device"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    fixes, truncated = geo.bbox(db.get_connection(), south, west, north, east, from_us, to_us, device, limit)
+    return jsonify({"fixes": [fix_entry(fix) for fix in fixes], "truncated": truncated})
+
+# /api/geo/nearest?lat=&lon=&k=5: the k fixes closest to a point (e.g. a
+# map click), closest first, with their great-circle distance in metres
+@app.route("/api/geo/nearest")
+@conditional()
+def api_geo_nearest():
+    try:
+        lat = float_arg("lat", -90, 90)
+        lon = float_arg("lon", -180, 180)
+        k = int_arg("k", 1, minimum=1, maximum=GEO_MAX_K)
+        from_us = time_arg("from")
+        to_us = time_arg("to")
+        device = parse_device(request.args.get("device"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    ranked = geo.nearest(db.get_connection(), lat, lon, k, from_us, to_us, device)
+    return jsonify([dict(fix_entry(fix), distance=round(meters, 1)) for meters, fix in ranked])
+
+# Deepest zoom a map may ask clusters for
+MAP_MAX_ZOOM = 30
+
+# /api/geo/clusters?bbox=west,south,east,north&zoom=z: map markers grouped
+# per 64-pixel cell at zoom z, each {count, lat, lon, first, last} with the
+# centroid and time range of its fixes. Clusters of every zoom are kept up
+# to date on ingest, so this reads just the cells in view (see clusters.py).
+# Deeper zooms than CLUSTER_MAX_ZOOM (16) get its clusters; "zoom" says
+# which zoom's clusters were returned.
+@app.route("/api/geo/clusters")
+@conditional()
+def api_geo_clusters():
+    try:
+        south, west, north, east = geo.parse_bbox(request.args.get("bbox"))
+        zoom = int_arg("zoom", minimum=0, maximum=MAP_MAX_ZOOM)
+        if zoom is None:
+            raise ValueError("zoom is required")
+        zoom, found = clusters.clusters(db.get_connection(), south, west, north, east, zoom)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "zoom": zoom,
+        "clusters": [
+            {"count": count, "lat": lat, "lon": lon, "first": to_iso(first), "last": to_iso(last)}
+            for count, lat, lon, first, last in found
+        ],
+    })
+
+# ================= Ground track =================
+TRACK_DEFAULT_TOLERANCE = 100.0
+TRACK_MAX_TOLERANCE = 1_000_000
+
+# /api/track?from=&to=&tolerance=100: the GPS fixes of a time range (default
+# the last 24 hours), simplified with Douglas-Peucker to within ?tolerance=
+# Web Mercator metres and returned as an encoded polyline (see track.py).
+# ?zoom=z instead uses one pixel at that map zoom as the tolerance, and
+# levels=1 adds "zooms": the lowest zoom each point is needed at, so a map
+# can fetch once at its deepest zoom and filter points as the user zooms.
+# A range holding more than track.MAX_FIXES fixes is refused with 400.
+@app.route("/api/track")
+@conditional(pinned="to")
+def api_track():
+    try:
+        to_us = time_arg("to", now_us())
+        from_us = time_arg("from", to_us - HISTORY_DEFAULT_RANGE)
+        device = parse_device(request.args.get("device"))
+        if from_us >= to_us:
+            raise ValueError("from must be before to")
+        if request.args.get("tolerance"):
+            tolerance = float_arg("tolerance", 0, TRACK_MAX_TOLERANCE)
+        elif request.args.get("zoom"):
+            tolerance = track.pixel_size(int_arg("zoom", minimum=0, maximum=track.MAX_ZOOM))
+        else:
+            tolerance = TRACK_DEFAULT_TOLERANCE
+        total, timestamps, lat, lon, weight = track.simplify(db.get_connection(), from_us, to_us, tolerance, device)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    body = {
+        "from": to_iso(from_us),
+        "to": to_iso(to_us),
+        "tolerance": tolerance,
+        "fixes": total,
+        "points": len(timestamps),
+        "first": to_iso(int(timestamps[0])) if len(timestamps) else None,
+        "last": to_iso(int(timestamps[-1])) if len(timestamps) else None,
+        "polyline": track.encode(lat, lon),
+    }
+    if request.args.get("levels") in ("1", "true"):
+        body["zooms"] = track.min_zooms(weight).tolist()
+    return jsonify(body)
+
+# ================= Heatmap tiles =================
+# /api/tiles/{z}/{x}/{y}: a 256-pixel PNG of how many fixes fell in each
+# 4-pixel cell of a Web Mercator tile, over all data ever stored (usable
+# as a Leaflet tile layer URL). Counts are kept up to date on ingest and
+# rendered tiles cached on disk until new fixes land in them (see heatmap.py).
+@app.route("/api/tiles/<int:z>/<int:x>/<int:y>")
+@conditional()
+def api_tiles(z, x, y):
+    try:
+        png = heatmap.tiles.get(db.get_connection(), z, x, y)
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    return Response(png, mimetype="image/png")
+
+# ================= Bulk export =================
+# /api/export?from=&to=&format=csv|ndjson streams every matching row, oldest
+# first, with no row limit (see export.py). source= and filter= work as in
+# /api/logs; without from/to the whole retained history is exported. The
+# body is gzip-compressed when the client sends Accept-Encoding: gzip
+# (e.g. curl --compressed).
+@app.route("/api/export")
+def api_export():
+    fmt = request.args.get("format") or "csv"
+    if fmt not in export.FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(export.FORMATS)}"}), 400
+    try:
+        where, params = build_filters(request.args)
+        bounds = partition_bounds(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    conn = db.get_connection()
+    chunks = export.ENCODERS[fmt](export.rows(conn, partitions.source(conn, **bounds), where, params))
+    headers = {
+        "Content-Disposition": f"attachment; filename=telemetry.{fmt}",
+        "Vary": "Accept-Encoding",
+        "X-Accel-Buffering": "no",
+    }
+    if "gzip" in request.accept_encodings:
+        chunks = export.gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return Response(stream_with_context(chunks), mimetype=export.FORMATS[fmt], headers=headers)
+
+# ================= Push stream (Server-Sent Events) =================
+TELEMETRY_CHANNELS = ("temperature", "humidity", "pressure", "latitude", "longitude")
+GYRO_CHANNELS = ("gx", "gy", "gz")
+
+def publish_commit(committed):
+    """Ingest listener: turn committed rows into stream events"""
+    events = []
+    telemetry_id = gyro_id = None
+    for row_id, row in committed:
+        events.append((row_id, "log", log_entry((row_id,) + row)))
+        values = dict(zip(COLUMNS, row))
+        if any(values[channel] is not None for channel in TELEMETRY_CHANNELS):
+            telemetry_id = row_id
+        if all(values[channel] is not None for channel in GYRO_CHANNELS):
+            gyro_id = row_id
+    # The snapshot listener has already run, so one event per batch carries the latest state
+    if telemetry_id is not None:
+        events.append((telemetry_id, "telemetry", telemetry_body()))
+    if gyro_id is not None:
+        events.append((gyro_id, "gyro", gyro_body()))
+    events.sort(key=lambda event: event[0])
+    broker.publish(events)
+
+writer.add_listener(publish_commit)
+# Every commit resets its devices' offline deadlines; after publish_commit,
+# so an "online" event follows the row that brought the device back
+writer.add_listener(presence.monitor.apply)
+
+def publish_status(changes):
+    """Presence listener: one "status" event per transition, after the newest row's id"""
+    broker.publish([(None, "status", status_entry(status)) for status in changes])
+
+presence.monitor.add_listener(publish_status)
+
+def missed_log_events(after_id, up_to_id):
+    """Backfill log events the ring buffer no longer holds"""
+    conn = db.get_connection()
+    c = conn.cursor()
+    c.execute(
+        f"SELECT {', '.join(LOG_COLUMNS)} FROM {partitions.source(conn, after_id=after_id, before_id=up_to_id + 1)} "
+        "WHERE id > ? AND id <= ? ORDER BY id LIMIT ?",
+        (after_id, up_to_id, STREAM_RESUME_LIMIT)
+    )
+    rows = c.fetchall()
+    db.release()
+    return [format_event(row[0], "log", log_entry(row)) for row in rows], len(rows) == STREAM_RESUME_LIMIT
+
+# Subscribe with ?channels=telemetry,gyro,log,status (default: all). Reconnecting
+# clients send Last-Event-ID (or ?last_event_id=) to resume where they left off.
+# "status" starts with the /api/status body (counts and offline devices),
+# then sends one {device, status, ...} event per online / offline transition.
+@app.route("/api/stream")
+def api_stream():
+    requested = request.args.get("channels")
+    channels = set(CHANNELS) if not requested else {c.strip() for c in requested.split(",") if c.strip()}
+    if not channels or not channels <= set(CHANNELS):
+        return jsonify({"error": f"channels must be a subset of {', '.join(CHANNELS)}"}), 400
+
+    resume = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    try:
+        after_id = int(resume) if resume else None
+    except ValueError:
+        return jsonify({"error": "Invalid Last-Event-ID"}), 400
+
+    def generate():
+        # Broker positions are (row id, sequence); see stream.py. An id past
+        # the newest one predates a database reset: start from now and tell
+        # the client to refetch, or it would wait for ids to catch up
+        stale = after_id is not None and after_id > broker.last_id
+        last = resume_position(after_id) if after_id is not None and not stale else broker.position
+        yield f"retry: {STREAM_RETRY_MS}\n\n"
+        if stale:
+            yield format_event(last[0], "gap", {"after_id": after_id})
+        # Current state first, so a client never needs a separate initial fetch
+        if "telemetry" in channels:
+            yield format_event(last[0], "telemetry", telemetry_body())
+        if "gyro" in channels:
+            yield format_event(last[0], "gyro", gyro_body())
+        if "status" in channels:
+            yield format_event(last[0], "status", status_body(STATUS_DEFAULT_LIMIT))
+
+        while True:
+            events, position, complete = broker.wait(last, channels)
+            if not complete:
+                # Fell behind the ring buffer: backfill logs from the database
+                # up to where the buffer still reaches
+                target = broker.position
+                if "log" in channels:
+                    backfill, truncated = missed_log_events(last[0], target[0])
+                    if truncated:
+                        yield format_event(target[0], "gap", {"after_id": last[0]})
+                    else:
+                        yield "".join(backfill)
+                if "telemetry" in channels:
+                    yield format_event(target[0], "telemetry", telemetry_body())
+                if "gyro" in channels:
+                    yield format_event(target[0], "gyro", gyro_body())
+                if "status" in channels:
+                    yield format_event(target[0], "status", status_body(STATUS_DEFAULT_LIMIT))
+                last = target
+                continue
+            last = position
+            if not events:
+                yield ": heartbeat\n\n"
+                continue
+            yield "".join(events)
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # keep reverse proxies from buffering the stream
     })
 
 if __name__ == "__main__":
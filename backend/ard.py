@@ -1,15 +1,19 @@
-import requests
 import random
 import time
 import os
 import sys  # Added this import
 from dotenv import load_dotenv
 
+from uploader import Uploader
+
 load_dotenv()
 # Server configuration - with fallback options
 DEFAULT_SERVER = "http://localhost:5000/data"
 SERVER_URL = os.getenv("SERVER_BASE_URL", "http://localhost:5000") + "/data"
-HEADERS = {"Content-Type": "application/json"}
+# Samples wait here until the server has them (see uploader.py)
+OUTBOX = os.path.join(os.getenv("OUTBOX_DIR", "."), "ard_outbox.db")
+# Identifies this node in /api/telemetry?device= and friends; unset = no device
+DEVICE_ID = os.getenv("DEVICE_ID")
 
 def generate_sensor_data():
     """Generates data identical to your LoRa receiver's format"""
@@ -27,35 +31,22 @@ def generate_sensor_data():
         f"MZ:{random.uniform(-0.5, 0.5):.2f}"
     )
 
-def send_to_server(data, server_url):
-    """Improved HTTP POST handling with server URL parameter"""
-    try:
-        response = requests.post(
-            server_url,
-            json={"data": data},
-            headers=HEADERS,
-            timeout=5
-        )
-        print(f"➡️ Data sent to {server_url}: {response.status_code}")
-        return True
-    except Exception as e:
-        print(f"❌ Failed to send to {server_url}: {str(e)}")
-        return False
-
 def loop():
-    """Main loop with fallback server logic"""
+    """Main loop: journal every sample, then forward the backlog"""
+    # Primary server first, then the localhost fallback
+    uploader = Uploader(dict.fromkeys([SERVER_URL + "/batch", DEFAULT_SERVER + "/batch"]), OUTBOX)
     try:
         while True:
             data = generate_sensor_data()
             print(f"Generated: {data}")
             
-            # Try primary server first
-            success = send_to_server(data, SERVER_URL)
-            
-            # If primary fails, try fallback to localhost
-            if not success and SERVER_URL != DEFAULT_SERVER:
-                print(f"⚠️ Trying fallback server: {DEFAULT_SERVER}")
-                send_to_server(data, DEFAULT_SERVER)
+            # The capture time travels with the sample, so frames buffered
+            # during an outage are stored at the right time
+            sent = uploader.submit({"data": data, "timestamp": time.time(), "device": DEVICE_ID})
+            if sent is None:
+                print(f"⏸️ Server unreachable - {uploader.pending()} samples buffered in {OUTBOX}")
+            else:
+                print(f"➡️ Sent {sent} sample(s)")
             
             time.sleep(1)
     except KeyboardInterrupt:
@@ -63,6 +54,7 @@ def loop():
     except Exception as e:
         print(f"\n⚠️ Unexpected error: {str(e)}")
     finally:
+        uploader.close()
         print("⭕ Simulation session ended")
         sys.exit(0)
 
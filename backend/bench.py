@@ -0,0 +1,497 @@
+"""Ingest micro-benchmarks for the Flask backend.
+
+Runs against a throwaway SQLite file through Flask's test client, so no
+server needs to be running:
+
+    python bench.py ingest --frames 2000 --batch-size 200
+    python bench.py parse --frames 10000
+    python bench.py connect --rows 20000 --queries 500
+    python bench.py queue --threads 16 --frames 4000
+    python bench.py latest --sizes 10000,100000,1000000
+    python bench.py logs --sizes 100000,1000000
+    python bench.py history --rows 1000000
+    python bench.py export --rows 1000000
+    python bench.py fleet --devices 10000
+    python bench.py geo --rows 2000000
+"""
+import argparse
+import os
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import app as backend
+import clusters
+import db
+import heatmap
+import partitions
+import rollup
+import snapshot
+from ingest import make_row, writer
+from snapshot import latest
+from ard import generate_sensor_data
+from lora import parse_frame
+from timeutil import now_us
+
+
+def use_temp_db():
+    """Point the app at a fresh database file and return its path"""
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    drop_temp_db(path)
+    db.configure(path=path)
+    backend.init_db()
+    return path
+
+
+def drop_temp_db(path):
+    """Close pooled connections and delete the database with its WAL files"""
+    db.release()
+    db.configure()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def report(label, count, elapsed):
+    print(f"{label:<28} {count:>7} frames  {elapsed:8.3f}s  {count / elapsed:10.0f} frames/s")
+
+
+def bench_ingest(args):
+    """Compare one-frame-per-POST /data against /data/batch"""
+    frames = [generate_sensor_data() for _ in range(args.frames)]
+    client = backend.app.test_client()
+
+    path = use_temp_db()
+    start = time.perf_counter()
+    for frame in frames:
+        client.post("/data", json={"data": frame})
+    report("/data (1 frame/request)", len(frames), time.perf_counter() - start)
+    drop_temp_db(path)
+
+    path = use_temp_db()
+    start = time.perf_counter()
+    for i in range(0, len(frames), args.batch_size):
+        client.post("/data/batch", json=frames[i:i + args.batch_size])
+    report(f"/data/batch ({args.batch_size}/request)", len(frames), time.perf_counter() - start)
+    drop_temp_db(path)
+
+
+def legacy_parse(data):
+    """The original /data parsing: four independent regex scans, gyro + pressure only"""
+    pressure_match = re.search(r"P:([\d.]+)hPa", data)
+    gx_match = re.search(r"GX:([\d.-]+)", data)
+    gy_match = re.search(r"GY:([\d.-]+)", data)
+    gz_match = re.search(r"GZ:([\d.-]+)", data)
+    return (
+        float(pressure_match.group(1)) if pressure_match else None,
+        float(gx_match.group(1)) if gx_match else None,
+        float(gy_match.group(1)) if gy_match else None,
+        float(gz_match.group(1)) if gz_match else None,
+    )
+
+
+def bench_parse(args):
+    """Per-frame cost of lora.parse_frame next to the legacy regex scans"""
+    frames = [generate_sensor_data() for _ in range(args.frames)]
+    for label, parse in (("legacy re.search x4 (4 ch)", legacy_parse),
+                         ("lora.parse_frame (11 ch)", parse_frame)):
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            for frame in frames:
+                parse(frame)
+            best = min(best, time.perf_counter() - start)
+        print(f"{label:<28} {best / len(frames) * 1e6:8.2f} us/frame")
+
+
+# The read queries behind /api/telemetry, /api/logs and /api/gyro
+READ_QUERIES = {
+    # The ORDER BY column is selected too, so SQLite can merge the partitions
+    "telemetry": """
+        SELECT
+            (SELECT temperature FROM (SELECT timestamp, temperature FROM telemetry
+                WHERE temperature IS NOT NULL ORDER BY timestamp DESC LIMIT 1)),
+            (SELECT humidity FROM (SELECT timestamp, humidity FROM telemetry
+                WHERE humidity IS NOT NULL ORDER BY timestamp DESC LIMIT 1)),
+            (SELECT pressure FROM (SELECT timestamp, pressure FROM telemetry
+                WHERE pressure IS NOT NULL ORDER BY timestamp DESC LIMIT 1))
+    """,
+    "location": """
+        SELECT timestamp, latitude, longitude FROM telemetry
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+        ORDER BY timestamp DESC LIMIT 1
+    """,
+    "logs": "SELECT * FROM telemetry ORDER BY timestamp DESC LIMIT 300",
+    "gyro": """
+        SELECT timestamp, gx, gy, gz FROM telemetry
+        WHERE gx IS NOT NULL AND gy IS NOT NULL AND gz IS NOT NULL
+        ORDER BY timestamp DESC LIMIT 1
+    """,
+}
+
+
+def fill_synthetic(count, start_us=1_700_000_000_000_000, step_us=500_000):
+    """Insert count alternating arduino/GPS rows directly, bypassing HTTP"""
+    conn = db.get_connection()
+    rng = random.Random(42)
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        for base in range(0, count, 50000):
+            rows = []
+            for i in range(base, min(count, base + 50000)):
+                ts = start_us + i * step_us
+                if i % 2:
+                    rows.append(make_row(ts, "GPS", temperature=rng.uniform(20, 35),
+                                         humidity=rng.uniform(30, 80),
+                                         latitude=rng.uniform(0, 50), longitude=rng.uniform(5, 80)))
+                else:
+                    rows.append(make_row(ts, "arduino", temperature=rng.uniform(15, 35),
+                                         pressure=rng.uniform(500, 1500), gx=rng.uniform(-90, 90),
+                                         gy=rng.uniform(-180, 180), gz=rng.uniform(-180, 180)))
+            partitions.insert(conn, rows)
+            rollup.apply(conn, rows)
+            snapshot.store(conn, rows)
+            heatmap.apply(conn, rows)
+            clusters.apply(conn, rows)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def bench_connect(args):
+    """Per-request latency: sqlite3.connect per call vs pooled WAL connections"""
+    path = use_temp_db()
+    client = backend.app.test_client()
+    frames = [generate_sensor_data() for _ in range(args.rows)]
+    for i in range(0, len(frames), 1000):
+        client.post("/data/batch", json=frames[i:i + 1000])
+
+    def per_call(sql):
+        with sqlite3.connect(path) as conn:
+            conn.execute(sql).fetchall()
+        conn.close()
+
+    def pooled(sql):
+        db.get_connection().execute(sql).fetchall()
+        db.release()
+
+    for name, sql in READ_QUERIES.items():
+        for label, run in (("connect per call", per_call), ("pooled", pooled)):
+            samples = []
+            for _ in range(args.queries):
+                start = time.perf_counter()
+                run(sql)
+                samples.append((time.perf_counter() - start) * 1e6)
+            print(f"{name:<10} {label:<17} p50 {percentile(samples, 50):8.1f} us"
+                  f"   p99 {percentile(samples, 99):8.1f} us")
+    drop_temp_db(path)
+
+
+def bench_latest(args):
+    """Latest-value query latency as the table grows"""
+    path = use_temp_db()
+    filled = 0
+    for size in sorted(int(s) for s in args.sizes.split(",")):
+        fill_synthetic(size - filled, start_us=1_700_000_000_000_000 + filled * 500_000)
+        filled = size
+        conn = db.get_connection()
+        for name in ("telemetry", "location", "gyro"):
+            samples = []
+            for _ in range(args.queries):
+                start = time.perf_counter()
+                conn.execute(READ_QUERIES[name]).fetchall()
+                samples.append((time.perf_counter() - start) * 1e6)
+            print(f"{size:>10} rows  {name:<10} p50 {percentile(samples, 50):8.1f} us"
+                  f"   p99 {percentile(samples, 99):8.1f} us")
+        latest.seed(conn)
+        samples = []
+        for _ in range(args.queries):
+            start = time.perf_counter()
+            for group in ("temperature", "humidity", "pressure", "location", "gyro"):
+                latest.get(group)
+            samples.append((time.perf_counter() - start) * 1e6)
+        print(f"{size:>10} rows  {'snapshot':<10} p50 {percentile(samples, 50):8.1f} us"
+              f"   p99 {percentile(samples, 99):8.1f} us")
+    drop_temp_db(path)
+
+
+# Representative /api/logs requests; times are relative to the newest row
+LOG_REQUESTS = (
+    "/api/logs",
+    "/api/logs?before_id={mid}",
+    "/api/logs?since_id={recent}",
+    "/api/logs?source=GPS",
+    "/api/logs?source=arduino&filter=pressure<800",
+    "/api/logs?filter=pressure<510",
+    "/api/logs?from={hour_ago}&to={end}",
+    "/api/logs?from={day_ago}&to={half_day_ago}&source=GPS",
+    "/api/logs?source=GPS&count=1",
+)
+
+
+def bench_logs(args):
+    """/api/logs latency for cursor and filter combinations as the table grows"""
+    path = use_temp_db()
+    client = backend.app.test_client()
+    start_us = 1_700_000_000_000_000
+    filled = 0
+    for size in sorted(int(s) for s in args.sizes.split(",")):
+        fill_synthetic(size - filled, start_us=start_us + filled * 500_000)
+        filled = size
+        end = (start_us + size * 500_000) / 1e6
+        values = {"mid": size // 2, "recent": size - 50, "end": end, "hour_ago": end - 3600,
+                  "day_ago": end - 86400, "half_day_ago": end - 43200}
+        for template in LOG_REQUESTS:
+            url = template.format(**values)
+            samples = []
+            for _ in range(args.queries):
+                t0 = time.perf_counter()
+                response = client.get(url)
+                samples.append((time.perf_counter() - t0) * 1e3)
+            assert response.status_code == 200, response.json
+            print(f"{size:>10} rows  p50 {percentile(samples, 50):7.2f} ms  p99 {percentile(samples, 99):7.2f} ms"
+                  f"  {len(response.json):>4} rows  {template}")
+    drop_temp_db(path)
+
+
+HISTORY_REQUESTS = (
+    "/api/history?from={hour_ago}&to={end}&bucket=1m",
+    "/api/history?from={day_ago}&to={end}&bucket=5m",
+    "/api/history?from={day_ago}&to={end}&bucket=5m&channels=temperature,pressure",
+    "/api/history?from={week_ago}&to={end}&bucket=1h",
+    "/api/history?from={day_ago}&to={end}&bucket=1s&channels=temperature,pressure&max_points=300",
+)
+
+
+def bench_history(args):
+    """/api/history aggregation latency for a few ranges and bucket sizes"""
+    path = use_temp_db()
+    client = backend.app.test_client()
+    start_us = 1_700_000_000_000_000
+    fill_synthetic(args.rows, start_us=start_us)
+    end = (start_us + args.rows * 500_000) / 1e6
+    values = {"end": end, "hour_ago": end - 3600, "day_ago": end - 86400, "week_ago": end - 7 * 86400}
+    for template in HISTORY_REQUESTS:
+        url = template.format(**values)
+        samples = []
+        for _ in range(args.queries):
+            t0 = time.perf_counter()
+            response = client.get(url)
+            samples.append((time.perf_counter() - t0) * 1e3)
+        assert response.status_code == 200, response.json
+        body = response.json
+        # Downsampled responses carry a time list per channel instead
+        points = len(body["time"]) if "time" in body else max(
+            len(stats["time"]) for stats in body["channels"].values())
+        print(f"p50 {percentile(samples, 50):8.2f} ms  p99 {percentile(samples, 99):8.2f} ms"
+              f"  {points:>5} points  {len(response.get_data()):>8} bytes  {template}")
+    drop_temp_db(path)
+
+
+EXPORT_REQUESTS = (
+    ("/api/export?format=csv", {}),
+    ("/api/export?format=ndjson", {}),
+    ("/api/export?format=csv", {"Accept-Encoding": "gzip"}),
+    ("/api/export?format=csv&source=GPS&filter=temperature>30", {}),
+)
+
+
+def bench_export(args):
+    """/api/export throughput and peak Python memory while streaming"""
+    path = use_temp_db()
+    client = backend.app.test_client()
+    fill_synthetic(args.rows)
+
+    def stream(url, headers):
+        response = client.get(url, headers=headers, buffered=False)
+        size = sum(len(data) for data in response.response)
+        response.close()
+        return size
+
+    for url, headers in EXPORT_REQUESTS:
+        t0 = time.perf_counter()
+        size = stream(url, headers)
+        elapsed = time.perf_counter() - t0
+        # Second, traced pass: tracemalloc slows everything down too much to time
+        tracemalloc.start()
+        stream(url, headers)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        label = url + (" (gzip)" if headers else "")
+        print(f"{elapsed:7.2f}s  {size / 1e6:8.1f} MB  {size / 1e6 / elapsed:6.1f} MB/s"
+              f"  peak {peak / 1e6:6.1f} MB  {label}")
+    drop_temp_db(path)
+
+
+# /api/fleet requests; the first after a commit sorts, repeats hit the cache
+FLEET_REQUESTS = (
+    "/api/fleet",
+    "/api/fleet?sort=temperature&order=desc",
+    "/api/fleet?sort=device&offset=5000",
+)
+
+
+def bench_fleet(args):
+    """/api/fleet latency with many devices, right after a commit and cached"""
+    path = use_temp_db()
+    client = backend.app.test_client()
+    rng = random.Random(42)
+    now = now_us()
+
+    def commit():
+        # One sample from a few random devices, as a busy fleet commits
+        writer.write([make_row(now, "GPS", f"sat-{rng.randrange(args.devices)}",
+                               temperature=rng.uniform(20, 35)) for _ in range(10)])
+
+    writer.write([make_row(now - rng.randrange(3600_000_000), "GPS", f"sat-{i}",
+                           temperature=rng.uniform(20, 35), humidity=rng.uniform(30, 80),
+                           latitude=rng.uniform(0, 50), longitude=rng.uniform(5, 80))
+                  for i in range(args.devices)])
+    for url in FLEET_REQUESTS:
+        cold = []
+        warm = []
+        for _ in range(args.queries):
+            commit()
+            start = time.perf_counter()
+            client.get(url)
+            cold.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            client.get(url)
+            warm.append((time.perf_counter() - start) * 1000)
+        print(f"{args.devices} devices  after commit p50 {percentile(cold, 50):6.2f} ms"
+              f"  p99 {percentile(cold, 99):6.2f} ms   cached p50 {percentile(warm, 50):6.2f} ms  {url}")
+    drop_temp_db(path)
+
+
+# Spatial queries over the synthetic fixes (uniform over lat 0..50, lon 5..80)
+GEO_REQUESTS = (
+    "/api/geo?bbox=10,10,10.5,10.5",
+    "/api/geo?bbox=10,10,20,20",
+    "/api/geo?bbox=5,0,80,50",
+    "/api/geo?bbox=10,10,20,20&from={hour_ago}",
+    "/api/geo/nearest?lat=25&lon=40&k=1",
+    "/api/geo/nearest?lat=25&lon=40&k=100",
+    "/api/geo/nearest?lat=-40&lon=-100&k=5",
+)
+
+
+def bench_geo(args):
+    """/api/geo bbox and nearest-fix latency at millions of fixes"""
+    path = use_temp_db()
+    client = backend.app.test_client()
+    start_us = 1_700_000_000_000_000
+    start = time.perf_counter()
+    fill_synthetic(args.rows, start_us=start_us)
+    print(f"filled {args.rows} rows ({args.rows // 2} fixes) in {time.perf_counter() - start:.1f}s")
+    hour_ago = (start_us + args.rows * 500_000) / 1e6 - 3600
+    for template in GEO_REQUESTS:
+        url = template.format(hour_ago=hour_ago)
+        samples = []
+        for _ in range(args.queries):
+            start = time.perf_counter()
+            response = client.get(url)
+            samples.append((time.perf_counter() - start) * 1000)
+        body = response.get_json()
+        found = len(body["fixes"] if isinstance(body, dict) else body)
+        print(f"p50 {percentile(samples, 50):8.2f} ms  p99 {percentile(samples, 99):8.2f} ms"
+              f"  {found:>5} fixes  {url}")
+    drop_temp_db(path)
+
+
+def bench_queue(args):
+    """Concurrent /data posts: synchronous commits vs the write-behind queue"""
+    frames = [generate_sensor_data() for _ in range(args.frames)]
+    per_thread = [frames[i::args.threads] for i in range(args.threads)]
+
+    def post_all(chunk, errors):
+        client = backend.app.test_client()
+        for frame in chunk:
+            if client.post("/data", json={"data": frame}).status_code != 200:
+                errors.append(frame)
+
+    for mode, durability in (("sync", "commit"), ("queue", "commit"), ("queue", "enqueue")):
+        path = use_temp_db()
+        writer.configure(mode=mode, durability=durability)
+        errors = []
+        threads = [threading.Thread(target=post_all, args=(chunk, errors)) for chunk in per_thread]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.stop()
+        elapsed = time.perf_counter() - start
+        stats = writer.stats()
+        report(f"{mode}/{durability}", len(frames), elapsed)
+        print(f"{'':<28} errors {len(errors)}  flushes {stats['flushes']}"
+              f"  avg flush {stats['avg_flush_ms']} ms  max latency {stats['max_commit_latency_ms']} ms")
+        drop_temp_db(path)
+    writer.configure()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    ingest = sub.add_parser("ingest", help=bench_ingest.__doc__)
+    ingest.add_argument("--frames", type=int, default=2000)
+    ingest.add_argument("--batch-size", type=int, default=200)
+    ingest.set_defaults(func=bench_ingest)
+
+    parse = sub.add_parser("parse", help=bench_parse.__doc__)
+    parse.add_argument("--frames", type=int, default=10000)
+    parse.add_argument("--repeat", type=int, default=5)
+    parse.set_defaults(func=bench_parse)
+
+    connect = sub.add_parser("connect", help=bench_connect.__doc__)
+    connect.add_argument("--rows", type=int, default=20000)
+    connect.add_argument("--queries", type=int, default=500)
+    connect.set_defaults(func=bench_connect)
+
+    queue = sub.add_parser("queue", help=bench_queue.__doc__)
+    queue.add_argument("--threads", type=int, default=16)
+    queue.add_argument("--frames", type=int, default=4000)
+    queue.set_defaults(func=bench_queue)
+
+    latest = sub.add_parser("latest", help=bench_latest.__doc__)
+    latest.add_argument("--sizes", default="10000,100000,1000000")
+    latest.add_argument("--queries", type=int, default=200)
+    latest.set_defaults(func=bench_latest)
+
+    logs = sub.add_parser("logs", help=bench_logs.__doc__)
+    logs.add_argument("--sizes", default="100000,1000000")
+    logs.add_argument("--queries", type=int, default=20)
+    logs.set_defaults(func=bench_logs)
+
+    history = sub.add_parser("history", help=bench_history.__doc__)
+    history.add_argument("--rows", type=int, default=1_000_000)
+    history.add_argument("--queries", type=int, default=5)
+    history.set_defaults(func=bench_history)
+
+    export = sub.add_parser("export", help=bench_export.__doc__)
+    export.add_argument("--rows", type=int, default=1_000_000)
+    export.set_defaults(func=bench_export)
+
+    fleet = sub.add_parser("fleet", help=bench_fleet.__doc__)
+    fleet.add_argument("--devices", type=int, default=10000)
+    fleet.add_argument("--queries", type=int, default=50)
+    fleet.set_defaults(func=bench_fleet)
+
+    geo = sub.add_parser("geo", help=bench_geo.__doc__)
+    geo.add_argument("--rows", type=int, default=2_000_000)
+    geo.add_argument("--queries", type=int, default=20)
+    geo.set_defaults(func=bench_geo)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Zoom-dependent clusters of GPS fixes for map markers.
+
+At every zoom 0..CLUSTER_MAX_ZOOM the Web Mercator map is cut into square
+cells of CLUSTER_CELL_PX screen pixels, and geo_clusters
+(schema.GEO_CLUSTERS) keeps one cluster per cell that holds fixes: their
+count, the sums of their latitudes and longitudes (the centroid) and their
+first and last timestamps. The cells of zoom z + 1 split those of zoom z in
+four, so the levels form a quadtree. Like the rollups, the ingest writer
+calls ``apply()`` in the transaction that inserts the rows and each touched
+cluster is merged with an UPSERT; they outlive the raw rows.
+
+A cell id is ``row << (zoom + bits) | column``, so the cells of a bbox are
+one key range per grid row, and a request reads exactly the clusters in
+view through the primary key, however many fixes they hold. Ingest keeps
+longitudes within -180..180 (ingest.check_position) and a fix at 180
+counts as -180, the cell it falls in, so cells never cross the
+antimeridian and plain means are valid centroids.
+"""
+import os
+
+import numpy as np
+
+import geo
+from schema import COLUMNS
+
+CLUSTER_MAX_ZOOM = int(os.getenv("CLUSTER_MAX_ZOOM", "16"))
+# Cell size in screen pixels: a 256-pixel tile holds 4 x 4 cells
+CLUSTER_CELL_PX = 64
+_TILE_BITS = 2  # log2(256 / CLUSTER_CELL_PX)
+# Most cells one request may cover, several screens' worth
+MAX_CELLS = 16384
+
+_TIMESTAMP = COLUMNS.index("timestamp")
+_LATITUDE = COLUMNS.index("latitude")
+_LONGITUDE = COLUMNS.index("longitude")
+_ZOOMS = np.arange(CLUSTER_MAX_ZOOM + 1, dtype=np.int64)
+
+_UPSERT = (
+    "INSERT INTO geo_clusters (zoom, cell, count, lat_sum, lon_sum, first_ts, last_ts) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(zoom, cell) DO UPDATE SET "
+    "count = count + excluded.count, "
+    "lat_sum = lat_sum + excluded.lat_sum, "
+    "lon_sum = lon_sum + excluded.lon_sum, "
+    "first_ts = min(first_ts, excluded.first_ts), "
+    "last_ts = max(last_ts, excluded.last_ts)"
+)
+
+
+def _side(zoom):
+    """Cells per side of the map at a zoom"""
+    return 1 << (zoom + _TILE_BITS)
+
+
+def _partials(fixes):
+    """[(zoom, cell, count, lat_sum, lon_sum, first_ts, last_ts)] of (timestamp, lat, lon) triples"""
+    if not fixes:
+        return []
+    timestamps = [fix[0] for fix in fixes]
+    lat = np.array([fix[1] for fix in fixes], dtype=np.float64)
+    lon = np.array([fix[2] for fix in fixes], dtype=np.float64)
+    # 180 is the western edge of the first column, as -180
+    lon[lon >= 180.0] -= 360.0
+    u, v = geo.mercator(lat, lon)
+    # One row per zoom, one column per fix
+    side = _side(0) << _ZOOMS[:, None]
+    cells = ((v * side).astype(np.int64) * side + (u * side).astype(np.int64)).tolist()
+    lat = lat.tolist()
+    lon = lon.tolist()
+    partials = {}
+    for zoom, row in enumerate(cells):
+        for i, cell in enumerate(row):
+            acc = partials.get((zoom, cell))
+            if acc is None:
+                partials[zoom, cell] = [1, lat[i], lon[i], timestamps[i], timestamps[i]]
+            else:
+                acc[0] += 1
+                acc[1] += lat[i]
+                acc[2] += lon[i]
+                if timestamps[i] < acc[3]:
+                    acc[3] = timestamps[i]
+                if timestamps[i] > acc[4]:
+                    acc[4] = timestamps[i]
+    return [(zoom, cell, *acc) for (zoom, cell), acc in partials.items()]
+
+
+def apply(conn, rows):
+    """Ingest transaction hook: merge the fixes of make_row tuples into geo_clusters"""
+    fixes = [
+        (row[_TIMESTAMP], row[_LATITUDE], row[_LONGITUDE]) for row in rows
+        if row[_LATITUDE] is not None and row[_LONGITUDE] is not None
+    ]
+    conn.executemany(_UPSERT, _partials(fixes))
+
+
+def rebuild(conn, chunk=65536):
+    """Recompute geo_clusters from telemetry; runs in the caller's transaction"""
+    conn.execute("DELETE FROM geo_clusters")
+    cursor = conn.execute(
+        "SELECT timestamp, latitude, longitude FROM telemetry "
+        "WHERE latitude IS NOT NULL AND longitude IS NOT NULL"
+    )
+    while True:
+        fixes = cursor.fetchmany(chunk)
+        if not fixes:
+            break
+        conn.executemany(_UPSERT, _partials(fixes))
+
+
+def _columns(west, east, side):
+    """Ranges of cell columns covering west..east (split at the antimeridian)"""
+    first, last = (min(side - 1, int((lon + 180.0) / 360.0 * side)) for lon in (west, east))
+    return [(first, last)] if west <= east else [(first, side - 1), (0, last)]
+
+
+def clusters(conn, south, west, north, east, zoom):
+    """Clusters of the cells overlapping the box at a zoom (clamped to CLUSTER_MAX_ZOOM).
+
+    Returns (zoom used, [(count, lat, lon, first_ts, last_ts)]), raising
+    ValueError if the box covers more than MAX_CELLS cells.
+    """
+    zoom = min(zoom, CLUSTER_MAX_ZOOM)
+    side = _side(zoom)
+    _, v = geo.mercator(np.array([north, south]), np.zeros(2))
+    top, bottom = int(v[0] * side), int(v[1] * side)
+    columns = _columns(west, east, side)
+    if (bottom - top + 1) * sum(last - first + 1 for first, last in columns) > MAX_CELLS:
+        raise ValueError(f"bbox covers more than {MAX_CELLS} cells at zoom {zoom}; zoom in or shrink it")
+    found = []
+    for row in range(top, bottom + 1):
+        for first, last in columns:
+            found += conn.execute(
+                "SELECT count, lat_sum / count, lon_sum / count, first_ts, last_ts FROM geo_clusters "
+                "WHERE zoom = ? AND cell BETWEEN ? AND ?",
+                (zoom, row * side + first, row * side + last),
+            ).fetchall()
+    return zoom, found
@@ -0,0 +1,116 @@
+"""SQLite connection management for the backend.
+
+Opening a connection per request pays the file open, schema parse and PRAGMA
+setup every time. Instead each worker thread gets a long-lived connection
+from ``get_connection()``; when a request finishes ``release()`` hands it back
+to a small idle pool so the next request (on any thread) reuses it. Threads
+that never call ``release()`` (e.g. background writers) simply keep theirs.
+
+Connections run in WAL mode so readers are never blocked by an ingest commit.
+Tuning comes from the environment (or ``backend/.env``):
+
+    TELEMETRY_DB          database file           (telemetry.db)
+    SQLITE_SYNCHRONOUS    OFF | NORMAL | FULL     (NORMAL)
+    SQLITE_CACHE_SIZE     pages, or -KiB          (-65536, i.e. 64 MiB)
+    SQLITE_MMAP_SIZE      bytes                   (268435456)
+    SQLITE_BUSY_TIMEOUT   milliseconds            (5000)
+    SQLITE_POOL_SIZE      idle connections kept   (8)
+"""
+import os
+import sqlite3
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DB = os.getenv("TELEMETRY_DB", "telemetry.db")
+
+SETTINGS = {
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper(),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000")),
+    "pool_size": int(os.getenv("SQLITE_POOL_SIZE", "8")),
+}
+
+_SYNCHRONOUS = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+_local = threading.local()
+_lock = threading.Lock()
+_idle = []
+_generation = 0
+
+
+def configure(path=None, **settings):
+    """Change the database file and/or PRAGMA settings.
+
+    Idle pooled connections are closed; connections currently held by a
+    thread are replaced the next time that thread asks for one.
+    """
+    global DB, _generation
+    unknown = set(settings) - set(SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown settings: {', '.join(sorted(unknown))}")
+    with _lock:
+        if path is not None:
+            DB = path
+        SETTINGS.update(settings)
+        _generation += 1
+        idle = _idle[:]
+        _idle.clear()
+    for conn, _ in idle:
+        conn.close()
+
+
+def connect():
+    """Open a new connection with the configured PRAGMAs applied"""
+    synchronous = SETTINGS["synchronous"]
+    if synchronous not in _SYNCHRONOUS:
+        raise ValueError(f"Invalid SQLITE_SYNCHRONOUS: {synchronous}")
+
+    conn = sqlite3.connect(DB, timeout=SETTINGS["busy_timeout"] / 1000, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={synchronous}")
+    conn.execute(f"PRAGMA cache_size={int(SETTINGS['cache_size'])}")
+    conn.execute(f"PRAGMA mmap_size={int(SETTINGS['mmap_size'])}")
+    conn.execute(f"PRAGMA busy_timeout={int(SETTINGS['busy_timeout'])}")
+    return conn
+
+
+def get_connection():
+    """Return this thread's connection, checking one out of the pool if needed"""
+    held = getattr(_local, "conn", None)
+    if held is not None and held[1] == _generation:
+        return held[0]
+    if held is not None:
+        held[0].close()
+
+    with _lock:
+        entry = None
+        while _idle and entry is None:
+            candidate = _idle.pop()
+            if candidate[1] == _generation:
+                entry = candidate
+            else:
+                candidate[0].close()
+        generation = _generation
+    if entry is None:
+        entry = (connect(), generation)
+    _local.conn = entry
+    return entry[0]
+
+
+def release():
+    """Return this thread's connection to the idle pool (no-op if it has none)"""
+    held = _local.__dict__.pop("conn", None)
+    if held is None:
+        return
+    conn, generation = held
+    if conn.in_transaction:
+        conn.rollback()
+    with _lock:
+        if generation == _generation and len(_idle) < SETTINGS["pool_size"]:
+            _idle.append(held)
+            return
+    conn.close()
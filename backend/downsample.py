@@ -0,0 +1,61 @@
+"""Point-budget downsampling for chart series.
+
+Largest-Triangle-Three-Buckets (Steinarsson, 2013) keeps the first and last
+points and, from each of ``n_out - 2`` equal-width buckets in between, the
+point forming the largest triangle with the point kept from the previous
+bucket and the average of the next one. Peaks and troughs survive because
+they make large triangles.
+
+Choosing a bucket's point depends on the previous choice, so the loop over
+buckets stays; everything inside a bucket, and the bucket averages, are
+computed with NumPy.
+"""
+import numpy as np
+
+
+def lttb(x, y, n_out):
+    """Indices of the ``n_out`` points LTTB keeps from the series (x, y)"""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64) - x[0]
+    y = np.asarray(y, dtype=np.float64)
+
+    # Interior points 1 .. n-2 split into n_out - 2 buckets: [edges[k], edges[k + 1])
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[:n - 1], edges[:-1]) / counts
+    avg_y = np.add.reduceat(y[:n - 1], edges[:-1]) / counts
+    # Third vertex for bucket k: the next bucket's average, or the last point
+    next_x = np.append(avg_x[1:], x[-1])
+    next_y = np.append(avg_y[1:], y[-1])
+
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+    a = 0
+    for k in range(n_out - 2):
+        lo, hi = edges[k], edges[k + 1]
+        ax, ay = x[a], y[a]
+        # Twice the triangle area; the constant factor doesn't change the argmax
+        area = np.abs((ax - next_x[k]) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (next_y[k] - ay))
+        a = lo + int(area.argmax())
+        keep[k + 1] = a
+    return keep
+
+
+def downsample(starts, series, n_out, key="mean"):
+    """LTTB each channel of a history.aggregate() result to at most n_out points.
+
+    Points are chosen on the ``key`` stat and every stat is kept at the
+    chosen buckets. Channels end up with different buckets, so each one
+    gets its own ``time`` array (bucket starts) alongside its stats.
+    """
+    x = starts.astype(np.float64)
+    out = {}
+    for channel, stats in series.items():
+        present = np.flatnonzero(~np.isnan(stats[key]))
+        chosen = present[lttb(x[present], stats[key][present], n_out)]
+        out[channel] = {stat: values[chosen] for stat, values in stats.items()}
+        out[channel]["time"] = starts[chosen]
+    return out
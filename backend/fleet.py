@@ -0,0 +1,118 @@
+"""Fleet overview: every device's latest state, sorted and paged in memory.
+
+``/api/fleet`` is answered from the per-device state that
+snapshot.LatestValues keeps up to date on every commit, so SQLite is never
+read and no query groups the raw rows. Sorting 10k devices takes a few
+milliseconds; the sorted order is cached until the next commit changes the
+state, so paging through the table or many dashboards polling it cost one
+sort per commit rather than one per request.
+
+Sort keys:
+
+    staleness     time since the device's newest row (descending = stalest first)
+    last_seen     timestamp of the device's newest row
+    device        device id
+    <channel>     latest value of a channel (schema.CHANNELS); devices that
+                  never reported it come last in either order
+
+Ties are broken by device id.
+"""
+import threading
+
+from schema import CHANNELS
+from snapshot import GROUPS, latest
+from timeutil import to_iso
+
+SORT_KEYS = ("staleness", "last_seen", "device") + CHANNELS
+
+# Channel -> (group, position in the group's values)
+_CHANNEL_GROUPS = {
+    column: (group, i) for group, columns in GROUPS.items() for i, column in enumerate(columns)
+}
+
+
+def parse_sort(sort, order):
+    """(key, descending) for ?sort=&order=, raising ValueError if invalid.
+
+    Staleness defaults to descending (stalest first), everything else to ascending.
+    """
+    sort = sort or "staleness"
+    if sort not in SORT_KEYS:
+        raise ValueError(f"sort must be one of: {', '.join(SORT_KEYS)}")
+    if order not in (None, "", "asc", "desc"):
+        raise ValueError("order must be asc or desc")
+    descending = order == "desc" if order else sort == "staleness"
+    return sort, descending
+
+
+class FleetView:
+    def __init__(self, state):
+        self._state = state
+        self._lock = threading.Lock()
+        self._version = None
+        self._orders = {}  # (sort, descending) -> device ids, for _version
+
+    def page(self, sort, descending, offset, limit, now):
+        """(total devices, entries offset..offset+limit in the requested order)"""
+        order = self._order(sort, descending)
+        # Rows show the current state even if a commit landed after the sort
+        return len(order), [
+            entry(device, *self._state.device_state(device), now)
+            for device in order[offset:offset + limit]
+        ]
+
+    def _order(self, sort, descending):
+        with self._lock:
+            if self._state.version == self._version:
+                order = self._orders.get((sort, descending))
+                if order is not None:
+                    return order
+        version, seen, devices = self._state.fleet()
+        with self._lock:
+            if version != self._version:
+                self._version = version
+                self._orders = {}
+            # Sorting by id first makes it the tie-breaker of the (stable) sorts below
+            by_id = self._orders.get(("device", False))
+        if by_id is None:
+            by_id = sorted(seen)
+        order = self._sort(by_id, seen, devices, sort, descending)
+        with self._lock:
+            if version == self._version:
+                self._orders["device", False] = by_id
+                self._orders[sort, descending] = order
+        return order
+
+    @staticmethod
+    def _sort(by_id, seen, devices, sort, descending):
+        if sort == "device":
+            return by_id[::-1] if descending else by_id
+        if sort in ("staleness", "last_seen"):
+            # Stalest first is oldest last_seen first
+            return sorted(by_id, key=seen.__getitem__, reverse=descending != (sort == "staleness"))
+        group, i = _CHANNEL_GROUPS[sort]
+        values = {}
+        for device, groups in devices.items():
+            group_entry = groups.get(group)
+            if group_entry is not None:
+                values[device] = group_entry[2][i]
+        present = [device for device in by_id if device in values]
+        present.sort(key=values.__getitem__, reverse=descending)
+        return present + [device for device in by_id if device not in values]
+
+
+def entry(device, last_seen, groups, now):
+    """One /api/fleet row: last seen, staleness in seconds and every channel (null if never reported)"""
+    row = {
+        "device": device,
+        "last_seen": to_iso(last_seen),
+        "staleness": round(max(0, now - last_seen) / 1_000_000, 3),
+    }
+    for channel in CHANNELS:
+        group, i = _CHANNEL_GROUPS[channel]
+        group_entry = groups.get(group)
+        row[channel] = group_entry[2][i] if group_entry else None
+    return row
+
+
+view = FleetView(latest)
@@ -0,0 +1,230 @@
+"""Bounding-box and nearest-neighbour queries over GPS fixes.
+
+Every partition has an R*Tree of its fixes (schema.geo_ddl), so a query
+walks the R*Tree of each partition in its time range instead of scanning
+rows. Partitions are read newest day first and the walk stops once
+``limit`` fixes are found, so a bbox over months of data costs about as
+much as one over the last day when the newest fixes fill the page.
+
+R*Tree has no k-nearest-neighbour search, so ``nearest`` looks for a box
+around the point holding between k and a few times k fixes: it grows the
+box (x4) from about 100 m, then bisects the radius if a step overshot, each
+probe fetching at most that many fixes. The k closest fixes of the box are
+the answer once the k-th lies within the box's inscribed circle. Otherwise
+the box of that radius is searched best first: it is cut in quarters until
+each holds few enough fixes to fetch, nearest quarter first, until the next
+one lies beyond the k-th closest fix found. Far from the data, where that
+box spans the globe, this reads a few hundred fixes instead of all of them.
+Distances are great-circle (haversine) metres.
+
+Boxes crossing the antimeridian are split in two.
+"""
+import heapq
+import math
+
+import numpy as np
+
+import partitions
+from schema import geo_table
+
+EARTH_RADIUS_M = 6_371_008.8
+# Metres per degree of latitude
+_DEGREE_M = math.pi * EARTH_RADIUS_M / 180
+# First box half-width for nearest(), in degrees (about 100 m)
+_NEAREST_START = 0.001
+_NEAREST_PROBES = 40
+# Boxes nearest() no longer quarters, in degrees
+_NEAREST_MIN_BOX = 1e-6
+# Web Mercator ends where the map is square
+MERCATOR_MAX_LAT = math.degrees(math.atan(math.sinh(math.pi)))
+
+
+def parse_bbox(text):
+    """'west,south,east,north' in degrees -> (south, west, north, east), raising ValueError.
+
+    ``west`` > ``east`` means the box crosses the antimeridian.
+    """
+    try:
+        west, south, east, north = (float(part) for part in (text or "").split(","))
+    except ValueError:
+        raise ValueError("bbox must be west,south,east,north in degrees")
+    if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+        raise ValueError("bbox must be west,south,east,north with -90 <= south <= north <= 90 "
+                         "and longitudes within -180..180")
+    return south, west, north, east
+
+
+def _lon_ranges(west, east):
+    return [(west, east)] if west <= east else [(west, 180.0), (-180.0, east)]
+
+
+def _query(conn, name, south, north, lon_ranges, from_us, to_us, device, limit=None, newest=True):
+    """Fixes of one partition inside the box: (id, timestamp, device, lat, lon).
+
+    With a ``limit``, the newest ones (or any, with ``newest=False``).
+    """
+    # The R*Tree constraints come first so SQLite drives the join from it;
+    # one SELECT per longitude range, as an OR of ranges would leave the
+    # longitudes to a scan of every fix in the latitude band
+    where = "g.min_lat <= ? AND g.max_lat >= ? AND g.min_lon <= ? AND g.max_lon >= ?"
+    filters = [north, south]
+    if from_us is not None:
+        where += " AND t.timestamp >= ?"
+        filters.append(from_us)
+    if to_us is not None:
+        where += " AND t.timestamp < ?"
+        filters.append(to_us)
+    if device is not None:
+        where += " AND t.device = ?"
+        filters.append(device)
+    where += " AND t.latitude BETWEEN ? AND ? AND t.longitude BETWEEN ? AND ?"
+    selects = []
+    params = []
+    for west, east in lon_ranges:
+        selects.append(
+            f"SELECT t.id, t.timestamp, t.device, t.latitude, t.longitude "
+            f"FROM {geo_table(name)} g JOIN {name} t ON t.id = g.id WHERE {where}"
+        )
+        params += filters[:2] + [east, west] + filters[2:] + [south, north, west, east]
+    sql = " UNION ALL ".join(selects)
+    if limit is not None:
+        sql += " ORDER BY 1 DESC LIMIT ?" if newest else " LIMIT ?"
+        params.append(limit)
+    return conn.execute(sql, params).fetchall()
+
+
+def bbox(conn, south, west, north, east, from_us=None, to_us=None, device=None, limit=1000):
+    """Up to ``limit`` fixes inside the box, newest first; returns (fixes, truncated)"""
+    lon_ranges = _lon_ranges(west, east)
+    fixes = []
+    for name in reversed(partitions.matching(conn, from_us, to_us)):
+        fixes += _query(conn, name, south, north, lon_ranges, from_us, to_us, device, limit + 1 - len(fixes))
+        if len(fixes) > limit:
+            break
+    # Partitions of different sources can share a day, so sort the page by id
+    fixes.sort(key=lambda fix: fix[0], reverse=True)
+    return fixes[:limit], len(fixes) > limit
+
+
+def mercator(lat, lon):
+    """Web Mercator position of fixes (NumPy arrays) as (u, v) in [0, 1).
+
+    u grows eastwards from the antimeridian and v southwards from the top
+    of the map, which ends at +-MERCATOR_MAX_LAT.
+    """
+    lat = np.radians(np.clip(lat, -MERCATOR_MAX_LAT, MERCATOR_MAX_LAT))
+    u = (np.asarray(lon, dtype=np.float64) + 180.0) / 360.0 % 1.0
+    v = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0
+    return u, np.minimum(v, np.nextafter(1.0, 0.0))
+
+
+def distance(lat1, lon1, lat2, lon2):
+    """Great-circle distance in metres"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _box(lat, lon, radius):
+    """(south, north, lon ranges) of the box ``radius`` degrees of latitude around a point"""
+    south = max(-90.0, lat - radius)
+    north = min(90.0, lat + radius)
+    # Longitude degrees shrink towards the poles; near them take every longitude
+    cos_lat = math.cos(math.radians(max(abs(south), abs(north))))
+    span = radius / cos_lat if cos_lat > radius / 180 else 180.0
+    if span >= 180:
+        return south, north, [(-180.0, 180.0)]
+    west = (lon - span + 180) % 360 - 180
+    east = (lon + span + 180) % 360 - 180
+    return south, north, _lon_ranges(west, east)
+
+
+def _within(conn, names, south, north, lon_ranges, from_us, to_us, device, limit=None):
+    """The fixes (up to ``limit``) of the partitions ``names`` inside a box"""
+    fixes = []
+    for name in names:
+        fixes += _query(conn, name, south, north, lon_ranges, from_us, to_us, device,
+                        None if limit is None else limit - len(fixes), newest=False)
+        if limit is not None and len(fixes) >= limit:
+            break
+    return fixes
+
+
+def _around(conn, names, lat, lon, radius, from_us, to_us, device, limit=None):
+    """The fixes (up to ``limit``) within ``radius`` degrees of latitude and the matching longitude span"""
+    south, north, lon_ranges = _box(lat, lon, radius)
+    return _within(conn, names, south, north, lon_ranges, from_us, to_us, device, limit)
+
+
+def _box_distance(lat, lon, south, north, west, east):
+    """Great-circle metres from a point to the closest point of a box (west <= east)"""
+    if west <= lon <= east:
+        return distance(lat, lon, min(max(lat, south), north), lon)
+    # Otherwise the closest point is on the meridian edge nearer in longitude,
+    # at the latitude where that meridian passes closest to the point
+    edge = min((west, east), key=lambda edge: abs((edge - lon + 180) % 360 - 180))
+    phi = math.radians(lat)
+    closest = math.degrees(math.atan2(math.sin(phi), math.cos(phi) * math.cos(math.radians(edge - lon))))
+    return distance(lat, lon, min(max(closest, south, -90.0), north, 90.0), edge)
+
+
+def _best_first(conn, names, lat, lon, radius, k, most, from_us, to_us, device):
+    """The k fixes closest to (lat, lon) within ``radius`` degrees, as (distance_m, fix) pairs.
+
+    The box is quartered until a part holds at most ``most`` fixes, and the
+    parts are visited nearest first until the next lies beyond the k-th
+    closest fix found.
+    """
+    south, north, lon_ranges = _box(lat, lon, radius)
+    boxes = [(_box_distance(lat, lon, south, north, west, east), south, north, west, east)
+             for west, east in lon_ranges]
+    heapq.heapify(boxes)
+    ranked = []
+    seen = set()
+    while boxes:
+        gap, south, north, west, east = heapq.heappop(boxes)
+        if len(ranked) == k and gap > ranked[-1][0]:
+            break
+        fixes = _within(conn, names, south, north, [(west, east)], from_us, to_us, device, most + 1)
+        if len(fixes) > most and max(north - south, east - west) > _NEAREST_MIN_BOX:
+            middle_lat = (south + north) / 2
+            middle_lon = (west + east) / 2
+            for part in ((south, middle_lat), (middle_lat, north)):
+                for side in ((west, middle_lon), (middle_lon, east)):
+                    heapq.heappush(boxes, (_box_distance(lat, lon, *part, *side), *part, *side))
+            continue
+        # Fixes on a shared edge are found in both parts
+        fixes = [fix for fix in fixes if fix[0] not in seen]
+        seen.update(fix[0] for fix in fixes)
+        ranked = sorted(ranked + [(distance(lat, lon, fix[3], fix[4]), fix) for fix in fixes])[:k]
+    return ranked
+
+
+def nearest(conn, lat, lon, k, from_us=None, to_us=None, device=None):
+    """The k fixes closest to (lat, lon) as (distance_m, fix) pairs, closest first"""
+    names = partitions.matching(conn, from_us, to_us)
+    most = max(4 * k, 256)
+    low = 0.0  # a radius known to hold fewer than k fixes
+    high = None  # a radius known to hold more than ``most``
+    radius = _NEAREST_START
+    for _ in range(_NEAREST_PROBES):
+        fixes = _around(conn, names, lat, lon, radius, from_us, to_us, device, most + 1)
+        if len(fixes) > most:
+            high, crowded = radius, fixes
+        elif len(fixes) < k and radius < 180:
+            low = radius
+        else:
+            break
+        radius = radius * 4 if high is None else (low + high) / 2
+    else:
+        # Only a cluster of more than ``most`` fixes at (nearly) the same
+        # distance gets here; any ``most`` of them will do
+        radius, fixes = high, crowded
+    ranked = sorted((distance(lat, lon, fix[3], fix[4]), fix) for fix in fixes)[:k]
+    # The box only guarantees fixes within its inscribed circle
+    if len(ranked) == k and radius < 180 and ranked[-1][0] > radius * _DEGREE_M:
+        radius = ranked[-1][0] / _DEGREE_M * 1.001
+        ranked = _best_first(conn, names, lat, lon, radius, k, most, from_us, to_us, device)
+    return ranked
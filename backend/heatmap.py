@@ -0,0 +1,237 @@
+"""Track-density heatmap tiles for /api/tiles/{z}/{x}/{y}.
+
+Every 256-pixel map tile (Web Mercator, the usual z/x/y scheme) at zooms
+0..HEAT_MAX_ZOOM is split into a 64 x 64 grid of 4-pixel cells, and
+heat_cells (schema.HEAT_CELLS) counts the fixes in each cell. The ingest
+writer calls ``apply()`` in the transaction that inserts the rows, so the
+counts grow with every commit, one UPSERT per touched cell and zoom, and
+are never recomputed; like the rollups they outlive the raw rows.
+
+A tile is rendered from its cells' counts (one range of the key, at most
+4096 rows) to a PNG and cached on disk in a ``heatmap`` folder under
+``HEATMAP_DIR``. A commit deletes the cached files of the tiles its fixes
+fall in, so a map pan costs a file read for every tile that saw no new
+fixes. The cache's tile files are deleted at startup, as rows loaded while
+the server was down (load.py) do not go through the writer; nothing else
+under ``HEATMAP_DIR`` is touched.
+
+Colour is on a log scale of the count, saturating at ``HEAT_SATURATION``
+fixes per cell at the deepest zoom; a cell one zoom out covers four cells
+but usually a track through two of them, so its saturation doubles.
+"""
+import logging
+import math
+import os
+import struct
+import threading
+import zlib
+from collections import Counter
+
+import numpy as np
+
+import db
+import geo
+from schema import COLUMNS
+
+log = logging.getLogger(__name__)
+
+HEAT_MAX_ZOOM = int(os.getenv("HEAT_MAX_ZOOM", "12"))
+HEAT_SATURATION = float(os.getenv("HEAT_SATURATION", "50"))
+HEATMAP_DIR = os.getenv("HEATMAP_DIR", f"{db.DB}-tiles")
+
+TILE_SIZE = 256
+# Cells per tile side, as a power of two
+_GRID_BITS = 6
+_GRID = 1 << _GRID_BITS
+_CELL_BITS = 2 * _GRID_BITS
+_ZOOMS = np.arange(HEAT_MAX_ZOOM + 1, dtype=np.int64)
+
+_LATITUDE = COLUMNS.index("latitude")
+_LONGITUDE = COLUMNS.index("longitude")
+
+_UPSERT = (
+    "INSERT INTO heat_cells (zoom, cell, count) VALUES (?, ?, ?) "
+    "ON CONFLICT(zoom, cell) DO UPDATE SET count = count + excluded.count"
+)
+
+# Count 0 -> transparent, then blue -> cyan -> yellow -> red as the log
+# count approaches saturation
+_STOPS = np.array([0.0, 0.25, 0.5, 0.75, 1.0])
+_COLOURS = np.array([
+    (0, 64, 255, 96),
+    (0, 192, 255, 160),
+    (64, 255, 128, 200),
+    (255, 224, 0, 230),
+    (255, 32, 0, 255),
+], dtype=np.float64)
+
+
+def _cells(points):
+    """{(zoom, cell): fixes} for (latitude, longitude) pairs, at every zoom"""
+    if not len(points):
+        return Counter()
+    u, v = geo.mercator(*np.asarray(points, dtype=np.float64).T)
+    # One row per zoom, one column per fix
+    zoom = _ZOOMS[:, None]
+    side = _GRID << zoom
+    gx = (u * side).astype(np.int64)
+    gy = (v * side).astype(np.int64)
+    tile = ((gy >> _GRID_BITS) << zoom) + (gx >> _GRID_BITS)
+    cells = (tile << _CELL_BITS) | ((gy & (_GRID - 1)) << _GRID_BITS) | (gx & (_GRID - 1))
+    return Counter(zip(np.broadcast_to(zoom, cells.shape).ravel().tolist(), cells.ravel().tolist()))
+
+
+def _fixes(rows):
+    return [
+        (row[_LATITUDE], row[_LONGITUDE]) for row in rows
+        if row[_LATITUDE] is not None and row[_LONGITUDE] is not None
+    ]
+
+
+def apply(conn, rows):
+    """Ingest transaction hook: count the fixes of make_row tuples into heat_cells"""
+    counts = _cells(_fixes(rows))
+    if counts:
+        conn.executemany(_UPSERT, [(zoom, cell, count) for (zoom, cell), count in counts.items()])
+
+
+def rebuild(conn, chunk=65536):
+    """Recount heat_cells from telemetry; runs in the caller's transaction"""
+    conn.execute("DELETE FROM heat_cells")
+    cursor = conn.execute(
+        "SELECT latitude, longitude FROM telemetry WHERE latitude IS NOT NULL AND longitude IS NOT NULL"
+    )
+    while True:
+        points = cursor.fetchmany(chunk)
+        if not points:
+            break
+        counts = _cells(points)
+        conn.executemany(_UPSERT, [(zoom, cell, count) for (zoom, cell), count in counts.items()])
+
+
+def check_tile(z, x, y):
+    """Raise LookupError unless z/x/y is a heatmap tile"""
+    if not (0 <= z <= HEAT_MAX_ZOOM and 0 <= x < 1 << z and 0 <= y < 1 << z):
+        raise LookupError(f"No heatmap tile {z}/{x}/{y} (zoom 0..{HEAT_MAX_ZOOM})")
+
+
+def density(conn, z, x, y):
+    """Fixes per cell of a tile as a 64 x 64 array, rows top to bottom"""
+    first = ((y << z) + x) << _CELL_BITS
+    grid = np.zeros(_GRID * _GRID, dtype=np.int64)
+    rows = conn.execute(
+        "SELECT cell, count FROM heat_cells WHERE zoom = ? AND cell >= ? AND cell < ?",
+        (z, first, first + (1 << _CELL_BITS)),
+    ).fetchall()
+    if rows:
+        cells, counts = np.array(rows, dtype=np.int64).T
+        grid[cells - first] = counts
+    return grid.reshape(_GRID, _GRID)
+
+
+def render(counts, z):
+    """PNG bytes of a tile from its cell counts"""
+    saturation = HEAT_SATURATION * 2 ** (HEAT_MAX_ZOOM - z)
+    level = np.minimum(np.log1p(counts) / math.log1p(saturation), 1.0)
+    rgba = np.stack([np.interp(level, _STOPS, _COLOURS[:, i]) for i in range(4)], axis=-1)
+    rgba[counts == 0] = 0
+    scale = TILE_SIZE // _GRID
+    pixels = rgba.round().astype(np.uint8).repeat(scale, axis=0).repeat(scale, axis=1)
+    return _png(pixels)
+
+
+def _png(pixels):
+    """Encode an (height, width, 4) uint8 array as an RGBA PNG"""
+    height, width, _ = pixels.shape
+    # Filter type 0 (None) before every scanline
+    raw = np.concatenate([np.zeros((height, 1), dtype=np.uint8), pixels.reshape(height, -1)], axis=1)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw.tobytes(), 6))
+            + chunk(b"IEND", b""))
+
+
+class TileCache:
+    """Rendered tiles on disk, dropped when a commit adds fixes to them.
+
+    ``_generation`` has an entry for every tile rendered since startup and
+    goes up when a commit touches it; a render that raced with a commit
+    is served but not written, so the cache never holds a tile older than
+    its counts.
+    """
+
+    def __init__(self, root=HEATMAP_DIR):
+        self.directory = os.path.join(root, "heatmap")
+        self._lock = threading.Lock()
+        self._generation = {}  # (z, x, y) -> commits that touched it
+
+    def reset(self):
+        """Delete the cached tiles (at startup): the z/x/y.png files and partial writes only"""
+        with self._lock:
+            for parent, _, names in os.walk(self.directory, topdown=False):
+                for name in names:
+                    if name.endswith((".png", ".tmp")):
+                        try:
+                            os.remove(os.path.join(parent, name))
+                        except FileNotFoundError:
+                            pass
+                # Left in place if anything else is in it
+                try:
+                    os.rmdir(parent)
+                except OSError:
+                    pass
+            self._generation.clear()
+
+    def get(self, conn, z, x, y):
+        """PNG bytes of a tile, from the cache or rendered (and cached)"""
+        check_tile(z, x, y)
+        key = (z, x, y)
+        path = self._path(key)
+        with self._lock:
+            generation = self._generation.setdefault(key, 0)
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+        png = render(density(conn, z, x, y), z)
+        with self._lock:
+            if self._generation.get(key) == generation:
+                try:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    partial = f"{path}.{threading.get_ident()}.tmp"
+                    with open(partial, "wb") as f:
+                        f.write(png)
+                    os.replace(partial, path)
+                except OSError:
+                    log.exception("Could not cache heatmap tile %d/%d/%d", z, x, y)
+        return png
+
+    def invalidate(self, committed):
+        """Ingest listener: drop the cached tiles a commit added fixes to"""
+        if not self._generation:
+            return
+        touched = {
+            (zoom, cell >> _CELL_BITS)
+            for zoom, cell in _cells(_fixes(row for _, row in committed))
+        }
+        with self._lock:
+            for zoom, tile in touched:
+                key = (zoom, tile & ((1 << zoom) - 1), tile >> zoom)
+                if key in self._generation:
+                    self._generation[key] += 1
+                    try:
+                        os.remove(self._path(key))
+                    except FileNotFoundError:
+                        pass
+
+    def _path(self, key):
+        z, x, y = key
+        return os.path.join(self.directory, str(z), str(x), f"{y}.png")
+
+
+tiles = TileCache()
@@ -0,0 +1,150 @@
+"""Time-bucketed aggregates for /api/history.
+
+Buckets are aligned to multiples of the bucket size since the Unix epoch, so
+the same bucket always covers the same interval whatever range is asked
+for. Every requested channel gets min / max / mean / count / last per bucket,
+computed in one grouped SQL pass over a rollup table (rollup.py) when one
+matches the bucket size, and with NumPy over raw rows otherwise.
+"""
+import numpy as np
+
+import partitions
+import rollup
+from schema import CHANNELS
+
+# How many buckets one request may ask for; with max_points only the
+# downsampled series is returned, so far more buckets may be scanned
+MAX_BUCKETS = 20000
+MAX_DOWNSAMPLED_BUCKETS = 1_000_000
+# Longest range of one device's history: it is read from raw rows, as the
+# rollups are fleet-wide, so its cost grows with the rows in range
+DEVICE_MAX_RANGE = 7 * 86400 * 1_000_000
+
+# Most raw rows one request may bucket (bucket sizes no rollup divides, or
+# one device's history)
+MAX_RAW_ROWS = 1_000_000
+
+# Raw rows are converted to arrays this many at a time
+FETCH_SIZE = 65536
+
+STATS = ("min", "max", "mean", "count", "last")
+
+
+def parse_channels(value):
+    """Comma-separated channel list -> tuple, defaulting to every channel"""
+    if not value:
+        return CHANNELS
+    channels = tuple(c.strip() for c in value.split(",") if c.strip())
+    unknown = [c for c in channels if c not in CHANNELS]
+    if unknown:
+        raise ValueError(f"Unknown channels: {', '.join(unknown)}")
+    return channels
+
+
+def align(from_us, to_us, bucket_us, limit=MAX_BUCKETS):
+    """Widen [from, to) to whole buckets"""
+    start = from_us - from_us % bucket_us
+    end = to_us + (-to_us % bucket_us)
+    if (end - start) // bucket_us > limit:
+        raise ValueError(f"Too many buckets (max {limit}); use a larger bucket")
+    return start, end
+
+
+def aggregate(conn, from_us, to_us, bucket_us, channels, device=None):
+    """Return (rollup name or None, bucket starts, {channel: {stat: values}}) for [from, to).
+
+    Reads the coarsest rollup table whose buckets tile ``bucket_us`` and
+    falls back to raw rows for bucket sizes no rollup divides. Rollups are
+    fleet-wide, so one ``device``'s history always comes from raw rows (via
+    its (device, timestamp) index) and may span at most DEVICE_MAX_RANGE,
+    raising ValueError otherwise. Starts and stats are NumPy arrays with
+    nan for "no value"; see ``as_list``.
+    """
+    if device is not None and to_us - from_us > DEVICE_MAX_RANGE:
+        raise ValueError(f"A device's history may span at most {DEVICE_MAX_RANGE // 86_400_000_000} days")
+    level = None if device is not None else rollup.pick(bucket_us)
+    if level is None:
+        starts, series = _aggregate_raw(conn, from_us, to_us, bucket_us, channels, device)
+        return None, starts, series
+
+    stats = [expr for c in channels for expr in rollup.combine_sql(c)]
+    width = len(stats) // len(channels)
+    table = fetch_table(conn.execute(
+        f"SELECT bucket / ? AS b, {', '.join(stats)} FROM {rollup.table(level[0])} "
+        "WHERE bucket >= ? AND bucket < ? GROUP BY b ORDER BY b",
+        (bucket_us, from_us, to_us),
+    ), 1 + len(stats))
+    series = {}
+    for i, channel in enumerate(channels):
+        low, high, total, count, last = table[:, 1 + i * width: 6 + i * width].T
+        series[channel] = _stats(low, high, total, count.astype(np.int64), last)
+    return level[0], table[:, 0].astype(np.int64) * bucket_us, series
+
+
+def as_list(values):
+    """Array -> JSON-ready list, with None in place of nan"""
+    if values.dtype.kind != "f":
+        return values.tolist()
+    out = values.astype(object)
+    out[np.isnan(values)] = None
+    return out.tolist()
+
+
+def _stats(low, high, total, count, last):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+    return {"min": low, "max": high, "mean": mean, "count": count, "last": last}
+
+
+def fetch_table(cursor, width):
+    """All rows of a cursor as a float64 array, NULL -> nan, converted in chunks"""
+    chunks = []
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        chunks.append(np.array(rows, dtype=np.float64))
+    return np.concatenate(chunks) if chunks else np.empty((0, width))
+
+
+def _aggregate_raw(conn, from_us, to_us, bucket_us, channels, device=None):
+    """Bucket raw rows with NumPy.
+
+    Rows come back in (timestamp, id) order straight from the timestamp
+    index, so each bucket is a contiguous run and every stat is one
+    ``reduceat`` over the run starts; the last non-null value of a run is
+    the one at its highest index. Raises ValueError past MAX_RAW_ROWS rows.
+    """
+    # id is selected only so SQLite can merge the partitions' index order
+    table = fetch_table(conn.execute(
+        f"SELECT timestamp, id, {', '.join(channels)} FROM {partitions.source(conn, from_us, to_us)} "
+        f"WHERE timestamp >= ? AND timestamp < ? {'' if device is None else 'AND device = ?'} "
+        "ORDER BY timestamp, id LIMIT ?",
+        (from_us, to_us) + (() if device is None else (device,)) + (MAX_RAW_ROWS + 1,),
+    ), 2 + len(channels))
+    if len(table) > MAX_RAW_ROWS:
+        raise ValueError(f"Too many rows to bucket (max {MAX_RAW_ROWS}); "
+                         "use a shorter range or a bucket of whole minutes")
+    if not len(table):
+        empty = np.empty(0)
+        return empty.astype(np.int64), {
+            channel: _stats(empty, empty, empty, empty.astype(np.int64), empty) for channel in channels
+        }
+
+    # Epoch microseconds stay exact in a float64 until the year 2255
+    buckets = table[:, 0].astype(np.int64) // bucket_us
+    runs = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    positions = np.arange(len(table))
+    series = {}
+    for i, channel in enumerate(channels, start=2):
+        values = table[:, i]
+        present = ~np.isnan(values)
+        last = np.maximum.reduceat(np.where(present, positions, -1), runs)
+        series[channel] = _stats(
+            np.fmin.reduceat(values, runs),
+            np.fmax.reduceat(values, runs),
+            np.add.reduceat(np.where(present, values, 0.0), runs),
+            np.add.reduceat(present.astype(np.int64), runs),
+            np.where(last >= 0, values[last], np.nan),
+        )
+    return buckets[runs] * bucket_us, series
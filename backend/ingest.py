@@ -0,0 +1,340 @@
+"""Telemetry write path shared by the ingest endpoints.
+
+Handlers build rows with ``make_row`` and hand them to ``writer.write()``.
+Two modes are available (``INGEST_MODE``):
+
+    sync   the calling thread inserts and commits (default)
+    queue  rows go onto a bounded in-memory queue; one writer thread drains
+           it and group-commits up to INGEST_BATCH_SIZE rows per transaction
+
+In queue mode ``INGEST_DURABILITY`` decides when a handler may answer:
+
+    commit   block until the writer has committed the rows (default)
+    enqueue  return as soon as the rows are queued; the writer waits up to
+             INGEST_FLUSH_INTERVAL seconds to fill a batch, and a crash can
+             lose whatever is still in the queue
+
+A full queue raises ``IngestBusy`` so handlers can shed load with a 503
+instead of piling up threads. ``writer.stats()`` reports queue depth and
+flush latency. ``writer.version`` counts the commits, for conditional GETs.
+"""
+import atexit
+import logging
+import math
+import os
+import queue
+import re
+import threading
+import time
+
+import db
+import partitions
+from schema import CHANNELS, COLUMNS
+
+log = logging.getLogger(__name__)
+
+_CHANNELS = frozenset(CHANNELS)
+_DEVICE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.:-]{0,63}$")
+
+
+class IngestBusy(Exception):
+    """The ingest queue is full"""
+
+
+def make_row(timestamp, source, device=None, **channels):
+    """Build a row tuple in COLUMNS order; channels not given are NULL.
+
+    ``timestamp`` is epoch microseconds (see timeutil), ``device`` an id
+    from ``parse_device`` or None.
+    """
+    unknown = channels.keys() - _CHANNELS
+    if unknown:
+        raise ValueError(f"Unknown channels: {', '.join(sorted(unknown))}")
+    return (timestamp, source, device) + tuple(map(channels.get, CHANNELS))
+
+
+def parse_device(value):
+    """Validate a device id from a payload or query string; None / "" mean no device.
+
+    Ids are 1-64 characters of letters, digits and ``_ . : -``, starting
+    with a letter or digit.
+    """
+    if value is None or value == "":
+        return None
+    if not isinstance(value, str) or not _DEVICE.match(value):
+        raise ValueError("Invalid device id")
+    return value
+
+
+def number(value):
+    """float(value), raising ValueError for nan and +-inf.
+
+    Neither is valid JSON on the way out, and nan would break the rollup sums.
+    """
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError("Invalid numeric values")
+    return value
+
+
+def check_position(latitude, longitude):
+    """Raise ValueError unless a fix (either part may be None) lies on the globe"""
+    if latitude is not None and not -90 <= latitude <= 90:
+        raise ValueError("latitude must be between -90 and 90")
+    if longitude is not None and not -180 <= longitude <= 180:
+        raise ValueError("longitude must be between -180 and 180")
+
+
+def parse_upload(data):
+    """Channels of a /upload payload (rasp.py), raising ValueError if unusable.
+
+    Missing temperature / humidity are stored as 0.0; a null reading (a
+    failed sensor) and a missing position are stored as NULL. Readings
+    must be finite and positions within -90..90 / -180..180.
+    """
+    def channel(key, default=None):
+        value = data.get(key, default)
+        return number(value) if value is not None else None
+
+    try:
+        channels = {
+            "temperature": channel("temperature", 0.0),
+            "humidity": channel("humidity", 0.0),
+            "latitude": channel("latitude"),
+            "longitude": channel("longitude"),
+        }
+    except (TypeError, ValueError):
+        raise ValueError("Invalid numeric values")
+    check_position(channels["latitude"], channels["longitude"])
+    return channels
+
+
+class _Pending:
+    __slots__ = ("rows", "enqueued", "done", "error")
+
+    def __init__(self, rows, wait):
+        self.rows = rows
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event() if wait else None
+        self.error = None
+
+
+class IngestWriter:
+    def __init__(self, mode="sync", durability="commit", max_queue=10000,
+                 batch_size=500, flush_interval=0.05):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self._listeners = []
+        self._hooks = []
+        # Successful commits so far; goes up after a commit's listeners ran,
+        # so whoever sees the new number also sees the data (conditional GETs)
+        self.version = 0
+        self.configure(mode, durability, max_queue, batch_size, flush_interval)
+
+    def configure(self, mode="sync", durability="commit", max_queue=10000,
+                  batch_size=500, flush_interval=0.05):
+        """(Re)apply settings, flushing and stopping a running writer thread first"""
+        if mode not in ("sync", "queue"):
+            raise ValueError(f"Invalid INGEST_MODE: {mode}")
+        if durability not in ("commit", "enqueue"):
+            raise ValueError(f"Invalid INGEST_DURABILITY: {durability}")
+        self.stop()
+        self.mode = mode
+        self.durability = durability
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stats = {
+            "rows_committed": 0,
+            "rows_failed": 0,
+            "rows_rejected": 0,
+            "flushes": 0,
+            "last_flush_rows": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+            "last_commit_latency_ms": 0.0,
+            "max_commit_latency_ms": 0.0,
+        }
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            mode=os.getenv("INGEST_MODE", "sync"),
+            durability=os.getenv("INGEST_DURABILITY", "commit"),
+            max_queue=int(os.getenv("INGEST_QUEUE_SIZE", "10000")),
+            batch_size=int(os.getenv("INGEST_BATCH_SIZE", "500")),
+            flush_interval=float(os.getenv("INGEST_FLUSH_INTERVAL", "0.05")),
+        )
+
+    def add_transaction_hook(self, hook):
+        """Call ``hook(conn, rows)`` inside every insert transaction.
+
+        Hooks keep derived tables in step with ``telemetry``: they commit
+        together with the rows, and an exception rolls the batch back.
+        """
+        self._hooks.append(hook)
+
+    def add_listener(self, listener):
+        """Call ``listener(committed)`` after every successful commit.
+
+        ``committed`` is a list of ``(id, row)`` pairs in insertion order.
+        Listeners run on the committing thread, one commit at a time, before
+        any caller waiting on that commit is released.
+        """
+        self._listeners.append(listener)
+
+    def write(self, rows):
+        """Store rows (tuples from make_row) according to the configured mode"""
+        if not rows:
+            return
+        if self.mode == "sync":
+            with self._lock:
+                self._commit([_Pending(rows, wait=False)])
+            return
+
+        self._ensure_started()
+        pending = _Pending(rows, wait=self.durability == "commit")
+        try:
+            self._queue.put_nowait(pending)
+        except queue.Full:
+            with self._lock:
+                self._stats["rows_rejected"] += len(rows)
+            raise IngestBusy("Ingest queue is full")
+        if pending.done is not None:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        total_flush_ms = stats.pop("total_flush_ms")
+        stats["avg_flush_ms"] = round(total_flush_ms / stats["flushes"], 3) if stats["flushes"] else 0.0
+        stats.update({
+            "mode": self.mode,
+            "durability": self.durability,
+            "queue_depth": self._queue.qsize(),
+            "queue_capacity": self._queue.maxsize,
+            "batch_size": self.batch_size,
+            "flush_interval": self.flush_interval,
+        })
+        return stats
+
+    def stop(self, timeout=5.0):
+        """Flush whatever is queued and stop the writer thread"""
+        thread = self._thread
+        if thread is None:
+            return
+        self._stopping = True
+        thread.join(timeout)
+        self._thread = None
+        self._stopping = False
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if self._stopping:
+                    return
+                continue
+
+            # Group commit: take everything already queued, up to batch_size rows.
+            # Callers waiting for a commit are never kept waiting for stragglers;
+            # in enqueue mode nobody waits, so linger up to flush_interval to
+            # build bigger transactions.
+            batch = [first]
+            count = len(first.rows)
+            linger = self.durability == "enqueue"
+            deadline = time.perf_counter() + self.flush_interval
+            while count < self.batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    if linger and remaining > 0:
+                        item = self._queue.get(timeout=remaining)
+                    else:
+                        item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+                count += len(item.rows)
+
+            with self._lock:
+                self._commit(batch)
+
+    def _commit(self, batch):
+        """Insert every pending item in one transaction; caller holds self._lock.
+
+        If the transaction fails, each item is retried in a transaction of
+        its own, so a bad item fails alone.
+        """
+        rows = [row for item in batch for row in item.rows]
+        start = time.perf_counter()
+        error = None
+        try:
+            conn = db.get_connection()
+            with conn:
+                # Take the write lock before reading the id sequence, and keep
+                # any partition DDL inside the transaction
+                conn.execute("BEGIN IMMEDIATE")
+                first_id = partitions.insert(conn, rows)
+                for hook in self._hooks:
+                    hook(conn, rows)
+        except Exception as e:
+            error = e
+        if error is not None and len(batch) > 1:
+            # The transaction rolled back; replay each item on its own so
+            # only the one that broke it fails
+            for item in batch:
+                self._commit([item])
+            return
+        end = time.perf_counter()
+
+        stats = self._stats
+        if error is None:
+            flush_ms = (end - start) * 1000
+            latency_ms = (end - min(item.enqueued for item in batch)) * 1000
+            stats["rows_committed"] += len(rows)
+            stats["flushes"] += 1
+            stats["last_flush_rows"] = len(rows)
+            stats["last_flush_ms"] = round(flush_ms, 3)
+            stats["max_flush_ms"] = round(max(stats["max_flush_ms"], flush_ms), 3)
+            stats["total_flush_ms"] += flush_ms
+            stats["last_commit_latency_ms"] = round(latency_ms, 3)
+            stats["max_commit_latency_ms"] = round(max(stats["max_commit_latency_ms"], latency_ms), 3)
+        else:
+            stats["rows_failed"] += len(rows)
+
+        if error is None and self._listeners:
+            committed = list(zip(range(first_id, first_id + len(rows)), rows))
+            for listener in self._listeners:
+                try:
+                    listener(committed)
+                except Exception:
+                    log.exception("Ingest listener %r failed", listener)
+        if error is None:
+            self.version += 1
+
+        for item in batch:
+            if item.done is not None:
+                item.error = error
+                item.done.set()
+        if error is not None:
+            if self.mode == "sync":
+                raise error
+            if any(item.done is None for item in batch):
+                log.error("Dropped %d queued rows: %s", len(rows), error)
+
+
+writer = IngestWriter.from_env()
+atexit.register(writer.stop)
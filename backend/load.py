@@ -0,0 +1,234 @@
+"""Bulk-load recorded telemetry captures into the database.
+
+    python load.py capture.log pi.jsonl mission.csv.gz
+    python load.py --start 2024-06-01T12:00:00Z --interval 1 frames.txt
+
+Input files (``.gz`` is decompressed on the fly, ``-`` reads stdin):
+
+    *.csv               /api/export CSV (id, timestamp, source, device, channels...)
+    *.jsonl, *.ndjson   one JSON object per line: an /api/export NDJSON row,
+                        a /data payload ({"data": "<frame>", "timestamp": ...})
+                        or an /upload payload as rasp.py sends it
+    anything else       LoRa frames as ard.py sends them, one per line,
+                        optionally prefixed by a timestamp and a TAB
+
+Frames and payloads go through the same parsers as the HTTP endpoints
+(lora.parse_frame, ingest.parse_upload). Timestamps are ISO 8601 or epoch
+seconds between 2000-01-01 and a day from now, as on the batch endpoints;
+naive ISO times in /upload payloads are local time, as rasp.py writes
+them. Lines without a timestamp are spaced ``--interval`` seconds apart
+from ``--start``. Unusable lines are counted and skipped. Rows get new
+ids, so an export can be loaded into another instance.
+
+For speed the loader commits ``--batch-size`` rows per transaction with
+``synchronous=OFF`` and creates the partitions it opens without indexes;
+it indexes them at the end and checkpoints the WAL. Rollups are merged in
+each batch's transaction with rollup.apply, which is several times cheaper
+than a rollup.rebuild of the loaded range afterwards, and so are the
+per-device latest values (snapshot.store), the heatmap counts
+(heatmap.apply) and the map marker clusters (clusters.apply). Run it while
+the server is stopped, or restart the server afterwards: the in-memory
+latest values and stream ids are seeded at startup. If the load is
+interrupted, the next server start adds any missing partition indexes.
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import sys
+import time
+
+import clusters
+import db
+import heatmap
+import partitions
+import rollup
+import schema
+import snapshot
+from ingest import check_position, make_row, number, parse_device, parse_upload
+from lora import parse_frame
+from schema import CHANNELS
+from timeutil import check_capture_time, from_iso, parse_json_time, parse_time
+
+MAX_ERRORS_SHOWN = 10
+
+
+class Skipped:
+    """Count of unusable lines, keeping the first few messages"""
+
+    def __init__(self):
+        self.count = 0
+        self.messages = []
+
+    def add(self, message):
+        self.count += 1
+        if len(self.messages) < MAX_ERRORS_SHOWN:
+            self.messages.append(message)
+
+
+class Clock:
+    """Timestamps for lines that carry none: --start, then every --interval"""
+
+    def __init__(self, start_us, interval_us):
+        self.next_us = start_us
+        self.interval_us = interval_us
+
+    def __call__(self):
+        if self.next_us is None:
+            raise ValueError("No timestamp (pass --start to load untimed lines)")
+        ts = self.next_us
+        self.next_us += self.interval_us
+        return ts
+
+
+def _timestamp(value, clock, assume_local=False):
+    """Epoch microseconds from an ISO string or epoch seconds; the clock if absent.
+
+    Raises ValueError for times outside timeutil.check_capture_time's window.
+    """
+    if value is None or value == "":
+        return clock()
+    if assume_local and isinstance(value, str):
+        try:
+            return check_capture_time(from_iso(value, assume_local=True))
+        except ValueError:
+            pass
+    return parse_json_time(value)
+
+
+def _number(value):
+    return number(value) if value not in (None, "") else None
+
+
+def export_row(record):
+    """Row from an /api/export CSV or NDJSON record"""
+    channels = {channel: _number(record.get(channel)) for channel in CHANNELS}
+    check_position(channels["latitude"], channels["longitude"])
+    return make_row(check_capture_time(from_iso(record["timestamp"])), record.get("source") or None,
+                    parse_device(record.get("device")), **channels)
+
+
+def frame_row(text, clock):
+    """Row from a LoRa capture line, '[timestamp<TAB>]frame'"""
+    stamp, tab, frame = text.rpartition("\t")
+    frame = parse_frame(frame)
+    return make_row(_timestamp(stamp, clock), "arduino", **frame._asdict())
+
+
+def json_row(record, clock):
+    """Row from an export NDJSON record, a /data payload or an /upload payload"""
+    if not isinstance(record, dict):
+        raise ValueError("Expected a JSON object")
+    if "source" in record:
+        return export_row(record)
+    stamp = record.get("timestamp")
+    if "data" in record:
+        frame = parse_frame(record["data"])
+        return make_row(_timestamp(stamp, clock), "arduino", parse_device(record.get("device")),
+                        **frame._asdict())
+    return make_row(_timestamp(stamp, clock, assume_local=True), "GPS", parse_device(record.get("device")),
+                    **parse_upload(record))
+
+
+def open_text(path):
+    if path == "-":
+        return sys.stdin
+    if path.endswith(".gz"):
+        return io.TextIOWrapper(gzip.open(path), encoding="utf-8", newline="")
+    return open(path, encoding="utf-8", newline="")
+
+
+def read_rows(path, clock, skipped):
+    """Yield the rows of one capture file; unusable lines go to ``skipped``"""
+    name = path[:-3] if path.endswith(".gz") else path
+    with open_text(path) as f:
+        if name.endswith(".csv"):
+            records = enumerate(csv.DictReader(f), start=2)
+            parse = export_row
+        elif name.endswith((".jsonl", ".ndjson")):
+            records = ((n, line) for n, line in enumerate(f, start=1) if line.strip())
+
+            def parse(line):
+                return json_row(json.loads(line), clock)
+        else:
+            records = ((n, line.strip()) for n, line in enumerate(f, start=1) if line.strip())
+
+            def parse(line):
+                return frame_row(line, clock)
+        for line_no, record in records:
+            try:
+                yield parse(record)
+            except (ValueError, KeyError, TypeError) as e:
+                skipped.add(f"{path}:{line_no}: {e}")
+
+
+def load(conn, paths, clock, batch_size):
+    """Insert every row of ``paths``; returns (rows, Skipped, partitions opened)"""
+    known = {name for name, *_ in partitions.listing(conn)}
+    skipped = Skipped()
+    loaded = 0
+    batch = []
+
+    def flush():
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            partitions.insert(conn, batch, indexes=False)
+            rollup.apply(conn, batch)
+            snapshot.store(conn, batch)
+            heatmap.apply(conn, batch)
+            clusters.apply(conn, batch)
+        batch.clear()
+
+    for path in paths:
+        for row in read_rows(path, clock, skipped):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                loaded += len(batch)
+                flush()
+        if batch:
+            loaded += len(batch)
+            flush()
+    opened = [name for name, *_ in partitions.listing(conn) if name not in known]
+    return loaded, skipped, opened
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+", help="capture files ('-' for stdin)")
+    parser.add_argument("--db", help="database file (default TELEMETRY_DB)")
+    parser.add_argument("--start", help="timestamp of the first untimed line (ISO 8601 or epoch seconds)")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between untimed lines")
+    parser.add_argument("--batch-size", type=int, default=100_000, help="rows per transaction")
+    args = parser.parse_args()
+
+    db.configure(path=args.db, synchronous="OFF", cache_size=-262144)
+    conn = db.connect()
+    conn.execute("PRAGMA temp_store=MEMORY")
+    schema.init_db(conn)
+    clock = Clock(parse_time(args.start) if args.start else None, int(args.interval * 1_000_000))
+
+    t0 = time.perf_counter()
+    count, skipped, opened = load(conn, args.paths, clock, args.batch_size)
+    t1 = time.perf_counter()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        for name in opened:
+            partitions.create_indexes(conn, name)
+    t2 = time.perf_counter()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    t3 = time.perf_counter()
+
+    for message in skipped.messages:
+        print(message, file=sys.stderr)
+    if skipped.count > len(skipped.messages):
+        print(f"... and {skipped.count - len(skipped.messages)} more unusable lines", file=sys.stderr)
+    print(f"insert   {t1 - t0:8.2f}s  {count} rows, {skipped.count} skipped, {len(opened)} partitions opened")
+    print(f"index    {t2 - t1:8.2f}s")
+    print(f"finish   {t3 - t2:8.2f}s")
+    print(f"total    {t3 - t0:8.2f}s  {count / (t3 - t0):10.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""Virtual-fleet load generator for the ingest endpoints.
+
+Simulates thousands of devices against a running server: LoRa nodes
+posting ard.py frames to /data and Pi nodes posting rasp.py payloads to
+/upload, each at its own rate with a random phase so the fleet does not
+send in lockstep. Every virtual device sends its own device id
+(p0-lora-17, p1-pi-3, ...), so the per-device tables fill up as they would
+with a real fleet.
+
+    python loadgen.py --devices 2000 --rate 1 --duration 60
+    python loadgen.py --devices 20000 --processes 4 --connections 200 --lora 0.8
+
+Every process runs its share of the devices as asyncio tasks over a small
+pool of keep-alive HTTP/1.1 connections (the stdlib has no async HTTP
+client, so the few lines of protocol needed live here). Devices are
+open-loop: a sample is due at its scheduled time whether or not earlier
+ones were answered, and latency is measured from that time, so waiting
+for a free connection counts. An overloaded server therefore shows up in
+the percentiles instead of silently lowering the send rate.
+
+The report gives achieved vs. offered throughput, the error rate (503
+load-shedding, other HTTP errors, timeouts and connection failures are
+counted separately) and p50/p95/p99/max latency of the answered requests.
+A sample that has waited ``--timeout`` seconds past its due time counts
+as a timeout, which also keeps an overloaded run from dragging on.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+
+import ard
+import rasp
+
+load_dotenv()
+
+SERVER_BASE_URL = os.getenv("SERVER_BASE_URL", "http://localhost:5000")
+
+
+class HTTPConnection:
+    """One keep-alive HTTP/1.1 connection, reopened after errors or Connection: close"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def post(self, path, body):
+        """POST a JSON body; returns the status code"""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            self.writer.write(
+                f"POST {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body
+            )
+            status_line = await self.reader.readline()
+            if not status_line:
+                raise ConnectionError("Connection closed by server")
+            version, status = status_line.split(None, 2)[:2]
+            length = 0
+            keep_alive = version == b"HTTP/1.1"
+            while True:
+                line = await self.reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.partition(b":")
+                name = name.strip().lower()
+                if name == b"content-length":
+                    length = int(value)
+                elif name == b"connection":
+                    keep_alive = value.strip().lower() != b"close"
+            await self.reader.readexactly(length)
+        except BaseException:
+            self.close()
+            raise
+        if not keep_alive:
+            self.close()
+        return int(status)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+def lora_sample(device_id):
+    return "/data", json.dumps({"data": ard.generate_sensor_data(), "device": device_id}).encode()
+
+
+def pi_sample(device_id):
+    sample = rasp.generate_sensor_data(verbose=False)
+    sample["device"] = device_id
+    return "/upload", json.dumps(sample).encode()
+
+
+async def device(sample, device_id, interval, start, end, pool, timeout, latencies, outcomes):
+    loop = asyncio.get_running_loop()
+    due = start + random.uniform(0, interval)
+    while due < end:
+        delay = due - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        path, body = sample(device_id)
+        conn = await pool.get()
+        # The timeout runs from the due time, so waiting for a connection counts
+        remaining = due + timeout - loop.time()
+        try:
+            if remaining <= 0:
+                raise asyncio.TimeoutError
+            status = await asyncio.wait_for(conn.post(path, body), remaining)
+            outcomes["ok" if status == 200 else "shed (503)" if status == 503 else f"http {status}"] += 1
+            latencies.append(loop.time() - due)
+        except asyncio.TimeoutError:
+            conn.close()
+            outcomes["timeout"] += 1
+        except (OSError, ValueError, asyncio.IncompleteReadError):
+            outcomes["connection error"] += 1
+        finally:
+            pool.put_nowait(conn)
+        due += interval
+
+
+async def run_fleet(url, lora_devices, pi_devices, rate, duration, connections, timeout, prefix=""):
+    """Run one process's devices; returns (latencies of answered requests in seconds, outcome counts)"""
+    parts = urlsplit(url)
+    pool = asyncio.Queue()
+    for _ in range(connections):
+        pool.put_nowait(HTTPConnection(parts.hostname, parts.port or 80))
+    loop = asyncio.get_running_loop()
+    start = loop.time() + 0.5
+    end = start + duration
+    latencies = []
+    outcomes = Counter()
+    await asyncio.gather(*(
+        device(sample, f"{prefix}{kind}-{i}", 1 / rate, start, end, pool, timeout, latencies, outcomes)
+        for sample, kind, count in ((lora_sample, "lora", lora_devices), (pi_sample, "pi", pi_devices))
+        for i in range(count)
+    ))
+    while not pool.empty():
+        pool.get_nowait().close()
+    return latencies, outcomes
+
+
+def _run_process(args):
+    return asyncio.run(run_fleet(*args))
+
+
+def percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default=SERVER_BASE_URL, help="server base URL (SERVER_BASE_URL)")
+    parser.add_argument("--devices", type=int, default=1000, help="simulated devices in total")
+    parser.add_argument("--lora", type=float, default=0.5, help="fraction of LoRa (ard.py) devices; the rest are Pis")
+    parser.add_argument("--rate", type=float, default=1.0, help="samples per second per device")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to run")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes")
+    parser.add_argument("--connections", type=int, default=50, help="keep-alive connections per process")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds before a request counts as timed out")
+    args = parser.parse_args()
+    if urlsplit(args.url).scheme != "http":
+        parser.error("only http:// URLs are supported")
+
+    lora_total = round(args.devices * args.lora)
+    jobs = []
+    for i in range(args.processes):
+        lora = lora_total // args.processes + (i < lora_total % args.processes)
+        pi = (args.devices - lora_total) // args.processes + (i < (args.devices - lora_total) % args.processes)
+        # Device ids are unique across processes: p<process>-lora-<n>, p<process>-pi-<n>
+        jobs.append((args.url, lora, pi, args.rate, args.duration, args.connections, args.timeout, f"p{i}-"))
+
+    print(f"{args.devices} devices ({lora_total} LoRa, {args.devices - lora_total} Pi) at {args.rate}/s each "
+          f"for {args.duration}s: {args.processes} process(es) x {args.connections} connections")
+    started = time.perf_counter()
+    if args.processes == 1:
+        results = [_run_process(jobs[0])]
+    else:
+        with ProcessPoolExecutor(args.processes) as executor:
+            results = list(executor.map(_run_process, jobs))
+    elapsed = time.perf_counter() - started - 0.5
+
+    latencies = sorted(latency for result, _ in results for latency in result)
+    outcomes = sum((counts for _, counts in results), Counter())
+    sent = sum(outcomes.values())
+    ok = outcomes["ok"]
+    print(f"sent {sent}  ok {ok}  throughput {ok / elapsed:.0f}/s (offered {args.devices * args.rate:.0f}/s)")
+    print(f"errors {sent - ok} ({(sent - ok) / sent * 100 if sent else 0:.2f}%)"
+          + "".join(f"  {kind} {count}" for kind, count in sorted(outcomes.items()) if kind != "ok"))
+    print("latency (answered)  " + "  ".join(
+        f"{label} {percentile(latencies, pct) * 1000:.1f} ms"
+        for label, pct in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))
+    ))
+
+
+if __name__ == "__main__":
+    main()
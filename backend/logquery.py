@@ -0,0 +1,87 @@
+"""Compile /api/logs filter parameters into parameterized SQL conditions.
+
+Supported parameters (all optional, combined with AND):
+
+    source=arduino            exact source (repeat or comma-separate for several)
+    device=sat-7              exact device id (repeat or comma-separate for several)
+    from=..., to=...          time range, ISO 8601 or epoch seconds (to is exclusive)
+    filter=pressure<800       channel predicate; repeat or comma-separate,
+                              operators < <= > >= = !=
+
+The keyset cursors (since_id / before_id) are added by app.api_logs.
+``partition_bounds`` turns the same parameters into the arguments for
+partitions.source(), so only partitions that can match are read.
+
+Column names are checked against schema.CHANNELS and values are bound as
+parameters, so nothing from the request is interpolated into SQL. A channel
+predicate implies ``channel IS NOT NULL``, which lets SQLite use that
+channel's partial index from schema.INDEXES; likewise ``device = ?`` implies
+``device IS NOT NULL`` for the per-device indexes.
+"""
+import re
+
+from schema import CHANNELS
+from timeutil import parse_time
+
+_PREDICATE = re.compile(r"^\s*([a-z]+)\s*(<=|>=|!=|<|>|=)\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*$")
+
+
+def _split(values):
+    return [part.strip() for value in values for part in value.split(",") if part.strip()]
+
+
+def parse_predicate(text):
+    """'pressure<800' -> ('pressure', '<', 800.0), raising ValueError if invalid"""
+    match = _PREDICATE.match(text)
+    if not match:
+        raise ValueError(f"Invalid filter: {text!r} (expected e.g. pressure<800)")
+    column, op, value = match.groups()
+    if column not in CHANNELS:
+        raise ValueError(f"Unknown channel in filter: {column}")
+    return column, op, float(value)
+
+
+def _time(args, name):
+    value = args.get(name)
+    if not value:
+        return None
+    try:
+        return parse_time(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO 8601 time or epoch seconds")
+
+
+def partition_bounds(args):
+    """partitions.source() keyword arguments for a request's query args"""
+    return {
+        "from_us": _time(args, "from"),
+        "to_us": _time(args, "to"),
+        "sources": _split(args.getlist("source")),
+    }
+
+
+def build_filters(args):
+    """Return (clauses, params) for a request's query args, raising ValueError if invalid"""
+    clauses = []
+    params = []
+
+    for column in ("source", "device"):
+        values = _split(args.getlist(column))
+        if len(values) == 1:
+            clauses.append(f"{column} = ?")
+        elif values:
+            clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+        params.extend(values)
+
+    for name, op in (("from", ">="), ("to", "<")):
+        value = _time(args, name)
+        if value is not None:
+            clauses.append(f"timestamp {op} ?")
+            params.append(value)
+
+    for text in _split(args.getlist("filter")):
+        column, op, value = parse_predicate(text)
+        clauses.append(f"{column} {'<>' if op == '!=' else op} ?")
+        params.append(value)
+
+    return clauses, params
@@ -0,0 +1,57 @@
+"""Parser for the LoRa telemetry frames sent by the Arduino (see ard.py).
+
+A frame is a comma-separated list of ``KEY:valueUNIT`` tokens, e.g.
+
+    T:25.00C, P:1013.25hPa, AX:0.01, AY:-0.02, AZ:0.98, GX:12.34, ...
+
+The whole frame is tokenized with a single compiled regex pass and mapped
+onto a ``LoraFrame`` record. Every ingest path (HTTP handlers, bulk loaders)
+should go through ``parse_frame`` so they agree on what a valid frame is.
+"""
+import math
+import re
+from typing import NamedTuple, Optional
+
+# KEY:value pairs; any unit suffix after the number is skipped by findall
+_TOKEN = re.compile(r"([A-Z]+):\s*([-+]?(?:\d+\.?\d*|\.\d+))")
+
+# Frame keys, in LoraFrame field order
+KEYS = ("T", "P", "AX", "AY", "AZ", "GX", "GY", "GZ", "MX", "MY", "MZ")
+
+# Channels a frame must carry to be stored
+REQUIRED = ("P", "GX", "GY", "GZ")
+
+
+class LoraFrame(NamedTuple):
+    """All channels of one LoRa frame; channels missing from the frame are None"""
+    temperature: Optional[float] = None
+    pressure: Optional[float] = None
+    ax: Optional[float] = None
+    ay: Optional[float] = None
+    az: Optional[float] = None
+    gx: Optional[float] = None
+    gy: Optional[float] = None
+    gz: Optional[float] = None
+    mx: Optional[float] = None
+    my: Optional[float] = None
+    mz: Optional[float] = None
+
+
+def parse_frame(data):
+    """Parse one frame into a LoraFrame, raising ValueError if it is unusable"""
+    if not isinstance(data, str):
+        raise ValueError("Invalid data format")
+
+    # Unknown keys are ignored; a repeated key keeps its last value
+    values = dict(_TOKEN.findall(data))
+    for key in REQUIRED:
+        if key not in values:
+            raise ValueError("Missing required fields")
+    frame = LoraFrame._make([
+        float(value) if value is not None else None
+        for value in map(values.get, KEYS)
+    ])
+    # An overlong run of digits parses as inf
+    if not all(math.isfinite(value) for value in frame if value is not None):
+        raise ValueError("Invalid numeric values")
+    return frame
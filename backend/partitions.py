@@ -0,0 +1,256 @@
+"""Time-partitioned telemetry storage with per-source retention.
+
+Rows live in one table per source and UTC day (``telemetry_YYYYMMDD_N``),
+listed in the ``partitions`` registry with their row count and id range.
+``telemetry`` is a view over every live partition, so ad-hoc queries keep
+working unchanged; the hot read paths call ``source()`` instead to get a
+FROM clause over just the partitions a time range, source list or id
+cursor can touch. SQLite merges the per-partition index scans
+(``MERGE (UNION ALL)``), so ORDER BY id / timestamp with a LIMIT stays
+cheap across partitions -- as long as every ORDER BY column is also in the
+select list; otherwise it sorts the whole union in a temp b-tree.
+
+Retention is configured per source in ``RETENTION``, e.g.
+``GPS=30d,arduino=7d,*=90d`` (``*`` covers every other source; sources
+not covered are kept forever). Expiring a day is never a DELETE: the
+partition is first detached (dropped from the registry's live set and the
+view) and its table is dropped by a later expiry run, once any reader that
+might still be routed to it has long finished. Expiry runs at startup and
+whenever the writer opens a new partition, i.e. at least once per source
+per day.
+"""
+import logging
+import os
+import time
+from collections import defaultdict
+
+from schema import COLUMNS, EMPTY_PARTITION, geo_table, partition_ddl
+from timeutil import now_us, parse_duration
+
+log = logging.getLogger(__name__)
+
+DAY_US = 86_400_000_000
+
+# A detached partition's table is only dropped after this long
+DROP_GRACE_US = 60_000_000
+
+# SQLite allows at most 500 terms in one compound SELECT
+_MAX_TERMS = 400
+
+_INSERT_COLUMNS = ", ".join(("id",) + COLUMNS)
+_INSERT_VALUES = ", ".join("?" * (1 + len(COLUMNS)))
+# Positions in an (id,) + make_row tuple
+_LATITUDE = 1 + COLUMNS.index("latitude")
+_LONGITUDE = 1 + COLUMNS.index("longitude")
+
+
+def parse_retention(value):
+    """'GPS=30d,arduino=7d,*=90d' -> {source or '*': microseconds}"""
+    policy = {}
+    for part in (value or "").split(","):
+        if not part.strip():
+            continue
+        source, sep, duration = part.partition("=")
+        if not sep or not source.strip():
+            raise ValueError(f"Invalid RETENTION entry: {part!r} (expected source=duration)")
+        policy[source.strip()] = parse_duration(duration)
+    return policy
+
+
+RETENTION = parse_retention(os.getenv("RETENTION", ""))
+
+
+def retention_for(source):
+    """Retention of a source in microseconds, or None to keep it forever"""
+    return RETENTION.get(source, RETENTION.get("*"))
+
+
+def _union(names):
+    if len(names) <= _MAX_TERMS:
+        return " UNION ALL ".join(f"SELECT * FROM {name}" for name in names)
+    chunks = [names[i:i + _MAX_TERMS] for i in range(0, len(names), _MAX_TERMS)]
+    return " UNION ALL ".join(f"SELECT * FROM ({_union(chunk)})" for chunk in chunks)
+
+
+def _live(conn):
+    return [row[0] for row in conn.execute(
+        "SELECT name FROM partitions WHERE detached IS NULL ORDER BY day, id"
+    )]
+
+
+def refresh_view(conn):
+    """Point the ``telemetry`` view at the live partitions; run inside a transaction"""
+    conn.execute("DROP VIEW IF EXISTS telemetry")
+    conn.execute(f"CREATE VIEW telemetry AS {_union(_live(conn) or [EMPTY_PARTITION])}")
+
+
+def create(conn, source, day, indexes=True):
+    """Create and register the partition for (source, day); returns its table name.
+
+    With ``indexes=False`` only the table is created; bulk loaders add the
+    indexes afterwards with ``create_indexes`` (and schema.init_db adds any
+    that are missing at startup).
+    """
+    partition_id = conn.execute(
+        "INSERT INTO partitions (name, source, day) VALUES ('', ?, ?)", (source, day)
+    ).lastrowid
+    name = f"telemetry_{time.strftime('%Y%m%d', time.gmtime(day // 1_000_000))}_{partition_id}"
+    conn.execute("UPDATE partitions SET name = ? WHERE id = ?", (name, partition_id))
+    for sql in partition_ddl(name)[:None if indexes else 1]:
+        conn.execute(sql)
+    return name
+
+
+def _has_geo(conn, name):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (geo_table(name),)
+    ).fetchone() is not None
+
+
+def _fill_geo(conn, name):
+    conn.execute(
+        f"INSERT INTO {geo_table(name)} SELECT id, latitude, latitude, longitude, longitude "
+        f"FROM {name} WHERE latitude IS NOT NULL AND longitude IS NOT NULL"
+    )
+
+
+def create_indexes(conn, name):
+    """Create a partition's indexes if they are missing, filling a new R*Tree"""
+    fill = not _has_geo(conn, name)
+    for sql in partition_ddl(name)[1:]:
+        conn.execute(sql)
+    if fill:
+        _fill_geo(conn, name)
+
+
+def _partition(conn, source, day, indexes=True):
+    row = conn.execute(
+        "SELECT name FROM partitions WHERE source IS ? AND day = ? AND detached IS NULL",
+        (source, day),
+    ).fetchone()
+    if row:
+        return row[0]
+    # A new day (or a new source) is the natural time to let old days go
+    expire(conn)
+    name = create(conn, source, day, indexes)
+    refresh_view(conn)
+    log.info("Opened partition %s", name)
+    return name
+
+
+def insert(conn, rows, indexes=True):
+    """Store make_row tuples in their partitions; returns the id of the first row.
+
+    Ids are handed out consecutively in row order. Runs inside the
+    caller's transaction and must only be called by one writer at a time.
+    Partitions opened with ``indexes=False`` are created without indexes,
+    and the rows' GPS fixes are left out of their (missing) R*Tree until
+    ``create_indexes`` builds it; partitions that already have one get
+    their fixes added either way.
+    """
+    first_id = conn.execute("SELECT last_id FROM telemetry_seq").fetchone()[0] + 1
+    groups = defaultdict(list)
+    for row_id, row in enumerate(rows, start=first_id):
+        ts = row[0]
+        groups[row[1], ts - ts % DAY_US].append((row_id,) + row)
+    for (source, day), group in groups.items():
+        name = _partition(conn, source, day, indexes)
+        conn.executemany(f"INSERT INTO {name} ({_INSERT_COLUMNS}) VALUES ({_INSERT_VALUES})", group)
+        if indexes or _has_geo(conn, name):
+            conn.executemany(f"INSERT INTO {geo_table(name)} VALUES (?, ?, ?, ?, ?)", [
+                (row[0], row[_LATITUDE], row[_LATITUDE], row[_LONGITUDE], row[_LONGITUDE])
+                for row in group if row[_LATITUDE] is not None and row[_LONGITUDE] is not None
+            ])
+        conn.execute(
+            "UPDATE partitions SET rows = rows + ?, min_id = COALESCE(min_id, ?), max_id = ? WHERE name = ?",
+            (len(group), group[0][0], group[-1][0], name),
+        )
+    conn.execute("UPDATE telemetry_seq SET last_id = ?", (first_id + len(rows) - 1,))
+    return first_id
+
+
+def last_id(conn):
+    """Highest id handed out so far"""
+    return conn.execute("SELECT last_id FROM telemetry_seq").fetchone()[0]
+
+
+def row_count(conn):
+    """Exact number of rows in the live partitions"""
+    return conn.execute("SELECT COALESCE(SUM(rows), 0) FROM partitions WHERE detached IS NULL").fetchone()[0]
+
+
+def expire(conn, now=None):
+    """Apply the retention policy; run inside a transaction.
+
+    Drops the tables of partitions detached more than DROP_GRACE_US ago and
+    detaches the partitions whose whole day is past their source's
+    retention. Returns the names detached.
+    """
+    now = now_us() if now is None else now
+    for partition_id, name in conn.execute(
+        "SELECT id, name FROM partitions WHERE detached < ?", (now - DROP_GRACE_US,)
+    ).fetchall():
+        conn.execute(f"DROP TABLE IF EXISTS {name}")
+        conn.execute(f"DROP TABLE IF EXISTS {geo_table(name)}")
+        conn.execute("DELETE FROM partitions WHERE id = ?", (partition_id,))
+        log.info("Dropped partition %s", name)
+
+    if not RETENTION:
+        return []
+    expired = []
+    for partition_id, name, source, day in conn.execute(
+        "SELECT id, name, source, day FROM partitions WHERE detached IS NULL"
+    ).fetchall():
+        keep = retention_for(source)
+        if keep is not None and day + DAY_US <= now - keep:
+            expired.append((partition_id, name))
+    if expired:
+        conn.executemany("UPDATE partitions SET detached = ? WHERE id = ?",
+                         [(now, partition_id) for partition_id, _ in expired])
+        refresh_view(conn)
+        log.info("Detached expired partitions: %s", ", ".join(name for _, name in expired))
+    return [name for _, name in expired]
+
+
+def source(conn, from_us=None, to_us=None, sources=None, after_id=None, before_id=None):
+    """FROM clause covering only the live partitions that can hold matching rows.
+
+    ``from_us`` / ``to_us`` bound the timestamp ([from, to)), ``sources`` is a
+    list of source names, and ``after_id`` / ``before_id`` are exclusive id
+    bounds. The caller still applies the same conditions in its WHERE
+    clause; this only skips partitions that cannot contribute.
+    """
+    if from_us is None and to_us is None and not sources and after_id is None and before_id is None:
+        return "telemetry"
+    return f"({_union(matching(conn, from_us, to_us, sources, after_id, before_id) or [EMPTY_PARTITION])})"
+
+
+def matching(conn, from_us=None, to_us=None, sources=None, after_id=None, before_id=None):
+    """Names of the live partitions that can hold matching rows (see ``source``), oldest day first"""
+    clauses = ["detached IS NULL"]
+    params = []
+    if from_us is not None:
+        clauses.append("day > ?")
+        params.append(from_us - DAY_US)
+    if to_us is not None:
+        clauses.append("day < ?")
+        params.append(to_us)
+    if sources:
+        clauses.append(f"source IN ({', '.join('?' * len(sources))})")
+        params.extend(sources)
+    if after_id is not None:
+        clauses.append("max_id > ?")
+        params.append(after_id)
+    if before_id is not None:
+        clauses.append("min_id < ?")
+        params.append(before_id)
+    return [row[0] for row in conn.execute(
+        f"SELECT name FROM partitions WHERE {' AND '.join(clauses)} ORDER BY day, id", params
+    )]
+
+
+def listing(conn):
+    """Registry rows for the API, oldest day first"""
+    return conn.execute(
+        "SELECT name, source, day, rows, min_id, max_id, detached FROM partitions ORDER BY day, id"
+    ).fetchall()
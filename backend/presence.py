@@ -0,0 +1,206 @@
+"""Online / offline detection for devices.
+
+A device goes offline when nothing has arrived from it for its timeout:
+``OFFLINE_AFTER`` seconds, or ``OFFLINE_MISSED`` of its usual intervals if
+that is longer, so slow reporters do not flap. The usual interval is a
+moving average of the gaps between the commits that carried the device.
+The next row from an offline device brings it back online.
+
+Deadlines sit in a min-heap with lazy rescheduling, holding one entry per
+online device. Ingest only moves the device's deadline in a dict, which is
+O(1); when a heap entry comes due for a device that has reported since, it
+is pushed back with the current deadline. A device therefore costs at most
+one O(log n) heap operation per timeout period however often it reports,
+and nothing ever scans all devices. One watcher thread sleeps until the
+earliest deadline.
+
+Times are taken on arrival (the commit), not from the rows' timestamps:
+a store-and-forward backlog with old capture times still means the device
+is talking to us again.
+"""
+import heapq
+import logging
+import os
+import threading
+import time
+
+from schema import COLUMNS
+from timeutil import now_us
+
+log = logging.getLogger(__name__)
+
+OFFLINE_AFTER = float(os.getenv("OFFLINE_AFTER", "30"))
+OFFLINE_MISSED = float(os.getenv("OFFLINE_MISSED", "3"))
+
+# Weight of the newest gap in a device's average interval
+_INTERVAL_WEIGHT = 0.2
+_DEVICE = COLUMNS.index("device")
+
+
+class PresenceMonitor:
+    def __init__(self, offline_after=OFFLINE_AFTER, missed=OFFLINE_MISSED, clock=time.monotonic):
+        self.offline_after = offline_after
+        self.missed = missed
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._thread = None
+        self._listeners = []
+        self._heap = []  # (deadline, device), one entry per online device
+        self._deadline = {}  # device -> deadline (clock seconds)
+        self._arrived = {}  # device -> (clock seconds, epoch microseconds) of its last commit
+        self._interval = {}  # device -> average seconds between its commits
+        self._offline = set()
+        self._since = {}  # device -> epoch microseconds of its last transition
+
+    def add_listener(self, listener):
+        """Call ``listener(changes)`` with the new status dicts (see ``status``) on transitions.
+
+        A device's first row counts as a transition to online.
+
+        Listeners run on the committing thread (online) or the watcher
+        thread (offline) while the monitor's lock is held, so they see the
+        transitions in order; they must be quick.
+        """
+        self._listeners.append(listener)
+
+    def track(self, devices):
+        """Start watching devices known before startup, as if they had just reported"""
+        now = self._clock()
+        wall = now_us()
+        with self._cond:
+            for device in devices:
+                if device not in self._arrived:
+                    self._arrived[device] = (now, wall)
+                    self._since[device] = wall
+                    self._schedule(device, now + self.offline_after)
+        self._ensure_started()
+
+    def apply(self, committed):
+        """Ingest listener: reset the deadline of every device in a commit"""
+        devices = {row[_DEVICE] for _, row in committed} - {None}
+        if not devices:
+            return
+        now = self._clock()
+        wall = now_us()
+        changes = []
+        with self._cond:
+            for device in devices:
+                previous = self._arrived.get(device)
+                self._arrived[device] = (now, wall)
+                # The gap of an outage says nothing about the usual interval
+                if previous is not None and device not in self._offline:
+                    gap = now - previous[0]
+                    interval = self._interval.get(device)
+                    self._interval[device] = gap if interval is None else (
+                        interval + _INTERVAL_WEIGHT * (gap - interval))
+                deadline = now + self._timeout(device)
+                if previous is None or device in self._offline:
+                    self._offline.discard(device)
+                    self._since[device] = wall
+                    changes.append(self._status(device))
+                if device in self._deadline:
+                    # Its heap entry stays put; the watcher reschedules it when due
+                    self._deadline[device] = deadline
+                else:
+                    self._schedule(device, deadline)
+            self._notify(changes)
+        self._ensure_started()
+
+    def status(self, device):
+        """{device, status, since, last_arrival, timeout} of one device, or None if never seen.
+
+        ``since`` (the last transition) and ``last_arrival`` are epoch
+        microseconds; ``timeout`` is in seconds.
+        """
+        with self._cond:
+            if device not in self._arrived:
+                return None
+            return self._status(device)
+
+    def summary(self):
+        """Device counts and the status of every offline device, longest offline first"""
+        with self._cond:
+            offline = sorted(self._offline, key=self._since.__getitem__)
+            return {
+                "online": len(self._deadline),
+                "offline": len(offline),
+                "offline_devices": [self._status(device) for device in offline],
+            }
+
+    def stop(self, timeout=5.0):
+        thread = self._thread
+        if thread is None:
+            return
+        with self._cond:
+            self._thread = None
+            self._cond.notify()
+        thread.join(timeout)
+
+    def _timeout(self, device):
+        interval = self._interval.get(device)
+        return self.offline_after if interval is None else max(self.offline_after, self.missed * interval)
+
+    def _schedule(self, device, deadline):
+        """Give a device a heap entry; caller holds the lock"""
+        self._deadline[device] = deadline
+        heapq.heappush(self._heap, (deadline, device))
+        if self._heap[0][1] == device:
+            # Earlier than what the watcher sleeps for
+            self._cond.notify()
+
+    def _status(self, device):
+        """{device, status, since, last_arrival, timeout}; times in epoch microseconds"""
+        return {
+            "device": device,
+            "status": "offline" if device in self._offline else "online",
+            "since": self._since[device],
+            "last_arrival": self._arrived[device][1],
+            "timeout": round(self._timeout(device), 3),
+        }
+
+    def _notify(self, changes):
+        """Run the listeners; caller holds the lock"""
+        if not changes:
+            return
+        for listener in self._listeners:
+            try:
+                listener(changes)
+            except Exception:
+                log.exception("Presence listener %r failed", listener)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="presence-watcher", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        me = threading.current_thread()
+        while True:
+            with self._cond:
+                if self._thread is not me:
+                    return
+                changes = []
+                now = self._clock()
+                while self._heap and self._heap[0][0] <= now:
+                    _, device = heapq.heappop(self._heap)
+                    deadline = self._deadline[device]
+                    if deadline > now:
+                        # Reported since this entry was pushed
+                        heapq.heappush(self._heap, (deadline, device))
+                    else:
+                        del self._deadline[device]
+                        self._offline.add(device)
+                        # When the deadline passed, however late the watcher woke
+                        arrived, arrived_us = self._arrived[device]
+                        self._since[device] = arrived_us + round((deadline - arrived) * 1_000_000)
+                        changes.append(self._status(device))
+                if changes:
+                    self._notify(changes)
+                else:
+                    self._cond.wait(self._heap[0][0] - now if self._heap else None)
+
+
+monitor = PresenceMonitor()
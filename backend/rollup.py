@@ -0,0 +1,191 @@
+"""Continuous aggregates of telemetry at 1m / 5m / 1h resolution.
+
+The ingest writer calls ``apply()`` inside the same transaction that
+inserts the raw rows, so the rollup tables (schema.ROLLUP_TABLES) are never
+ahead of or behind ``telemetry``. Each batch is first reduced in memory to
+one partial per bucket, then merged into the stored bucket with an UPSERT.
+The merge is order-independent (min, max, sum and count combine in any
+order; ``last`` only moves forward in time), so late and out-of-order
+samples land in the right bucket with the right result.
+
+``rebuild()`` recomputes the tables from raw rows, for the schema migration
+and after bulk loads that bypass the writer.
+"""
+from schema import CHANNELS, COLUMNS, ROLLUP_STATS, ROLLUPS, rollup_columns
+
+_WIDTH = len(ROLLUP_STATS)
+# Offsets of each stat inside a channel's slot of a partial
+_MIN, _MAX, _SUM, _COUNT, _LAST, _LAST_TS = range(_WIDTH)
+
+# Where the channels start in a make_row tuple
+_FIRST_CHANNEL = COLUMNS.index(CHANNELS[0])
+
+FINEST = ROLLUPS[0]
+COARSEST = ROLLUPS[-1]
+
+
+def table(name):
+    return f"rollup_{name}"
+
+
+def _merge_sql(channel):
+    # min()/max() with a NULL argument return NULL, hence the COALESCE fallbacks
+    c = channel
+    return (
+        f"{c}_min = COALESCE(min({c}_min, excluded.{c}_min), {c}_min, excluded.{c}_min), "
+        f"{c}_max = COALESCE(max({c}_max, excluded.{c}_max), {c}_max, excluded.{c}_max), "
+        f"{c}_sum = {c}_sum + excluded.{c}_sum, "
+        f"{c}_count = {c}_count + excluded.{c}_count, "
+        f"{c}_last = CASE WHEN excluded.{c}_last_ts >= COALESCE({c}_last_ts, excluded.{c}_last_ts) "
+        f"THEN excluded.{c}_last ELSE {c}_last END, "
+        f"{c}_last_ts = COALESCE(max({c}_last_ts, excluded.{c}_last_ts), {c}_last_ts, excluded.{c}_last_ts)"
+    )
+
+
+_UPSERT = {
+    name: (
+        f"INSERT INTO {table(name)} (bucket, {', '.join(rollup_columns())}) "
+        f"VALUES ({', '.join('?' * (1 + len(rollup_columns())))}) "
+        f"ON CONFLICT(bucket) DO UPDATE SET {', '.join(_merge_sql(c) for c in CHANNELS)}"
+    )
+    for name, _ in ROLLUPS
+}
+
+
+def _empty():
+    return [None, None, 0.0, 0, None, None] * len(CHANNELS)
+
+
+def _partials(rows, size):
+    """Reduce make_row tuples to {bucket: flat stats list in rollup_columns() order}"""
+    partials = {}
+    for row in rows:
+        ts = row[0]
+        bucket = ts - ts % size
+        acc = partials.get(bucket)
+        if acc is None:
+            acc = partials[bucket] = _empty()
+        j = 0
+        for value in row[_FIRST_CHANNEL:]:  # the channels, in CHANNELS order
+            if value is not None:
+                if acc[j + _COUNT]:
+                    if value < acc[j + _MIN]:
+                        acc[j + _MIN] = value
+                    if value > acc[j + _MAX]:
+                        acc[j + _MAX] = value
+                    # Equal timestamps: the later row of the batch wins
+                    if ts >= acc[j + _LAST_TS]:
+                        acc[j + _LAST] = value
+                        acc[j + _LAST_TS] = ts
+                else:
+                    acc[j + _MIN] = acc[j + _MAX] = acc[j + _LAST] = value
+                    acc[j + _LAST_TS] = ts
+                acc[j + _SUM] += value
+                acc[j + _COUNT] += 1
+            j += _WIDTH
+    return partials
+
+
+def _coarsen(partials, size):
+    """Merge finer partials into buckets of ``size``"""
+    coarse = {}
+    for bucket, part in partials.items():
+        bucket -= bucket % size
+        acc = coarse.get(bucket)
+        if acc is None:
+            coarse[bucket] = list(part)
+            continue
+        for j in range(0, len(part), _WIDTH):
+            if not part[j + _COUNT]:
+                continue
+            if not acc[j + _COUNT]:
+                acc[j:j + _WIDTH] = part[j:j + _WIDTH]
+                continue
+            acc[j + _MIN] = min(acc[j + _MIN], part[j + _MIN])
+            acc[j + _MAX] = max(acc[j + _MAX], part[j + _MAX])
+            acc[j + _SUM] += part[j + _SUM]
+            acc[j + _COUNT] += part[j + _COUNT]
+            if part[j + _LAST_TS] >= acc[j + _LAST_TS]:
+                acc[j + _LAST] = part[j + _LAST]
+                acc[j + _LAST_TS] = part[j + _LAST_TS]
+    return coarse
+
+
+def apply(conn, rows):
+    """Ingest transaction hook: merge make_row tuples into every rollup"""
+    partials = _partials(rows, FINEST[1])
+    for name, size in ROLLUPS:
+        if size != FINEST[1]:
+            partials = _coarsen(partials, size)
+        conn.executemany(_UPSERT[name], [(bucket, *stats) for bucket, stats in partials.items()])
+
+
+def pick(bucket_us):
+    """Coarsest rollup whose buckets tile ``bucket_us`` exactly, as (name, size), or None"""
+    for name, size in reversed(ROLLUPS):
+        if bucket_us % size == 0:
+            return name, size
+    return None
+
+
+def combine_sql(channel):
+    """Aggregate expressions merging rollup rows into (min, max, sum, count, last, last_ts)"""
+    c = channel
+    return (
+        f"MIN({c}_min)", f"MAX({c}_max)", f"SUM({c}_sum)", f"SUM({c}_count)",
+        # Buckets never share a timestamp, so the newest last_ts decides alone
+        f"CAST(substr(MAX(CASE WHEN {c}_last_ts IS NOT NULL "
+        f"THEN printf('%020d%!.17g', {c}_last_ts, {c}_last) END), 21) AS REAL)",
+        f"MAX({c}_last_ts)",
+    )
+
+
+def raw_sql(channel):
+    """The same expressions computed from raw telemetry rows"""
+    c = channel
+    return (
+        f"MIN({c})", f"MAX({c})", f"TOTAL({c})", f"COUNT({c})",
+        # Latest value by (timestamp, id), matching how the writer breaks ties:
+        # prefix each value with both, zero-padded, take the MAX string and
+        # strip the prefix again
+        f"CAST(substr(MAX(CASE WHEN {c} IS NOT NULL "
+        f"THEN printf('%020d%020d%!.17g', timestamp, id, {c}) END), 41) AS REAL)",
+        f"MAX(CASE WHEN {c} IS NOT NULL THEN timestamp END)",
+    )
+
+
+def rebuild(conn, from_us=None, to_us=None):
+    """Recompute the rollups from telemetry, for every bucket or those covering [from, to).
+
+    The range is widened to whole buckets of the coarsest rollup. Runs in the
+    caller's transaction.
+    """
+    grid = COARSEST[1]
+    start = None if from_us is None else from_us - from_us % grid
+    end = None if to_us is None else to_us + (-to_us % grid)
+    bounds = []
+    params = []
+    if start is not None:
+        bounds.append("{column} >= ?")
+        params.append(start)
+    if end is not None:
+        bounds.append("{column} < ?")
+        params.append(end)
+
+    def where(column):
+        return ("WHERE " + " AND ".join(bounds).format(column=column)) if bounds else ""
+
+    columns = ", ".join(rollup_columns())
+    for name, size in ROLLUPS:
+        conn.execute(f"DELETE FROM {table(name)} {where('bucket')}", params)
+        if size == FINEST[1]:
+            stats = ", ".join(expr for c in CHANNELS for expr in raw_sql(c))
+            source, column = "telemetry", "timestamp"
+        else:
+            stats = ", ".join(expr for c in CHANNELS for expr in combine_sql(c))
+            source, column = table(FINEST[0]), "bucket"
+        conn.execute(
+            f"INSERT INTO {table(name)} (bucket, {columns}) "
+            f"SELECT {column} / {size} * {size} AS b, {stats} FROM {source} {where(column)} GROUP BY b",
+            params,
+        )
@@ -0,0 +1,357 @@
+"""Database schema and in-place migrations.
+
+The schema version lives in ``PRAGMA user_version``. ``init_db`` creates a
+fresh database at the current version or upgrades an existing
+``telemetry.db`` step by step, each step in its own transaction.
+"""
+import logging
+
+from timeutil import from_iso
+
+log = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 6
+
+# Sensor channels, in table column order
+CHANNELS = (
+    "temperature", "humidity", "latitude", "longitude", "pressure",
+    "gx", "gy", "gz", "ax", "ay", "az", "mx", "my", "mz",
+)
+
+# Column order of every row passed to the writer (see ingest.make_row)
+COLUMNS = ("timestamp", "source", "device") + CHANNELS
+
+# device comes last so tables created before it (and given it with ADD
+# COLUMN) have the same column order as new ones; the view unions them
+TABLE = (
+    "CREATE TABLE IF NOT EXISTS telemetry ("
+    "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+    "timestamp INTEGER NOT NULL, "  # epoch microseconds, UTC
+    "source TEXT, "
+    + ", ".join(f"{channel} REAL" for channel in CHANNELS)
+    + ", device TEXT"  # satellite / node id; NULL for rows from before devices
+    ")"
+)
+
+# Each "latest non-null X" lookup walks one of these partial indexes backwards
+# from its newest entry, and the index carries the value itself, so the
+# lookup never touches the table.
+INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_telemetry_timestamp ON telemetry (timestamp)",
+    # Rows of one source in id order (the rowid is the implicit last column)
+    "CREATE INDEX IF NOT EXISTS idx_telemetry_source ON telemetry (source)",
+    # One device's rows in id order (/api/logs?device=) and in time order
+    # (?device=&from=&to=, /api/history?device=)
+    "CREATE INDEX IF NOT EXISTS idx_telemetry_device ON telemetry (device) WHERE device IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS idx_telemetry_device_time ON telemetry (device, timestamp) "
+    "WHERE device IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS idx_telemetry_temperature ON telemetry (timestamp, temperature) "
+    "WHERE temperature IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS idx_telemetry_humidity ON telemetry (timestamp, humidity) "
+    "WHERE humidity IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS idx_telemetry_pressure ON telemetry (timestamp, pressure) "
+    "WHERE pressure IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS idx_telemetry_location ON telemetry (timestamp, latitude, longitude) "
+    "WHERE latitude IS NOT NULL AND longitude IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS idx_telemetry_gyro ON telemetry (timestamp, gx, gy, gz) "
+    "WHERE gx IS NOT NULL AND gy IS NOT NULL AND gz IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS idx_telemetry_accel ON telemetry (timestamp, ax, ay, az) "
+    "WHERE ax IS NOT NULL AND ay IS NOT NULL AND az IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS idx_telemetry_mag ON telemetry (timestamp, mx, my, mz) "
+    "WHERE mx IS NOT NULL AND my IS NOT NULL AND mz IS NOT NULL",
+)
+
+# Rows are stored in one table per source and UTC day (see partitions.py),
+# each with the columns and indexes above; ``telemetry`` is a view over them.
+# Ids come from telemetry_seq, so they stay unique across partitions.
+PARTITIONS = (
+    "CREATE TABLE IF NOT EXISTS partitions ("
+    "id INTEGER PRIMARY KEY, "
+    "name TEXT NOT NULL UNIQUE, "
+    "source TEXT, "  # NULL for rows stored without a source
+    "day INTEGER NOT NULL, "  # start of the UTC day, epoch microseconds
+    "rows INTEGER NOT NULL DEFAULT 0, "
+    "min_id INTEGER, "
+    "max_id INTEGER, "
+    "detached INTEGER"  # when retention took it out of the view, epoch microseconds
+    ")"
+)
+ID_SEQUENCE = "CREATE TABLE IF NOT EXISTS telemetry_seq (last_id INTEGER NOT NULL)"
+# Stands in for the view's contents while there are no partitions
+EMPTY_PARTITION = "telemetry_empty"
+
+
+def geo_table(name):
+    return f"{name}_geo"
+
+
+def geo_ddl(name):
+    """Spatial index of a partition's GPS fixes (see geo.py).
+
+    An R*Tree of one degenerate box per fix, keyed by row id. R*Tree
+    coordinates are 32-bit floats rounded outwards, so matches are refined
+    against the row's exact latitude / longitude. Unlike the b-tree indexes
+    it is filled by partitions.insert (and create_indexes), not by SQLite.
+    """
+    return (f"CREATE VIRTUAL TABLE IF NOT EXISTS {geo_table(name)} "
+            "USING rtree(id, min_lat, max_lat, min_lon, max_lon)")
+
+
+def partition_ddl(name):
+    """CREATE statements for one partition table and its indexes"""
+    table = TABLE.replace(" AUTOINCREMENT", "").replace("telemetry (", f"{name} (", 1)
+    return (table,) + tuple(
+        sql.replace("idx_telemetry_", f"idx_{name}_").replace(" ON telemetry (", f" ON {name} (")
+        for sql in INDEXES
+    ) + (geo_ddl(name),)
+
+
+# Latest value of every channel group per device (see snapshot.py), written
+# in the ingest transaction so the in-memory cache can be seeded in
+# O(devices) instead of searching every partition. Rows without a device
+# are kept under ''. v1..v3 hold the group's values in snapshot.GROUPS order.
+DEVICE_LATEST = (
+    "CREATE TABLE IF NOT EXISTS device_latest ("
+    "device TEXT NOT NULL, "
+    "grp TEXT NOT NULL, "
+    "timestamp INTEGER NOT NULL, "
+    "v1 REAL, v2 REAL, v3 REAL, "
+    "PRIMARY KEY (device, grp)"
+    ") WITHOUT ROWID"
+)
+
+
+# Fixes per cell of the track-density heatmap (see heatmap.py): every map
+# tile at every heatmap zoom is split into a grid of cells, and a cell id
+# holds its tile before its place in the tile, so one tile's cells are one
+# range of the key. Kept when retention drops raw rows, like the rollups.
+HEAT_CELLS = (
+    "CREATE TABLE IF NOT EXISTS heat_cells ("
+    "zoom INTEGER NOT NULL, "
+    "cell INTEGER NOT NULL, "
+    "count INTEGER NOT NULL, "
+    "PRIMARY KEY (zoom, cell)"
+    ") WITHOUT ROWID"
+)
+
+
+# Marker clusters of GPS fixes per map zoom and grid cell (see clusters.py):
+# enough to merge further fixes in any order, i.e. the count, coordinate
+# sums for the centroid and the time range. Cell ids run along grid rows.
+GEO_CLUSTERS = (
+    "CREATE TABLE IF NOT EXISTS geo_clusters ("
+    "zoom INTEGER NOT NULL, "
+    "cell INTEGER NOT NULL, "
+    "count INTEGER NOT NULL, "
+    "lat_sum REAL NOT NULL, "
+    "lon_sum REAL NOT NULL, "
+    "first_ts INTEGER NOT NULL, "
+    "last_ts INTEGER NOT NULL, "
+    "PRIMARY KEY (zoom, cell)"
+    ") WITHOUT ROWID"
+)
+
+
+# Continuous aggregates of telemetry, one table per resolution (see rollup.py).
+# Each row is one bucket; per channel it keeps enough to merge further
+# samples in any order: min, max, sum, count and the latest value with its
+# timestamp.
+ROLLUPS = (
+    ("1m", 60_000_000),
+    ("5m", 300_000_000),
+    ("1h", 3_600_000_000),
+)
+# Stat -> column type; every channel gets one column per stat
+ROLLUP_STATS = {
+    "min": "REAL",
+    "max": "REAL",
+    "sum": "REAL NOT NULL DEFAULT 0",
+    "count": "INTEGER NOT NULL DEFAULT 0",
+    "last": "REAL",
+    "last_ts": "INTEGER",
+}
+
+
+def rollup_columns():
+    """Stat columns of a rollup table, channel by channel"""
+    return tuple(f"{channel}_{stat}" for channel in CHANNELS for stat in ROLLUP_STATS)
+
+
+ROLLUP_TABLES = tuple(
+    f"CREATE TABLE IF NOT EXISTS rollup_{name} ("
+    "bucket INTEGER PRIMARY KEY, "  # bucket start, epoch microseconds
+    + ", ".join(f"{channel}_{stat} {kind}" for channel in CHANNELS for stat, kind in ROLLUP_STATS.items())
+    + ")"
+    for name, _ in ROLLUPS
+)
+
+
+def init_db(conn):
+    """Create or upgrade the schema on an open connection"""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type IN ('table', 'view') AND name = 'telemetry'"
+    ).fetchone()
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+    import partitions
+
+    if not exists:
+        with conn:
+            conn.execute("BEGIN")
+            for sql in (PARTITIONS, ID_SEQUENCE, DEVICE_LATEST, HEAT_CELLS, GEO_CLUSTERS) + partition_ddl(EMPTY_PARTITION) + ROLLUP_TABLES:
+                conn.execute(sql)
+            conn.execute("INSERT INTO telemetry_seq VALUES (0)")
+            partitions.refresh_view(conn)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        return
+
+    if version < 1:
+        _migrate_to_1(conn)
+    if version < 2:
+        _migrate_to_2(conn)
+    if version < 3:
+        _migrate_to_3(conn)
+    if version < 4:
+        _migrate_to_4(conn)
+    if version < 5:
+        _migrate_to_5(conn)
+    if version < 6:
+        _migrate_to_6(conn)
+
+    # Indexes added without a schema change are created on the next start
+    with conn:
+        names = [row[0] for row in conn.execute("SELECT name FROM partitions")]
+        for name in names + [EMPTY_PARTITION]:
+            partitions.create_indexes(conn, name)
+
+
+def _legacy_to_us(value):
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        return from_iso(value, assume_local=True)
+    except ValueError:
+        return None
+
+
+def _migrate_to_1(conn):
+    """ISO TEXT timestamps (naive local time) -> indexed INTEGER epoch microseconds"""
+    log.info("Migrating telemetry to integer epoch timestamps")
+    # Tables from before the full LoRa frame was stored lack some channels
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(telemetry)")}
+    columns = ["id", "source"] + [c for c in CHANNELS if c in existing]
+
+    conn.create_function("legacy_to_us", 1, _legacy_to_us, deterministic=True)
+    with conn:
+        conn.execute("BEGIN")
+        conn.execute(TABLE.replace("telemetry (", "telemetry_v1 (", 1))
+        # Unreadable timestamps are kept at epoch 0 rather than dropped
+        conn.execute(
+            f"INSERT INTO telemetry_v1 (timestamp, {', '.join(columns)}) "
+            f"SELECT COALESCE(legacy_to_us(timestamp), 0), {', '.join(columns)} FROM telemetry"
+        )
+        unreadable = conn.execute("SELECT COUNT(*) FROM telemetry_v1 WHERE timestamp = 0").fetchone()[0]
+        conn.execute("DROP TABLE telemetry")
+        conn.execute("ALTER TABLE telemetry_v1 RENAME TO telemetry")
+        for sql in INDEXES:
+            conn.execute(sql)
+        conn.execute("PRAGMA user_version = 1")
+    if unreadable:
+        log.warning("%d rows had unreadable timestamps and were stored at epoch 0", unreadable)
+
+
+def _migrate_to_2(conn):
+    """Add the rollup tables and fill them from the rows already stored"""
+    import rollup
+
+    log.info("Building telemetry rollups")
+    with conn:
+        conn.execute("BEGIN")
+        for sql in ROLLUP_TABLES:
+            conn.execute(sql)
+        rollup.rebuild(conn)
+        conn.execute("PRAGMA user_version = 2")
+
+
+def _migrate_to_3(conn):
+    """Split the telemetry table into per-source, per-day partitions"""
+    import partitions
+
+    log.info("Partitioning telemetry by source and day")
+    with conn:
+        conn.execute("BEGIN")
+        for sql in (PARTITIONS, ID_SEQUENCE) + partition_ddl(EMPTY_PARTITION):
+            conn.execute(sql)
+        conn.execute("ALTER TABLE telemetry RENAME TO telemetry_v2")
+        groups = conn.execute(
+            f"SELECT DISTINCT source, timestamp - timestamp % {partitions.DAY_US} FROM telemetry_v2"
+        ).fetchall()
+        columns = ", ".join(("id", "timestamp", "source") + CHANNELS)
+        for source, day in groups:
+            # Indexes (and the R*Tree's fixes) are added once the rows are in
+            name = partitions.create(conn, source, day, indexes=False)
+            conn.execute(
+                f"INSERT INTO {name} ({columns}) SELECT {columns} FROM telemetry_v2 "
+                "WHERE source IS ? AND timestamp >= ? AND timestamp < ?",
+                (source, day, day + partitions.DAY_US),
+            )
+            conn.execute(
+                "UPDATE partitions SET (rows, min_id, max_id) = "
+                f"(SELECT COUNT(*), MIN(id), MAX(id) FROM {name}) WHERE name = ?",
+                (name,),
+            )
+            partitions.create_indexes(conn, name)
+        # Never hand out an id again, even one whose row was deleted
+        last_id = conn.execute(
+            "SELECT MAX(COALESCE((SELECT MAX(id) FROM telemetry_v2), 0), "
+            "COALESCE((SELECT seq FROM sqlite_sequence WHERE name IN ('telemetry', 'telemetry_v2')), 0))"
+        ).fetchone()[0]
+        conn.execute("INSERT INTO telemetry_seq VALUES (?)", (last_id,))
+        conn.execute("DROP TABLE telemetry_v2")
+        partitions.refresh_view(conn)
+        conn.execute("PRAGMA user_version = 3")
+
+
+def _migrate_to_4(conn):
+    """Add the device column and the per-device latest values"""
+    import partitions
+    import snapshot
+
+    log.info("Adding the device dimension")
+    with conn:
+        conn.execute("BEGIN")
+        names = [row[0] for row in conn.execute("SELECT name FROM partitions")]
+        for name in names + [EMPTY_PARTITION]:
+            # Partitions made by the v3 migration already have it
+            if "device" not in {row[1] for row in conn.execute(f"PRAGMA table_info({name})")}:
+                conn.execute(f"ALTER TABLE {name} ADD COLUMN device TEXT")
+        partitions.refresh_view(conn)
+        conn.execute(DEVICE_LATEST)
+        snapshot.rebuild(conn)
+        conn.execute("PRAGMA user_version = 4")
+
+
+def _migrate_to_5(conn):
+    """Add the heatmap cell counts, built from the fixes already stored"""
+    import heatmap
+
+    log.info("Building the track-density heatmap")
+    with conn:
+        conn.execute("BEGIN")
+        conn.execute(HEAT_CELLS)
+        heatmap.rebuild(conn)
+        conn.execute("PRAGMA user_version = 5")
+
+
+def _migrate_to_6(conn):
+    """Add the map marker clusters, built from the fixes already stored"""
+    import clusters
+
+    log.info("Building the map marker clusters")
+    with conn:
+        conn.execute("BEGIN")
+        conn.execute(GEO_CLUSTERS)
+        clusters.rebuild(conn)
+        conn.execute("PRAGMA user_version = 6")
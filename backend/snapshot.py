@@ -0,0 +1,193 @@
+"""Last known value per channel, kept in memory.
+
+``/api/telemetry`` and ``/api/gyro`` are polled by every open dashboard, so
+they are answered from this snapshot instead of SQLite, fleet-wide or for
+one device. It is seeded once from the ``device_latest`` table, which the
+``store`` transaction hook keeps current, and then updated by the ingest
+writer after each commit, so it never shows uncommitted rows.
+
+Updates build a new dict and swap it in, so a reader always sees one
+consistent snapshot without taking a lock.
+"""
+import threading
+
+import db
+from ingest import COLUMNS
+
+# Channel group -> columns that are written (and read back) together
+GROUPS = {
+    "temperature": ("temperature",),
+    "humidity": ("humidity",),
+    "pressure": ("pressure",),
+    "location": ("latitude", "longitude"),
+    "gyro": ("gx", "gy", "gz"),
+    "accel": ("ax", "ay", "az"),
+    "mag": ("mx", "my", "mz"),
+}
+
+_INDEX = {column: i for i, column in enumerate(COLUMNS)}
+_GROUP_INDEXES = {
+    group: tuple(_INDEX[column] for column in columns) for group, columns in GROUPS.items()
+}
+
+
+_NO_DEVICE = ""  # device_latest key for rows stored without a device
+_STORE = (
+    "INSERT INTO device_latest (device, grp, timestamp, v1, v2, v3) VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (device, grp) DO UPDATE SET timestamp = excluded.timestamp, "
+    "v1 = excluded.v1, v2 = excluded.v2, v3 = excluded.v3 "
+    # Late rows (older timestamps) must not replace newer values
+    "WHERE excluded.timestamp >= device_latest.timestamp"
+)
+
+
+def store(conn, rows):
+    """Ingest transaction hook: record each device's latest values in device_latest"""
+    ts_index = _INDEX["timestamp"]
+    device_index = _INDEX["device"]
+    newest = {}
+    for row in rows:
+        ts = row[ts_index]
+        device = row[device_index] or _NO_DEVICE
+        for group, indexes in _GROUP_INDEXES.items():
+            group_values = tuple(row[i] for i in indexes)
+            if None in group_values:
+                continue
+            current = newest.get((device, group))
+            # Equal timestamps: the later row of the batch wins
+            if current is None or ts >= current[0]:
+                newest[device, group] = (ts, group_values)
+    conn.executemany(_STORE, [
+        (device, group, ts) + values + (None,) * (3 - len(values))
+        for (device, group), (ts, values) in newest.items()
+    ])
+
+
+def rebuild(conn):
+    """Recompute device_latest from telemetry; runs in the caller's transaction"""
+    conn.execute("DELETE FROM device_latest")
+    for group, columns in GROUPS.items():
+        present = " AND ".join(f"{column} IS NOT NULL" for column in columns)
+        values = ", ".join(columns + ("NULL",) * (3 - len(columns)))
+        # The bare columns of a MAX() aggregate come from the row holding the maximum
+        conn.execute(
+            f"INSERT INTO device_latest (device, grp, timestamp, v1, v2, v3) "
+            f"SELECT COALESCE(device, ''), ?, MAX(timestamp), {values} "
+            f"FROM telemetry WHERE {present} GROUP BY COALESCE(device, '')",
+            (group,),
+        )
+
+
+class LatestValues:
+    """Latest values fleet-wide and per device.
+
+    Fleet-wide values swap in a new dict per commit; per-device values swap
+    in a new dict for each device a commit touches, so a reader always sees
+    one consistent state per device without taking a lock. ``version``
+    goes up with every change, for views derived from the state (fleet.py).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}  # group -> (timestamp, id, values tuple)
+        self._devices = {}  # device -> {group -> (timestamp, id, values tuple)}
+        self._seen = {}  # device -> timestamp of its newest row (devices with an id only)
+        self._seeded = False
+        self.version = 0
+
+    def seed(self, conn=None):
+        """(Re)load the latest committed value of every group and device from the database"""
+        conn = conn or db.get_connection()
+        with self._lock:
+            self._values = {}
+            self._devices = {}
+            self._seen = {}
+        values = {}
+        devices = {}
+        seen = {}
+        # Seeded entries get id 0: anything committed later has a larger id
+        for device, group, ts, *stored in conn.execute(
+            "SELECT device, grp, timestamp, v1, v2, v3 FROM device_latest"
+        ):
+            if group not in GROUPS:
+                continue
+            entry = (ts, 0, tuple(stored[:len(GROUPS[group])]))
+            devices.setdefault(device or None, {})[group] = entry
+            if device:
+                seen[device] = max(seen.get(device, ts), ts)
+            if group not in values or entry[:2] > values[group][:2]:
+                values[group] = entry
+        with self._lock:
+            # Keep anything committed (and applied) while we were reading
+            for group, entry in self._values.items():
+                if group not in values or entry[:2] > values[group][:2]:
+                    values[group] = entry
+            for device, groups in self._devices.items():
+                merged = devices.setdefault(device, {})
+                for group, entry in groups.items():
+                    if group not in merged or entry[:2] > merged[group][:2]:
+                        merged[group] = entry
+            for device, ts in self._seen.items():
+                seen[device] = max(seen.get(device, ts), ts)
+            self._values = values
+            self._devices = devices
+            self._seen = seen
+            self._seeded = True
+            self.version += 1
+
+    def apply(self, committed):
+        """Ingest listener: fold newly committed (id, row) pairs into the snapshot"""
+        ts_index = _INDEX["timestamp"]
+        device_index = _INDEX["device"]
+        with self._lock:
+            values = dict(self._values)
+            touched = {}
+            for row_id, row in committed:
+                ts = row[ts_index]
+                device = row[device_index]
+                if device not in touched:
+                    touched[device] = dict(self._devices.get(device, ()))
+                device_values = touched[device]
+                if device is not None and ts > self._seen.get(device, -1):
+                    self._seen[device] = ts
+                for group, indexes in _GROUP_INDEXES.items():
+                    group_values = tuple(row[i] for i in indexes)
+                    if None in group_values:
+                        continue
+                    # Late rows (older timestamps) must not replace newer values
+                    entry = (ts, row_id, group_values)
+                    current = values.get(group)
+                    if current is None or entry[:2] >= current[:2]:
+                        values[group] = entry
+                    current = device_values.get(group)
+                    if current is None or entry[:2] >= current[:2]:
+                        device_values[group] = entry
+            self._values = values
+            self._devices.update(touched)
+            self.version += 1
+
+    def get(self, group, device=None):
+        """Latest values tuple for a group (of one device, or fleet-wide), or None"""
+        if not self._seeded:
+            self.seed()
+        entry = (self._values if device is None else self._devices.get(device, {})).get(group)
+        return entry[2] if entry else None
+
+    def has_device(self, device):
+        if not self._seeded:
+            self.seed()
+        return device in self._devices
+
+    def device_state(self, device):
+        """(last seen, {group: entry}) of one device"""
+        return self._seen.get(device), self._devices.get(device, {})
+
+    def fleet(self):
+        """(version, {device: last seen}, {device: {group: entry}}) as of one commit"""
+        if not self._seeded:
+            self.seed()
+        with self._lock:
+            return self.version, dict(self._seen), dict(self._devices)
+
+
+latest = LatestValues()
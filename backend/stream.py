@@ -0,0 +1,108 @@
+"""Server-Sent Events fan-out for committed telemetry.
+
+The ingest side calls ``broker.publish()`` with the events produced by a
+commit. Each event carries the id of the telemetry row it came from, which
+doubles as the SSE ``id:`` so a reconnecting client can send
+``Last-Event-ID`` and receive only what it missed. Recent events are kept in
+a bounded ring buffer; a client that fell further behind than the buffer
+reaches gets told so and can backfill from the database.
+
+Device status changes (presence.py) are not tied to a row: they are
+published with the newest row id so far, so clients order events by
+*position*, ``(id, sequence number)``. A client resuming from
+``Last-Event-ID`` starts after every event with that id; it gets the
+current device status on connect anyway.
+
+Every connected client waits on one condition variable, so an idle stream
+costs nothing but a sleeping thread and a heartbeat comment every
+``STREAM_HEARTBEAT`` seconds.
+"""
+import collections
+import json
+import math
+import os
+import threading
+
+CHANNELS = ("telemetry", "gyro", "log", "status")
+
+HEARTBEAT = float(os.getenv("STREAM_HEARTBEAT", "15"))
+BUFFER_SIZE = int(os.getenv("STREAM_BUFFER_SIZE", "4096"))
+
+
+def format_event(event_id, channel, data):
+    """Encode one event in text/event-stream framing"""
+    return f"id: {event_id}\nevent: {channel}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+def resume_position(event_id):
+    """Position just after every event with id ``event_id`` (for Last-Event-ID)"""
+    return event_id, math.inf
+
+
+class EventBroker:
+    def __init__(self, buffer_size=BUFFER_SIZE):
+        self._cond = threading.Condition()
+        self._buffer_size = buffer_size
+        self._events = collections.deque()  # ((id, seq), channel, encoded)
+        self._seq = 0
+        self._position = (0, 0)
+        # Events at or before _floor may be missing from the buffer
+        self._floor = (0, 0)
+
+    @property
+    def last_id(self):
+        return self._position[0]
+
+    @property
+    def position(self):
+        """(id, seq) of the newest event"""
+        return self._position
+
+    def reset(self, last_id):
+        """Start over after the newest id already in the database"""
+        with self._cond:
+            self._events.clear()
+            self._position = self._floor = (last_id, self._seq)
+
+    def publish(self, events):
+        """Append (id, channel, data) events, in id order, and wake every client.
+
+        An id of None stands for the newest id published so far.
+        """
+        if not events:
+            return
+        with self._cond:
+            last_id = self._position[0]
+            for event_id, channel, data in events:
+                last_id = max(last_id, last_id if event_id is None else event_id)
+                self._seq += 1
+                self._events.append(((last_id, self._seq), channel, format_event(last_id, channel, data)))
+            while len(self._events) > self._buffer_size:
+                self._floor = self._events.popleft()[0]
+            self._position = (last_id, self._seq)
+            self._cond.notify_all()
+
+    def wait(self, after, channels, timeout=HEARTBEAT):
+        """Block until there are events after position ``after`` (or timeout).
+
+        Returns ``(events, position, complete)``: the encoded events for the
+        requested channels, the position to wait after next time (events of
+        other channels are skipped too) and False for ``complete`` when the
+        buffer no longer reaches back to ``after``, i.e. the caller missed events.
+        """
+        with self._cond:
+            if self._position <= after:
+                self._cond.wait(timeout)
+            newer = []
+            for position, channel, encoded in reversed(self._events):
+                if position <= after:
+                    break
+                if channel in channels:
+                    newer.append(encoded)
+            complete = after >= self._floor
+            position = max(after, self._position)
+        newer.reverse()
+        return newer, position, complete
+
+
+broker = EventBroker()
@@ -0,0 +1,66 @@
+"""Fixtures shared by the backend tests: each test gets its own database file.
+
+Run from backend/:  python -m pytest
+"""
+import os
+import random
+import sys
+import tempfile
+
+# The backend modules import each other by name, as when app.py runs from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Commit synchronously whatever .env says, and cache tiles outside the tree
+os.environ["INGEST_MODE"] = "sync"
+os.environ.setdefault("HEATMAP_DIR", tempfile.mkdtemp(prefix="telemetry-tiles-"))
+
+import pytest
+
+import app as backend
+import db
+from ingest import make_row, writer
+from schema import CHANNELS
+from timeutil import now_us
+
+HOUR_US = 3_600_000_000
+
+
+@pytest.fixture
+def database(tmp_path):
+    """Path of an empty database file the app is pointed at"""
+    previous = db.DB
+    path = str(tmp_path / "telemetry.db")
+    db.configure(path=path)
+    yield path
+    db.release()
+    db.configure(path=previous)
+
+
+@pytest.fixture
+def client(database):
+    """Test client of an app started on a fresh database"""
+    backend.init_db()
+    return backend.app.test_client()
+
+
+@pytest.fixture
+def ingested(client):
+    """Rows of the last six hours committed through the writer in small, unordered batches.
+
+    Channels are missing at random; fixes cover the globe, a quarter of
+    them in a small cluster.
+    """
+    rng = random.Random(7)
+    start = now_us() - 6 * HOUR_US
+    rows = []
+    for timestamp in rng.sample(range(start, start + 6 * HOUR_US, 1000), 3000):
+        channels = {channel: rng.uniform(-50, 50) for channel in CHANNELS if rng.random() < 0.7}
+        if rng.random() < 0.25:
+            channels.update(latitude=45 + rng.gauss(0, 0.01), longitude=7 + rng.gauss(0, 0.01))
+        else:
+            channels.update(latitude=rng.uniform(-85, 85), longitude=rng.uniform(-180, 180))
+        if rng.random() < 0.2:
+            del channels["latitude"], channels["longitude"]
+        rows.append(make_row(timestamp, rng.choice(["GPS", "arduino"]), rng.choice([None, "a", "b"]), **channels))
+    for i in range(0, len(rows), 128):
+        writer.write(rows[i:i + 128])
+    return rows
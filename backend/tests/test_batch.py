@@ -0,0 +1,36 @@
+import time
+
+import pytest
+
+FRAME = "T:25.00C, P:1013.25hPa, GX:0.10, GY:0.20, GZ:0.30"
+
+# Timestamps as written in a JSON body, after two good ones: Python's json
+# reads Infinity, NaN and 1e400 as floats, and 1e15 s would overflow SQLite
+BAD_TIMESTAMPS = ["Infinity", "NaN", "1e400", "1e15", "-1e10", '"1999-12-31T23:59:59Z"', "true", '"soon"']
+
+
+def post_json(client, url, text):
+    return client.post(url, data=text, content_type="application/json")
+
+
+@pytest.mark.parametrize("url, item", [
+    ("/upload/batch", '{{"temperature": 21.0, "latitude": 10.0, "longitude": 20.0, "timestamp": {}}}'),
+    ("/data/batch", '{{"data": "' + FRAME + '", "timestamp": {}}}'),
+])
+def test_bad_timestamps_reject_only_their_items(client, url, item):
+    timestamps = [str(time.time()), '"2024-06-01T12:00:00Z"'] + BAD_TIMESTAMPS
+    response = post_json(client, url, "[" + ", ".join(item.format(t) for t in timestamps) + "]")
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert (body["accepted"], body["rejected"]) == (2, len(timestamps) - 2)
+    assert [r["index"] for r in body["results"] if r["success"]] == [0, 1]
+    assert {r["error"] for r in body["results"] if not r["success"]} == {"Invalid timestamp"}
+    assert len(client.get("/api/logs").get_json()) == 2
+
+
+def test_a_batch_of_only_bad_items_is_a_client_error(client):
+    response = post_json(client, "/upload/batch", '[{"temperature": 21.0, "timestamp": Infinity}]')
+
+    assert response.status_code == 400
+    assert response.get_json()["results"] == [{"index": 0, "success": False, "error": "Invalid timestamp"}]
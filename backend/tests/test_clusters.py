@@ -0,0 +1,45 @@
+import math
+
+import clusters
+import db
+from schema import COLUMNS
+
+
+def cluster_rows(conn):
+    return conn.execute(
+        "SELECT zoom, cell, count, lat_sum, lon_sum, first_ts, last_ts FROM geo_clusters ORDER BY zoom, cell"
+    ).fetchall()
+
+
+def test_clusters_merged_on_ingest_match_a_rebuild(ingested):
+    conn = db.connect()
+    merged = cluster_rows(conn)
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        clusters.rebuild(conn)
+    rebuilt = cluster_rows(conn)
+
+    assert len(merged) == len(rebuilt) > 0
+    for row, expected in zip(merged, rebuilt):
+        assert row[:3] == expected[:3] and row[5:] == expected[5:]
+        assert math.isclose(row[3], expected[3], abs_tol=1e-6) and math.isclose(row[4], expected[4], abs_tol=1e-6)
+
+
+def test_each_zoom_accounts_for_every_fix(client, ingested):
+    fixes = sum(1 for row in ingested if row[COLUMNS.index("latitude")] is not None)
+    for zoom in (0, 3):
+        body = client.get(f"/api/geo/clusters?bbox=-180,-85,180,85&zoom={zoom}").get_json()
+        assert sum(cluster["count"] for cluster in body["clusters"]) == fixes
+
+
+def test_fixes_at_the_antimeridian_cluster_on_their_own_side(client):
+    # 180 is the same meridian as -180 and falls in the westernmost cell
+    fixes = [(1.0, 180.0), (1.0, -179.99), (1.0, 179.99), (1.0, 179.98)]
+    response = client.post("/upload/batch", json=[{"latitude": lat, "longitude": lon} for lat, lon in fixes])
+    assert response.get_json()["accepted"] == len(fixes)
+
+    for zoom in (0, 4, 10):
+        body = client.get(f"/api/geo/clusters?bbox=170,-2,-170,2&zoom={zoom}").get_json()
+        centroids = sorted((cluster["lon"], cluster["count"]) for cluster in body["clusters"])
+        assert [count for _, count in centroids] == [2, 2]
+        assert math.isclose(centroids[0][0], -179.995) and math.isclose(centroids[1][0], 179.985)
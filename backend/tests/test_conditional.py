@@ -0,0 +1,40 @@
+import pytest
+
+URLS = [
+    "/api/telemetry",
+    "/api/gyro",
+    "/api/logs?limit=5",
+    "/api/geo?bbox=-10,-10,10,10",
+    "/api/tiles/0/0/0",
+    "/api/history?from=2024-01-01T00:00:00Z&to=2024-01-02T00:00:00Z&bucket=1h",
+]
+
+
+@pytest.mark.parametrize("url", URLS)
+def test_a_matching_etag_gets_304_until_the_next_commit(client, url):
+    client.post("/upload", json={"temperature": 20.0, "gx": 1.0, "gy": 2.0, "gz": 3.0})
+    first = client.get(url)
+    etag = first.headers["ETag"]
+    assert first.status_code == 200 and etag.startswith("W/")
+    assert first.headers["Cache-Control"] == "no-cache"
+
+    again = client.get(url, headers={"If-None-Match": etag})
+    assert again.status_code == 304 and again.get_data() == b""
+    assert again.headers["ETag"] == etag
+
+    client.post("/upload", json={"temperature": 21.0})
+    changed = client.get(url, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+
+
+def test_responses_that_follow_the_clock_are_not_tagged(client):
+    # Without to= the range ends now, so the same version can give another body
+    assert "ETag" not in client.get("/api/history?bucket=1h").headers
+    assert "ETag" in client.get("/api/history?bucket=1h&to=2024-01-02T00:00:00Z").headers
+
+
+def test_errors_are_not_tagged(client):
+    response = client.get("/api/logs?limit=0")
+
+    assert response.status_code == 400 and "ETag" not in response.headers
@@ -0,0 +1,55 @@
+import csv
+import gzip
+import io
+import json
+
+import pytest
+
+import export
+from timeutil import from_iso
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    """Fetch a few rows at a time, so an export spans many chunks"""
+    monkeypatch.setattr(export, "FETCH_SIZE", 7)
+
+
+def test_ndjson_export_holds_every_row_oldest_first(client, ingested, small_chunks):
+    response = client.get("/api/export?format=ndjson")
+
+    assert response.mimetype == "application/x-ndjson"
+    entries = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert len(entries) == len(ingested)
+    assert [from_iso(entry["timestamp"]) for entry in entries] == sorted(row[0] for row in ingested)
+    assert list(entries[0]) == list(export.EXPORT_COLUMNS)
+    newest = max(ingested)
+    assert entries[-1]["temperature"] == newest[3] and entries[-1]["device"] == newest[2]
+
+
+def test_csv_export_applies_the_log_filters(client, ingested, small_chunks):
+    response = client.get("/api/export?format=csv&source=arduino&filter=temperature>0")
+
+    assert response.mimetype == "text/csv"
+    assert response.headers["Content-Disposition"] == "attachment; filename=telemetry.csv"
+    header, *rows = csv.reader(io.StringIO(response.get_data(as_text=True)))
+    assert header == list(export.EXPORT_COLUMNS)
+    expected = [row for row in ingested if row[1] == "arduino" and row[3] is not None and row[3] > 0]
+    assert len(rows) == len(expected)
+    assert {row[header.index("source")] for row in rows} == {"arduino"}
+    # Missing channels are empty fields
+    assert any(row[header.index("humidity")] == "" for row in rows)
+
+
+def test_gzip_export_decompresses_to_the_plain_one(client, ingested, small_chunks):
+    plain = client.get("/api/export?format=csv").get_data()
+
+    response = client.get("/api/export?format=csv", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.get_data()) == plain
+
+
+@pytest.mark.parametrize("query", ["format=xml", "filter=pressure<", "from=soon"])
+def test_invalid_exports_are_client_errors(client, query):
+    assert client.get(f"/api/export?{query}").status_code == 400
@@ -0,0 +1,61 @@
+import json
+import sqlite3
+from datetime import datetime, timedelta
+
+import app as backend
+import db
+import load
+import schema
+
+# telemetry as the first release created it, before any migration
+BASELINE_TABLE = (
+    "CREATE TABLE telemetry (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT, source TEXT, "
+    "temperature REAL, humidity REAL, latitude REAL, longitude REAL, pressure REAL, "
+    "gx REAL, gy REAL, gz REAL)"
+)
+
+
+def test_baseline_database_is_migrated_with_its_fixes_indexed(database):
+    conn = sqlite3.connect(database)
+    conn.execute(BASELINE_TABLE)
+    start = datetime.now() - timedelta(hours=2)
+    conn.executemany(
+        "INSERT INTO telemetry (timestamp, source, temperature, humidity, latitude, longitude) "
+        "VALUES (?, 'GPS', 21.5, 40.0, ?, ?)",
+        [((start + timedelta(seconds=i)).isoformat(), 10 + i / 100, 20 + i / 100) for i in range(50)],
+    )
+    conn.commit()
+    conn.close()
+
+    backend.init_db()
+    client = backend.app.test_client()
+
+    assert db.connect().execute("PRAGMA user_version").fetchone()[0] == schema.SCHEMA_VERSION
+    body = client.get("/api/geo?bbox=19,9,21,11").get_json()
+    assert len(body["fixes"]) == 50
+    assert not body["truncated"]
+    nearest = client.get("/api/geo/nearest?lat=10.2&lon=20.2&k=3").get_json()
+    assert [fix["distance"] for fix in nearest][0] == 0.0
+    assert len(nearest) == 3
+
+
+def test_fixes_loaded_into_an_existing_partition_are_indexed(client, tmp_path):
+    now = datetime.now().timestamp()
+    assert client.post("/upload", json={"temperature": 20.0, "humidity": 50.0,
+                                        "latitude": 45.0, "longitude": 7.0}).status_code == 200
+    capture = tmp_path / "pi.jsonl"
+    capture.write_text("".join(
+        json.dumps({"temperature": 20.0, "humidity": 50.0, "latitude": 46 + i / 100,
+                    "longitude": 8 + i / 100, "timestamp": now - 60 + i}) + "\n"
+        for i in range(10)
+    ))
+
+    conn = db.connect()
+    known = len(conn.execute("SELECT name FROM partitions").fetchall())
+    loaded, skipped, opened = load.load(conn, [str(capture)], load.Clock(None, 1_000_000), 100)
+    conn.close()
+
+    assert (loaded, skipped.count, opened) == (10, 0, [])
+    assert known == 1
+    body = client.get("/api/geo?bbox=7.5,45.5,9,47").get_json()
+    assert len(body["fixes"]) == 10
@@ -0,0 +1,41 @@
+import db
+import heatmap
+from ingest import make_row, writer
+from timeutil import now_us
+
+
+def test_heat_cells_counted_on_ingest_match_a_rebuild(ingested):
+    conn = db.connect()
+    counted = conn.execute("SELECT zoom, cell, count FROM heat_cells ORDER BY zoom, cell").fetchall()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        heatmap.rebuild(conn)
+
+    assert counted
+    assert counted == conn.execute("SELECT zoom, cell, count FROM heat_cells ORDER BY zoom, cell").fetchall()
+
+
+def test_a_commit_refreshes_the_cached_tiles_it_lands_in(client):
+    writer.write([make_row(now_us(), "GPS", latitude=45.0, longitude=7.0)])
+    first = client.get("/api/tiles/4/8/5")
+    elsewhere = client.get("/api/tiles/4/0/0")
+    assert first.status_code == elsewhere.status_code == 200
+    assert first.data != elsewhere.data
+
+    writer.write([make_row(now_us(), "GPS", latitude=45.0, longitude=7.0) for _ in range(200)])
+
+    assert client.get("/api/tiles/4/8/5").data != first.data
+    assert client.get("/api/tiles/4/0/0").data == elsewhere.data
+
+
+def test_reset_deletes_only_the_cached_tiles(tmp_path):
+    (tmp_path / "notes.txt").write_text("kept")
+    cache = heatmap.TileCache(str(tmp_path))
+    tile = tmp_path / "heatmap" / "2" / "1" / "3.png"
+    tile.parent.mkdir(parents=True)
+    tile.write_bytes(b"png")
+
+    cache.reset()
+
+    assert not (tmp_path / "heatmap").exists()
+    assert (tmp_path / "notes.txt").read_text() == "kept"
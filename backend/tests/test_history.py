@@ -0,0 +1,41 @@
+import numpy as np
+
+import db
+import history
+from schema import CHANNELS
+from timeutil import now_us
+
+
+def test_history_from_rollups_matches_raw_rows(ingested):
+    conn = db.connect()
+    from_us, to_us = history.align(now_us() - 7 * 3_600_000_000, now_us(), 300_000_000)
+
+    level, starts, series = history.aggregate(conn, from_us, to_us, 300_000_000, CHANNELS)
+    raw_starts, raw_series = history._aggregate_raw(conn, from_us, to_us, 300_000_000, CHANNELS)
+
+    assert level == "5m"
+    np.testing.assert_array_equal(starts, raw_starts)
+    for channel in CHANNELS:
+        for stat in history.STATS:
+            np.testing.assert_allclose(series[channel][stat], raw_series[channel][stat], rtol=1e-9,
+                                       err_msg=f"{channel} {stat}")
+
+
+def test_max_points_downsamples_every_channel(client, ingested):
+    body = client.get("/api/history?bucket=1m&max_points=50&channels=temperature,pressure").get_json()
+
+    assert "time" not in body
+    for channel in ("temperature", "pressure"):
+        stats = body["channels"][channel]
+        assert 3 <= len(stats["time"]) <= 50
+        assert all(len(values) == len(stats["time"]) for values in stats.values())
+
+
+def test_raw_buckets_over_too_many_rows_are_refused(client, ingested, monkeypatch):
+    monkeypatch.setattr(history, "MAX_RAW_ROWS", len(ingested) - 1)
+
+    response = client.get("/api/history?bucket=59s&max_points=100&channels=temperature")
+
+    assert response.status_code == 400
+    assert "Too many rows" in response.get_json()["error"]
+    assert client.get("/api/history?bucket=1m&max_points=100&channels=temperature").status_code == 200
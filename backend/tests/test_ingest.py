@@ -0,0 +1,57 @@
+import pytest
+
+import db
+from ingest import _Pending, make_row, writer
+from timeutil import now_us
+
+
+def stored(conn=None):
+    """Temperatures committed so far, in id order"""
+    conn = conn or db.connect()
+    return [row[0] for row in conn.execute("SELECT temperature FROM telemetry ORDER BY id")]
+
+
+@pytest.fixture
+def queued(client):
+    """The writer in queue mode for one test, back in sync mode afterwards"""
+    yield writer
+    writer.configure(mode="sync")
+
+
+def test_commit_durability_returns_once_the_rows_are_committed(queued):
+    queued.configure(mode="queue", durability="commit")
+
+    for i in range(5):
+        queued.write([make_row(now_us(), "arduino", temperature=float(i))])
+        # Visible to another connection as soon as write() returns
+        assert stored() == [float(n) for n in range(i + 1)]
+    assert queued.stats()["rows_committed"] == 5
+
+
+def test_enqueue_durability_commits_in_the_background_and_flushes_on_stop(queued):
+    queued.configure(mode="queue", durability="enqueue", flush_interval=0.2)
+
+    for i in range(50):
+        queued.write([make_row(now_us(), "arduino", temperature=float(i))])
+    queued.stop()
+
+    assert stored() == [float(i) for i in range(50)]
+    stats = queued.stats()
+    assert stats["rows_committed"] == 50 and stats["queue_depth"] == 0
+    # Lingering for the flush interval groups the rows into few transactions
+    assert stats["flushes"] < 50
+
+
+def test_a_bad_item_fails_alone_in_a_group_commit(queued):
+    queued.configure(mode="queue", durability="commit")
+    # nan reaches the rollup sums as NULL and breaks the whole transaction
+    batch = [_Pending([make_row(now_us(), "arduino", temperature=value)], wait=True)
+             for value in (1.0, float("nan"), 3.0)]
+
+    with queued._lock:
+        queued._commit(batch)
+
+    assert [item.done.is_set() for item in batch] == [True, True, True]
+    assert [item.error is None for item in batch] == [True, False, True]
+    assert stored() == [1.0, 3.0]
+    assert queued.stats()["rows_failed"] == 1
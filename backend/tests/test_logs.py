@@ -0,0 +1,88 @@
+import pytest
+from werkzeug.datastructures import MultiDict
+
+from logquery import build_filters, parse_predicate
+from timeutil import from_iso
+
+
+def ids(response):
+    return [entry["id"] for entry in response.get_json()]
+
+
+def test_before_id_pages_back_through_every_row_once(client, ingested):
+    seen = []
+    response = client.get("/api/logs?limit=1000")
+    while True:
+        seen.extend(ids(response))
+        cursor = response.headers.get("X-Next-Before-Id")
+        if cursor is None:
+            break
+        response = client.get(f"/api/logs?limit=1000&before_id={cursor}")
+
+    assert seen == sorted(seen, reverse=True)
+    assert len(seen) == len(set(seen)) == len(ingested)
+
+
+def test_since_id_returns_only_newer_rows_oldest_first(client, ingested):
+    newest = int(client.get("/api/logs?limit=1").headers["X-Next-Since-Id"])
+    client.post("/upload", json={"temperature": 1.0})
+    client.post("/upload", json={"temperature": 2.0})
+
+    response = client.get(f"/api/logs?since_id={newest}")
+
+    assert ids(response) == [newest + 1, newest + 2]
+    assert response.headers["X-Next-Since-Id"] == str(newest + 2)
+    # Nothing new: the same cursor comes back
+    response = client.get(f"/api/logs?since_id={newest + 2}")
+    assert response.get_json() == [] and response.headers["X-Next-Since-Id"] == str(newest + 2)
+
+
+def test_filters_match_a_scan_of_every_row(client, ingested):
+    everything = client.get("/api/logs?limit=1000").get_json()
+    while len(everything) < len(ingested):
+        everything += client.get(f"/api/logs?limit=1000&before_id={everything[-1]['id']}").get_json()
+    to = everything[len(everything) // 2]["timestamp"]
+    expected = [
+        entry["id"] for entry in everything
+        if entry["source"] == "GPS" and entry["device"] in ("a", "b")
+        and entry["pressure"] != "N/A" and entry["pressure"] < 10 and entry["timestamp"] < to
+    ]
+
+    response = client.get(f"/api/logs?limit=1000&count=1&source=GPS&device=a,b&filter=pressure<10&to={to}")
+
+    assert ids(response) == expected
+    assert response.headers["X-Total-Count"] == str(len(expected))
+
+
+def test_filter_parameters_compile_to_bound_parameters():
+    args = MultiDict([("source", "GPS,arduino"), ("device", "sat-7"), ("from", "1700000000"),
+                      ("filter", "pressure < 800, temperature>=-1.5e1"), ("filter", "gx!=0")])
+
+    clauses, params = build_filters(args)
+
+    assert clauses == ["source IN (?, ?)", "device = ?", "timestamp >= ?",
+                       "pressure < ?", "temperature >= ?", "gx <> ?"]
+    assert params == ["GPS", "arduino", "sat-7", 1_700_000_000_000_000, 800.0, -15.0, 0.0]
+    assert build_filters(MultiDict([("to", "2024-06-01T00:00:00Z")]))[1] == [from_iso("2024-06-01T00:00:00Z")]
+
+
+@pytest.mark.parametrize("text, error", [
+    ("pressure", "Invalid filter"),
+    ("pressure<<800", "Invalid filter"),
+    ("pressure<abc", "Invalid filter"),
+    ("pressure<800; DROP TABLE telemetry", "Invalid filter"),
+    ("id>5", "Unknown channel"),
+    ("altitude>5", "Unknown channel"),
+])
+def test_invalid_predicates_are_rejected(text, error):
+    with pytest.raises(ValueError, match=error):
+        parse_predicate(text)
+
+
+@pytest.mark.parametrize("query", ["filter=Pressure<800", "from=yesterday", "to=1e400", "limit=0",
+                                   "before_id=x", "since_id=-1"])
+def test_invalid_log_queries_are_client_errors(client, query):
+    response = client.get(f"/api/logs?{query}")
+
+    assert response.status_code == 400
+    assert "error" in response.get_json()
@@ -0,0 +1,30 @@
+import pytest
+
+from lora import LoraFrame, parse_frame
+
+
+def test_every_channel_is_decoded_whatever_the_order_and_units():
+    frame = parse_frame("GZ:0.30, T:25.00C, P:1013.25hPa, AX:-.5, AY:+1, AZ:0.98, GX:12.34, GY:-0.20, "
+                        "MX:100, MY:3, MZ:4.")
+
+    assert frame == LoraFrame(temperature=25.0, pressure=1013.25, ax=-0.5, ay=1.0, az=0.98,
+                              gx=12.34, gy=-0.2, gz=0.3, mx=100.0, my=3.0, mz=4.0)
+
+
+def test_missing_optional_channels_are_none_and_unknown_keys_ignored():
+    frame = parse_frame("P:1000hPa, GX:1, GY:2, GZ:3, RSSI:-97dBm, GX:4")
+
+    assert frame == LoraFrame(pressure=1000.0, gx=4.0, gy=2.0, gz=3.0)
+
+
+@pytest.mark.parametrize("data, error", [
+    ("T:25.00C, GX:1, GY:2, GZ:3", "Missing required fields"),
+    ("P:1000, GX:1, GY:2, GZ:", "Missing required fields"),
+    ("", "Missing required fields"),
+    (None, "Invalid data format"),
+    (b"P:1000, GX:1, GY:2, GZ:3", "Invalid data format"),
+    ("P:1" + "0" * 400 + ", GX:1, GY:2, GZ:3", "Invalid numeric values"),
+])
+def test_unusable_frames_are_rejected(data, error):
+    with pytest.raises(ValueError, match=error):
+        parse_frame(data)
@@ -0,0 +1,54 @@
+import pytest
+
+import db
+import partitions
+from ingest import make_row, writer
+from timeutil import now_us
+
+DAY_US = partitions.DAY_US
+
+
+def tables(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def expire(conn, now):
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        return partitions.expire(conn, now)
+
+
+def test_parse_retention():
+    assert partitions.parse_retention("GPS=30d, arduino=12h,*=90d") == {
+        "GPS": 30 * DAY_US, "arduino": 12 * 3_600_000_000, "*": 90 * DAY_US}
+    assert partitions.parse_retention("") == {}
+    for value in ("GPS", "=30d", "GPS=soon"):
+        with pytest.raises(ValueError):
+            partitions.parse_retention(value)
+
+
+def test_expired_days_are_detached_then_dropped(client, monkeypatch):
+    now = now_us()
+    writer.write([make_row(now - days * DAY_US, source, temperature=float(days))
+                  for source in ("GPS", "arduino") for days in (5, 1)])
+    conn = db.connect()
+    assert len(partitions.listing(conn)) == 4
+    old_gps = [name for name, source, day, *_ in partitions.listing(conn)
+               if source == "GPS" and day < now - 2 * DAY_US]
+    monkeypatch.setattr(partitions, "RETENTION", {"GPS": 2 * DAY_US, "*": 10 * DAY_US})
+
+    assert expire(conn, now) == old_gps
+    # Out of the view and of every query at once, but the table is still there
+    assert sorted(row[0] for row in conn.execute("SELECT temperature FROM telemetry")) == [1.0, 1.0, 5.0]
+    assert len(client.get("/api/logs").get_json()) == 3
+    assert old_gps[0] in tables(conn)
+    listed = client.get("/api/retention").get_json()["partitions"]
+    assert [entry["detached"] is not None for entry in listed if entry["name"] == old_gps[0]] == [True]
+
+    # Within the grace period nothing is dropped; after it the table goes
+    assert expire(conn, now + partitions.DROP_GRACE_US // 2) == []
+    assert old_gps[0] in tables(conn)
+    expire(conn, now + partitions.DROP_GRACE_US + 1)
+    assert old_gps[0] not in tables(conn) and partitions.geo_table(old_gps[0]) not in tables(conn)
+    assert old_gps[0] not in {row[0] for row in partitions.listing(conn)}
+    assert partitions.row_count(conn) == 3
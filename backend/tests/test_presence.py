@@ -0,0 +1,107 @@
+import time
+
+import pytest
+
+from ingest import make_row
+from presence import PresenceMonitor
+from timeutil import now_us
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def monitor():
+    clock = Clock()
+    monitor = PresenceMonitor(offline_after=30, missed=3, clock=clock)
+    monitor.clock = clock
+    monitor.changes = []
+    monitor.add_listener(lambda changes: monitor.changes.extend(
+        (change["device"], change["status"]) for change in changes))
+    yield monitor
+    monitor.stop()
+
+
+def report(monitor, *devices):
+    monitor.apply([(i, make_row(now_us(), "GPS", device)) for i, device in enumerate(devices)])
+
+
+def advance(monitor, seconds):
+    """Move the clock on and wait until the watcher has handled every due deadline"""
+    monitor.clock.now += seconds
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        with monitor._cond:
+            if not monitor._heap or monitor._heap[0][0] > monitor.clock.now:
+                return
+            monitor._cond.notify()
+        time.sleep(0.001)
+    raise AssertionError("the watcher did not wake up")
+
+
+def test_devices_go_offline_after_the_timeout_and_back_online_on_a_row(monitor):
+    report(monitor, "a", "b")
+    advance(monitor, 20)
+    report(monitor, "b")
+
+    advance(monitor, 15)
+    assert sorted(monitor.changes[:2]) == [("a", "online"), ("b", "online")]
+    assert monitor.changes[2:] == [("a", "offline")]
+    assert monitor.summary()["online"] == 1
+
+    # b reported 20 s apart, so its timeout is 3 x 20 s
+    assert monitor.status("b")["timeout"] == 60.0
+    advance(monitor, 50)
+    report(monitor, "a")
+    assert monitor.changes[3:] == [("b", "offline"), ("a", "online")]
+    assert monitor.status("a")["status"] == "online" and monitor.status("b")["status"] == "offline"
+    assert monitor.status("c") is None
+
+
+def test_the_heap_holds_one_entry_per_online_device_however_often_they_report(monitor):
+    devices = [f"sat-{i}" for i in range(50)]
+    for _ in range(20):
+        report(monitor, *devices)
+        advance(monitor, 1)
+
+    assert len(monitor._heap) == len(devices)
+    # Every entry still holds the first deadline; the dict holds the real one
+    assert {deadline for deadline, _ in monitor._heap} == {1030.0}
+    assert set(monitor._deadline.values()) == {1049.0}
+
+    advance(monitor, 15)
+    assert len(monitor._heap) == len(devices) and {deadline for deadline, _ in monitor._heap} == {1049.0}
+    advance(monitor, 20)
+    assert monitor._heap == [] and monitor.summary()["offline"] == len(devices)
+
+
+def test_slow_reporters_get_a_longer_timeout(monitor):
+    for _ in range(5):
+        report(monitor, "slow")
+        advance(monitor, 25)
+    assert monitor.status("slow")["timeout"] == 75.0
+
+    # 45 s of silence would take a device on the default 30 s offline
+    advance(monitor, 45)
+    assert monitor.changes == [("slow", "online")]
+    advance(monitor, 30)
+    assert monitor.changes[-1] == ("slow", "offline")
+
+
+def test_summary_lists_the_longest_offline_first(monitor):
+    report(monitor, "a")
+    advance(monitor, 10)
+    report(monitor, "b")
+    advance(monitor, 10)
+    report(monitor, "c")
+
+    advance(monitor, 40)
+
+    summary = monitor.summary()
+    assert (summary["online"], summary["offline"]) == (0, 3)
+    assert [status["device"] for status in summary["offline_devices"]] == ["a", "b", "c"]
@@ -0,0 +1,30 @@
+import math
+
+import db
+import rollup
+from schema import ROLLUPS
+
+
+def rollup_rows(conn):
+    return {name: conn.execute(f"SELECT * FROM {rollup.table(name)} ORDER BY bucket").fetchall()
+            for name, _ in ROLLUPS}
+
+
+def same(a, b):
+    if isinstance(a, float) and isinstance(b, float):
+        return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9)
+    return a == b
+
+
+def test_rollups_merged_on_ingest_match_a_rebuild(ingested):
+    conn = db.connect()
+    merged = rollup_rows(conn)
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        rollup.rebuild(conn)
+    rebuilt = rollup_rows(conn)
+
+    for name, _ in ROLLUPS:
+        assert len(merged[name]) == len(rebuilt[name]) > 0
+        for row, expected in zip(merged[name], rebuilt[name]):
+            assert all(same(a, b) for a, b in zip(row, expected)), (name, row, expected)
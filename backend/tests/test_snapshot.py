@@ -0,0 +1,54 @@
+import db
+import snapshot
+from snapshot import GROUPS, LatestValues, latest
+
+
+def newest(conn, group, device=None, fleet=False):
+    """A group's values in the row with the newest timestamp, straight from telemetry"""
+    columns = GROUPS[group]
+    present = " AND ".join(f"{column} IS NOT NULL" for column in columns)
+    row = conn.execute(
+        f"SELECT {', '.join(columns)} FROM telemetry WHERE {present} "
+        f"{'' if fleet else 'AND device IS ?'} ORDER BY timestamp DESC, id DESC LIMIT 1",
+        () if fleet else (device,),
+    ).fetchone()
+    return tuple(row) if row else None
+
+
+def device_latest(conn):
+    return conn.execute("SELECT * FROM device_latest ORDER BY device, grp").fetchall()
+
+
+def test_snapshot_holds_the_newest_values_despite_late_rows(ingested):
+    conn = db.connect()
+    for group in GROUPS:
+        assert latest.get(group) == newest(conn, group, fleet=True), group
+        for device in ("a", "b"):
+            assert latest.get(group, device) == newest(conn, group, device), (group, device)
+
+
+def test_a_snapshot_seeded_after_a_restart_matches_the_live_one(ingested):
+    conn = db.connect()
+    stored = device_latest(conn)
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        snapshot.rebuild(conn)
+    assert device_latest(conn) == stored
+
+    seeded = LatestValues()
+    seeded.seed(conn)
+    for group in GROUPS:
+        assert seeded.get(group) == latest.get(group), group
+        for device in ("a", "b"):
+            assert seeded.get(group, device) == latest.get(group, device), (group, device)
+
+
+def test_telemetry_endpoint_serves_the_snapshot(client, ingested):
+    conn = db.connect()
+    lat, lon = newest(conn, "location", fleet=True)
+
+    body = client.get("/api/telemetry").get_json()
+
+    assert body["temperature"] == newest(conn, "temperature", fleet=True)[0]
+    assert body["location"] == {"lat": lat, "lon": lon}
+    assert client.get("/api/telemetry?device=a").get_json()["pressure"] == newest(conn, "pressure", "a")[0]
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+from stream import broker
+
+
+def post_rows(client, count):
+    """Upload rows one by one, one commit each; returns their ids"""
+    for i in range(count):
+        assert client.post("/upload", json={"temperature": float(i)}).status_code == 200
+    return [entry["id"] for entry in reversed(client.get(f"/api/logs?limit={count}").get_json())]
+
+
+def events(chunk):
+    """(id, event, data) of every event in a chunk of the stream"""
+    parsed = []
+    for block in chunk.decode().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if "event" in fields:
+            parsed.append((int(fields["id"]), fields["event"], json.loads(fields["data"])))
+    return parsed
+
+
+def resume(client, last_event_id, chunks):
+    """The first ``chunks`` chunks of a log stream resumed after ``last_event_id``"""
+    response = client.get("/api/stream?channels=log", headers={"Last-Event-ID": str(last_event_id)},
+                          buffered=False)
+    body = iter(response.response)
+    try:
+        # Never read past what is ready, or the stream would wait for a heartbeat
+        return [next(body) for _ in range(chunks)]
+    finally:
+        response.close()
+
+
+@pytest.fixture
+def small_buffer():
+    size = broker._buffer_size
+    broker._buffer_size = 4
+    yield
+    broker._buffer_size = size
+
+
+def test_resume_inside_the_buffer_replays_what_was_missed(client):
+    ids = post_rows(client, 6)
+
+    retry, replay = resume(client, ids[2], 2)
+
+    assert retry.startswith(b"retry:")
+    assert [(event_id, event) for event_id, event, _ in events(replay)] == [(i, "log") for i in ids[3:]]
+
+
+def test_resume_older_than_the_buffer_backfills_from_the_database(client, small_buffer):
+    ids = post_rows(client, 6)
+
+    _, backfill = resume(client, ids[0], 2)
+
+    replayed = events(backfill)
+    assert [event_id for event_id, _, _ in replayed] == ids[1:]
+    assert [data["temperature"] for _, _, data in replayed] == [1.0, 2.0, 3.0, 4.0, 5.0]
+
+
+def test_resume_from_a_future_id_resets_the_client(client):
+    ids = post_rows(client, 2)
+
+    _, gap = resume(client, ids[-1] + 100, 2)
+
+    assert events(gap) == [(ids[-1], "gap", {"after_id": ids[-1] + 100})]
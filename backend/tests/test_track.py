@@ -0,0 +1,64 @@
+import math
+
+import numpy as np
+
+import track
+
+
+def test_encode_matches_the_reference_polyline():
+    # The worked example of Google's polyline algorithm documentation
+    lat = np.array([38.5, 40.7, 43.252])
+    lon = np.array([-120.2, -120.95, -126.453])
+
+    assert track.encode(lat, lon) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+    assert track.encode(np.array([]), np.array([])) == ""
+    assert track.encode(np.array([-0.00001]), np.array([0.0])) == "@?"
+
+
+def test_weights_are_the_tolerance_each_point_survives():
+    x = np.array([0.0, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0])
+    y = np.array([0.0, 0.1, 0.0, 5.0, 0.0, 0.0, 0.0])
+
+    weight = track.weights(x, y, 0.01)
+
+    # The spike splits first, then the points furthest from its two segments
+    side = 10 / math.sqrt(34)
+    np.testing.assert_allclose(weight, [math.inf, 0.1, side, 5.0, side, 0.0, math.inf])
+    # A coarser tolerance stops splitting early but agrees on what it keeps
+    coarse = track.weights(x, y, 1.0)
+    np.testing.assert_array_equal(coarse > 1.0, weight > 1.0)
+    np.testing.assert_array_equal(coarse > 1.0, [True, False, True, True, True, False, True])
+
+
+def test_a_split_point_never_outweighs_the_point_that_split_before_it():
+    x = np.array([0.0, 1.0, 2.0, 3.0, 4.0])
+    y = np.array([0.0, 3.0, -3.0, 0.0, 0.0])
+
+    weight = track.weights(x, y, 0.0)
+
+    # Point 2 is 15 / sqrt(18) from the segment 1-4, but only there once point 1 is
+    assert weight[1] == 3.0
+    assert weight[2] == 3.0
+
+
+def test_simplifying_at_a_tolerance_keeps_the_points_that_weigh_more():
+    rng = np.random.default_rng(3)
+    x = np.cumsum(rng.normal(size=500))
+    y = np.cumsum(rng.normal(size=500))
+    weight = track.weights(x, y, 0.5)
+
+    for tolerance in (1.0, 5.0, 20.0):
+        kept = np.flatnonzero(weight > tolerance)
+        # Every dropped point lies within tolerance of the kept polyline segment around it
+        for first, last in zip(kept[:-1], kept[1:]):
+            dx, dy = x[last] - x[first], y[last] - y[first]
+            for i in range(first + 1, last):
+                t = min(max(((x[i] - x[first]) * dx + (y[i] - y[first]) * dy) / (dx * dx + dy * dy), 0.0), 1.0)
+                assert math.hypot(x[i] - x[first] - t * dx, y[i] - y[first] - t * dy) <= tolerance + 1e-9
+
+
+def test_min_zooms():
+    pixel = track.pixel_size(10)
+    zooms = track.min_zooms(np.array([math.inf, pixel * 1.01, pixel, 0.0]))
+
+    assert zooms.tolist() == [0, 10, 11, track.MAX_ZOOM]
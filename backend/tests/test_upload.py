@@ -0,0 +1,27 @@
+import pytest
+
+
+# JSON numbers that parse as inf / nan, and the strings float() reads the same way
+@pytest.mark.parametrize("value", ['"inf"', '"-Infinity"', '"nan"', "1e400", "NaN"])
+def test_non_finite_values_are_rejected(client, value):
+    response = client.post("/upload", data=f'{{"temperature": {value}, "humidity": 40.0}}',
+                           content_type="application/json")
+
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Invalid numeric values"}
+    assert client.get("/api/logs").get_json() == []
+
+
+@pytest.mark.parametrize("position, error", [
+    ({"latitude": 90.5, "longitude": 0.0}, "latitude must be between -90 and 90"),
+    ({"latitude": -91.0, "longitude": 0.0}, "latitude must be between -90 and 90"),
+    ({"latitude": 0.0, "longitude": 180.5}, "longitude must be between -180 and 180"),
+    ({"latitude": 0.0, "longitude": -360.0}, "longitude must be between -180 and 180"),
+])
+def test_positions_off_the_globe_are_rejected_per_item(client, position, error):
+    edge = {"latitude": 90, "longitude": -180}
+    response = client.post("/upload/batch", json=[dict(position, temperature=20.0), edge])
+
+    assert response.status_code == 200
+    assert [result.get("error") for result in response.get_json()["results"]] == [error, None]
+    assert [(entry["latitude"], entry["longitude"]) for entry in client.get("/api/logs").get_json()] == [(90, -180)]
@@ -0,0 +1,58 @@
+import json
+
+from uploader import Uploader
+
+
+class Answer:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+        self.text = str(body)
+
+    def json(self):
+        return self.body
+
+
+class Server:
+    """Session stand-in that fails every batch holding a poison sample with a 500"""
+
+    def __init__(self):
+        self.received = []
+        self.posts = 0
+
+    def post(self, url, json, timeout):
+        self.posts += 1
+        if any(item.get("poison") for item in json):
+            return Answer(500, {"error": "Internal server error"})
+        self.received.extend(json)
+        return Answer(200, {"results": [{"index": i, "success": True} for i in range(len(json))]})
+
+    def close(self):
+        pass
+
+
+def drain_until_settled(uploader, rounds=100):
+    for _ in range(rounds):
+        # Skip the backoff a failed attempt starts
+        uploader._retry_at = 0.0
+        if uploader.drain() is not None and not uploader.pending():
+            return
+    raise AssertionError("journal never drained")
+
+
+def test_a_sample_the_server_keeps_failing_is_dead_lettered(tmp_path):
+    uploader = Uploader("http://server/upload/batch", str(tmp_path / "journal.db"), batch_size=8, max_attempts=3)
+    uploader.session = server = Server()
+    for i in range(12):
+        item = {"n": i, "poison": True} if i == 5 else {"n": i}
+        uploader._db.execute("INSERT INTO outbox (item) VALUES (?)", (json.dumps(item),))
+
+    drain_until_settled(uploader)
+
+    assert [item["n"] for item in server.received] == [0, 1, 2, 3, 4, 6, 7, 8, 9, 10, 11]
+    assert uploader.dead_letters() == 1
+    assert uploader._db.execute("SELECT item, error FROM dead_letter").fetchone() == (
+        '{"n": 5, "poison": true}', "500 {'error': 'Internal server error'}")
+    # 8 x3, 4, 4 x3, 2 x3, 1, 1 x3 (dead-lettered), then the other 6 at once
+    assert server.posts == 15
+    uploader.close()
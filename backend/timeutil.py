@@ -0,0 +1,107 @@
+"""Timestamp helpers.
+
+Telemetry timestamps are stored as integer microseconds since the Unix epoch
+(UTC) and rendered as ISO 8601 strings with a ``Z`` suffix in API responses.
+"""
+import re
+import time
+from datetime import datetime, timezone
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# Epoch seconds parse_time accepts: what an ISO 8601 year 1..9999 can say
+_MAX_SECONDS = (datetime(9999, 12, 31, 23, 59, 59, tzinfo=timezone.utc) - _EPOCH).total_seconds()
+# Capture times sent by devices must fall between this and a day from now;
+# anything else is a broken clock and would open a partition for that day
+CAPTURE_EARLIEST_US = 946_684_800_000_000  # 2000-01-01T00:00:00Z
+CAPTURE_MAX_AHEAD_US = 86_400_000_000
+
+_DURATION = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(us|ms|s|m|h|d|w)?\s*$")
+_UNITS = {
+    "us": 1, "ms": 1_000, "s": 1_000_000, "m": 60_000_000,
+    "h": 3_600_000_000, "d": 86_400_000_000, "w": 604_800_000_000,
+}
+
+
+def now_us():
+    """Current UTC time in epoch microseconds"""
+    return time.time_ns() // 1000
+
+
+def from_datetime(value):
+    """Epoch microseconds for a datetime; naive values are taken as UTC"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    delta = value - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def from_iso(value, assume_local=False):
+    """Parse an ISO 8601 string to epoch microseconds.
+
+    Strings without an offset are UTC unless ``assume_local`` is set, which is
+    how the original ``datetime.now().isoformat()`` values were written.
+    """
+    value = value.strip()
+    if value.endswith(("Z", "z")):
+        value = value[:-1] + "+00:00"
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None and assume_local:
+        parsed = parsed.astimezone()
+    return from_datetime(parsed)
+
+
+def to_iso(us):
+    """Render epoch microseconds as an ISO 8601 UTC string"""
+    if us is None:
+        return None
+    seconds, micros = divmod(us, 1_000_000)
+    stamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds))
+    return f"{stamp}.{micros:06d}Z"
+
+
+def _from_seconds(seconds):
+    """Epoch seconds -> microseconds, raising ValueError for inf, nan and years past 9999"""
+    if not abs(seconds) <= _MAX_SECONDS:
+        raise ValueError("Time out of range")
+    return int(round(seconds * 1_000_000))
+
+
+def parse_time(value):
+    """Parse a query-string time: epoch seconds (int or float) or ISO 8601"""
+    value = value.strip()
+    try:
+        seconds = float(value)
+    except ValueError:
+        return from_iso(value)
+    return _from_seconds(seconds)
+
+
+def check_capture_time(us):
+    """Return ``us`` if it is a plausible capture time, raising ValueError otherwise"""
+    if not CAPTURE_EARLIEST_US <= us <= now_us() + CAPTURE_MAX_AHEAD_US:
+        raise ValueError("Timestamp out of range (2000-01-01 to a day from now)")
+    return us
+
+
+def parse_json_time(value):
+    """Parse a capture time from a JSON body: epoch seconds (number) or a parse_time string.
+
+    Raises ValueError for anything outside check_capture_time's window.
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError("Invalid timestamp")
+    if isinstance(value, str):
+        return check_capture_time(parse_time(value))
+    return check_capture_time(_from_seconds(value))
+
+
+def parse_duration(value):
+    """'300', '5m', '1h', '1d' -> microseconds (bare numbers are seconds)"""
+    match = _DURATION.match(value)
+    if not match:
+        raise ValueError(f"Invalid duration: {value!r} (expected e.g. 30s, 5m, 1h, 1d)")
+    number, unit = match.groups()
+    us = int(float(number) * _UNITS[unit or "s"])
+    if us <= 0:
+        raise ValueError("Duration must be positive")
+    return us
@@ -0,0 +1,130 @@
+"""Simplified ground track for /api/track.
+
+The GPS fixes of a time range are simplified with Douglas-Peucker and sent
+as an encoded polyline (Google's format, 5 decimal places), so a day of
+fixes becomes a few hundred points and a few kilobytes.
+
+Simplification runs in Web Mercator metres, the plane the map draws in, so
+a tolerance matches the same on-screen distance everywhere on the track:
+one pixel at zoom z is ``pixel_size(z)``. Longitudes are unwrapped first so
+a pass over the antimeridian is not a jump across the map.
+
+Every kept point also gets its Douglas-Peucker weight: the largest
+tolerance it survives (its distance from the segment it split, capped by
+the weights of the points that split before it). A point is kept at
+tolerance t exactly when its weight exceeds t, so one simplification at the
+finest tolerance also gives every coarser one; ``min_zooms`` turns the
+weights into the lowest zoom level each point is needed at, letting the map
+fetch the track once and filter it as it zooms.
+"""
+import math
+
+import numpy as np
+
+import partitions
+from history import fetch_table
+
+# Web Mercator (EPSG:3857) sphere radius, and the latitude where the map ends
+_MERCATOR_RADIUS = 6_378_137.0
+_MERCATOR_MAX_LAT = 85.05112878
+MAX_ZOOM = 20
+# Most fixes one track may simplify (about 11 days of 1 Hz fixes)
+MAX_FIXES = 1_000_000
+
+
+def fixes(conn, from_us, to_us, device=None):
+    """(timestamps, latitudes, longitudes) of the fixes in [from_us, to_us), oldest first.
+
+    Raises ValueError if there are more than MAX_FIXES.
+    """
+    table = fetch_table(conn.execute(
+        f"SELECT timestamp, id, latitude, longitude FROM {partitions.source(conn, from_us, to_us)} "
+        "WHERE latitude IS NOT NULL AND longitude IS NOT NULL AND timestamp >= ? AND timestamp < ? "
+        f"{'' if device is None else 'AND device = ?'} ORDER BY timestamp, id LIMIT ?",
+        (from_us, to_us) + (() if device is None else (device,)) + (MAX_FIXES + 1,),
+    ), 4)
+    if len(table) > MAX_FIXES:
+        raise ValueError(f"Too many fixes (max {MAX_FIXES}); use a shorter range")
+    return table[:, 0].astype(np.int64), table[:, 2], table[:, 3]
+
+
+def pixel_size(zoom):
+    """Web Mercator metres per pixel at a zoom level (256-pixel tiles)"""
+    return 2 * math.pi * _MERCATOR_RADIUS / (256 * 2 ** zoom)
+
+
+def project(lat, lon):
+    """Web Mercator (x, y) metres of fixes, longitudes unwrapped along the track"""
+    lon = np.degrees(np.unwrap(np.radians(lon)))
+    lat = np.radians(np.clip(lat, -_MERCATOR_MAX_LAT, _MERCATOR_MAX_LAT))
+    return _MERCATOR_RADIUS * np.radians(lon), _MERCATOR_RADIUS * np.log(np.tan(np.pi / 4 + lat / 2))
+
+
+def weights(x, y, tolerance):
+    """Douglas-Peucker weight of every point; points within ``tolerance`` get 0.
+
+    The end points weigh inf. Segments are split until all their points lie
+    within ``tolerance`` of them, so the work grows with the number of kept
+    points rather than with the fixes dropped.
+    """
+    n = len(x)
+    weight = np.zeros(n)
+    if n:
+        weight[[0, -1]] = np.inf
+    stack = [(0, n - 1, np.inf)]
+    while stack:
+        first, last, cap = stack.pop()
+        if last - first < 2:
+            continue
+        dx = x[last] - x[first]
+        dy = y[last] - y[first]
+        px = x[first + 1:last] - x[first]
+        py = y[first + 1:last] - y[first]
+        length2 = dx * dx + dy * dy
+        # Distance to the segment, not the line: a track can double back
+        t = np.clip((px * dx + py * dy) / length2, 0.0, 1.0) if length2 else 0.0
+        distances = np.hypot(px - t * dx, py - t * dy)
+        i = int(distances.argmax())
+        if distances[i] <= tolerance:
+            continue
+        split = first + 1 + i
+        weight[split] = min(distances[i], cap)
+        stack.append((first, split, weight[split]))
+        stack.append((split, last, weight[split]))
+    return weight
+
+
+def min_zooms(weight):
+    """Lowest zoom level (0..MAX_ZOOM) at which a point of the given weight is kept.
+
+    Kept at zoom z means weight > pixel_size(z).
+    """
+    with np.errstate(divide="ignore"):
+        zoom = np.floor(np.log2(pixel_size(0) / weight)) + 1
+    return np.clip(zoom, 0, MAX_ZOOM).astype(np.int64)
+
+
+def encode(lat, lon, precision=5):
+    """Encoded polyline of the points (Google's polyline algorithm)"""
+    values = np.round(np.column_stack((lat, lon)) * 10 ** precision).astype(np.int64)
+    deltas = np.diff(values, axis=0, prepend=[[0, 0]]).ravel()
+    chars = []
+    for value in ((deltas << 1) ^ (deltas >> 63)).tolist():
+        while value >= 0x20:
+            chars.append(chr((0x20 | (value & 0x1F)) + 63))
+            value >>= 5
+        chars.append(chr(value + 63))
+    return "".join(chars)
+
+
+def simplify(conn, from_us, to_us, tolerance, device=None):
+    """Simplify the track of a time range.
+
+    Returns (fix count, kept timestamps, latitudes, longitudes, weights),
+    raising ValueError if the range holds more than MAX_FIXES fixes.
+    """
+    timestamps, lat, lon = fixes(conn, from_us, to_us, device)
+    x, y = project(lat, lon)
+    weight = weights(x, y, tolerance)
+    kept = weight > tolerance
+    return len(timestamps), timestamps[kept], lat[kept], lon[kept], weight[kept]
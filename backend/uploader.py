@@ -0,0 +1,166 @@
+"""Store-and-forward uploads for the device scripts (ard.py, rasp.py).
+
+Every sample is first committed to a local SQLite journal, then sent; it
+leaves the journal only once the server has answered for it. A crash,
+reboot or server outage therefore never loses a sample: whatever is in the
+journal is sent on the next ``drain()``, oldest first, up to ``batch_size``
+samples per POST to the server's batch endpoint over one keep-alive
+``requests.Session``.
+
+While the server is unreachable (connection error, timeout, 5xx or 503
+load-shedding) no further attempt is made until a backoff expires: 1s,
+doubling per failed attempt up to ``max_backoff``, with jitter so a fleet
+coming back online does not retry in lockstep. Samples keep being
+journaled meanwhile. Samples the server rejects as invalid (per-item
+errors or a 400) are logged and dropped instead of being retried forever.
+
+Any other error answer (a 500, 413, 415, ...) means the server is up but
+cannot take this batch. After ``max_attempts`` such answers in a row the
+batch is halved (and batches stay that small until every sample of the
+failing one is through), and a single sample that still fails is moved to
+the journal's ``dead_letter`` table and logged, so one bad sample cannot
+hold up the journal for good.
+
+Delivery is at-least-once: a crash between the server's commit and the
+journal delete resends that batch.
+"""
+import json
+import logging
+import random
+import sqlite3
+import time
+
+import requests
+
+log = logging.getLogger(__name__)
+
+
+class Uploader:
+    def __init__(self, urls, journal, batch_size=200, timeout=5.0, max_backoff=60.0, max_attempts=5):
+        """``urls``: batch endpoints to try in order (e.g. primary, then fallback)"""
+        self.urls = [urls] if isinstance(urls, str) else list(urls)
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.session = requests.Session()
+        self._failures = 0
+        self._retry_at = 0.0
+        # Error answers for the oldest journaled samples, how many of them
+        # to send while they keep failing, and the last id of the batch
+        # that first failed (the limit holds until it is delivered)
+        self._attempts = 0
+        self._limit = batch_size
+        self._failed_to = 0
+        self._error = None
+        # Autocommit: every journal write is its own durable transaction
+        self._db = sqlite3.connect(journal, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, item TEXT NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS dead_letter (id INTEGER PRIMARY KEY, item TEXT NOT NULL, error TEXT)"
+        )
+
+    def submit(self, item):
+        """Journal one JSON-serializable sample, then try to drain; returns drain()'s result"""
+        self._db.execute("INSERT INTO outbox (item) VALUES (?)", (json.dumps(item),))
+        return self.drain()
+
+    def pending(self):
+        """Number of journaled samples not yet delivered"""
+        return self._db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def drain(self):
+        """Send journaled samples in batches until the journal is empty.
+
+        Returns the number of samples delivered, or None if the server could
+        not be reached (or a backoff is still running).
+        """
+        if time.monotonic() < self._retry_at:
+            return None
+        sent = 0
+        while True:
+            rows = self._db.execute(
+                "SELECT id, item FROM outbox ORDER BY id LIMIT ?", (self._limit,)
+            ).fetchall()
+            if not rows:
+                return sent
+            delivered = self._send([json.loads(item) for _, item in rows])
+            if delivered is False:
+                self._attempts += 1
+                if self._attempts >= self.max_attempts:
+                    self._give_up(rows)
+                    continue
+            if not delivered:
+                self._failures += 1
+                delay = min(self.max_backoff, 2 ** (self._failures - 1))
+                self._retry_at = time.monotonic() + random.uniform(delay / 2, delay)
+                return None
+            self._failures = 0
+            self._attempts = 0
+            if rows[-1][0] >= self._failed_to:
+                self._limit = self.batch_size
+            self._db.execute("DELETE FROM outbox WHERE id <= ?", (rows[-1][0],))
+            sent += len(rows)
+
+    def dead_letters(self):
+        """Number of samples given up on (see the ``dead_letter`` table)"""
+        return self._db.execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0]
+
+    def close(self):
+        self.session.close()
+        self._db.close()
+
+    def _give_up(self, rows):
+        """Halve a batch that keeps failing, or dead-letter a single sample"""
+        self._attempts = 0
+        if len(rows) > 1:
+            self._limit = len(rows) // 2
+            self._failed_to = max(self._failed_to, rows[-1][0])
+            return
+        log.error("Giving up on sample %s after %d attempts: %s", rows[0][1], self.max_attempts, self._error)
+        self._db.execute("BEGIN")
+        self._db.execute("INSERT INTO dead_letter (id, item, error) VALUES (?, ?, ?)", (*rows[0], self._error))
+        self._db.execute("DELETE FROM outbox WHERE id = ?", (rows[0][0],))
+        self._db.execute("COMMIT")
+        self._limit = self.batch_size
+
+    def _send(self, items):
+        """POST one batch.
+
+        True once a server has taken responsibility for it, False if a
+        server answered with an error it will likely give again, None if
+        none could be reached (or all were shedding load).
+        """
+        answered = False
+        for url in self.urls:
+            try:
+                response = self.session.post(url, json=items, timeout=self.timeout)
+            except requests.RequestException as e:
+                log.debug("Upload to %s failed: %s", url, e)
+                continue
+            if response.status_code in (200, 400):
+                self._log_rejected(response, items)
+                return True
+            log.debug("Upload to %s returned %s", url, response.status_code)
+            # 502 / 504 come from a proxy in front of a server that is down
+            if response.status_code not in (502, 503, 504):
+                answered = True
+                self._error = f"{response.status_code} {response.text[:200]}"
+        return False if answered else None
+
+    @staticmethod
+    def _log_rejected(response, items):
+        try:
+            results = response.json().get("results")
+        except ValueError:
+            results = None
+        if results is None and response.status_code == 400:
+            log.warning("Server rejected a batch of %d samples: %s", len(items), response.text)
+            return
+        for result in results or ():
+            if not result.get("success"):
+                log.warning("Server rejected sample %r: %s", items[result["index"]], result.get("error"))
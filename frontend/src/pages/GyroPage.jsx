@@ -1,5 +1,5 @@
 import { useEffect, useState } from 'react';
-import { fetchGyro } from '../services/api';
+import { subscribeStream } from '../services/api';
 import styled from 'styled-components';
 import GyroVisualization from '../components/GyroVisualization';
 
@@ -26,20 +26,12 @@ const GyroPage = () => {
   const [gyroData, setGyroData] = useState({ roll: 0, pitch: 0, yaw: 0 });
 
   useEffect(() => {
-    const getGyro = () => {
-      fetchGyro()
-        .then(response => {
-          if (response.data && !response.data.error) {
-            setGyroData(response.data);
-          }
-        })
-        .catch(error => console.error('Error fetching gyro data:', error));
-    };
+    // The stream sends the current values on connect, then every update
+    const unsubscribe = subscribeStream({
+      gyro: (data) => setGyroData(data),
+    });
 
-    getGyro(); // initial fetch
-    const interval = setInterval(getGyro, 1000);
-
-    return () => clearInterval(interval);
+    return unsubscribe;
   }, []);
 
   return (
@@ -1,5 +1,5 @@
-import { useEffect, useState } from 'react';
-import { fetchLogs } from '../services/api';
+import { useEffect, useRef, useState } from 'react';
+import { fetchLogs, subscribeStream } from '../services/api';
 import styled from 'styled-components';
 import { useTheme } from '../context/ThemeContext';
 
@@ -142,28 +142,54 @@ const PageSizeSelect = styled.select`
   font-size: 1rem;
 `;
 
+// Newest first, one row per id: a fetched page merged with the rows the
+// stream added while the request was in flight
+const mergeLogs = (current, fetched) => {
+  const fetchedIds = new Set(fetched.map(row => row.id));
+  return [...current.filter(row => !fetchedIds.has(row.id)), ...fetched].sort((a, b) => b.id - a.id);
+};
+
 const LogsPage = () => {
   const [logs, setLogs] = useState([]);
+  // Set while the server reports older rows beyond the ones loaded
+  const [olderCursor, setOlderCursor] = useState(null);
+  const [loadingOlder, setLoadingOlder] = useState(false);
+  // Once older pages are loaded, live updates stop trimming the list
+  const olderLoadedRef = useRef(false);
   const { theme } = useTheme();
   const [currentPage, setCurrentPage] = useState(1);
   const [logsPerPage, setLogsPerPage] = useState(10);
   const [pageInput, setPageInput] = useState('');
 
   useEffect(() => {
-    // Initial fetch
-    fetchLogs()
-      .then(response => setLogs(response.data))
-      .catch(error => console.error('Error fetching logs:', error));
-
-    // Polling interval
-    const interval = setInterval(() => {
+    // After a gap the rows held may be stale (or the database reset), so
+    // they are replaced; otherwise stream events that beat the response are kept
+    const loadLogs = (replace) => {
       fetchLogs()
-        .then(response => setLogs(response.data))
+        .then(response => {
+          olderLoadedRef.current = false;
+          setLogs(prev => (replace ? response.data : mergeLogs(prev, response.data)));
+          setOlderCursor(response.headers['x-next-before-id'] || null);
+        })
         .catch(error => console.error('Error fetching logs:', error));
-    }, 5000); // every 5 seconds
+    };
+
+    // Initial fetch, then new rows are pushed as they are stored
+    loadLogs(false);
+    const unsubscribe = subscribeStream(
+      {
+        log: (entry) => setLogs(prev => {
+          // A resumed stream may replay rows we already have
+          if (prev.length > 0 && entry.id <= prev[0].id) return prev;
+          const next = [entry, ...prev];
+          return olderLoadedRef.current ? next : next.slice(0, 300);
+        }),
+      },
+      { onGap: () => loadLogs(true) }
+    );
 
     // Cleanup on unmount
-    return () => clearInterval(interval);
+    return unsubscribe;
   }, []);
 
   // Pagination logic
@@ -173,6 +199,20 @@ const LogsPage = () => {
   const endIdx = startIdx + logsPerPage;
   const currentLogs = logs.slice(startIdx, endIdx);
 
+  const handleLoadOlder = () => {
+    if (!olderCursor || loadingOlder || logs.length === 0) return;
+    setLoadingOlder(true);
+    // Page back from the oldest row shown; live updates may have trimmed the list
+    fetchLogs({ before_id: logs[logs.length - 1].id })
+      .then(response => {
+        olderLoadedRef.current = true;
+        setLogs(prev => mergeLogs(prev, response.data));
+        setOlderCursor(response.headers['x-next-before-id'] || null);
+      })
+      .catch(error => console.error('Error fetching older logs:', error))
+      .finally(() => setLoadingOlder(false));
+  };
+
   const handlePageChange = (page) => {
     if (page < 1 || page > totalPages) return;
     setCurrentPage(page);
@@ -345,6 +385,11 @@ const LogsPage = () => {
             </form>
           )}
           <PageButton onClick={() => handlePageChange(currentPage + 1)} disabled={currentPage === totalPages} theme={theme}>Next &gt;</PageButton>
+          {currentPage === totalPages && olderCursor && (
+            <PageButton onClick={handleLoadOlder} disabled={loadingOlder} theme={theme}>
+              {loadingOlder ? 'Loading...' : 'Load older'}
+            </PageButton>
+          )}
         </PaginationControls>
       </TableContainer>
     </PageContainer>
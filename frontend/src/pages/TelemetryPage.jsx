@@ -1,5 +1,5 @@
 import { useEffect, useState } from 'react';
-import { fetchTelemetry, fetchLogs } from '../services/api';
+import { fetchTelemetry, fetchHistory, subscribeStream } from '../services/api';
 import styled from 'styled-components';
 import MapComponent from '../components/MapComponent';
 import TelemetryChart from '../components/TelemetryChart';
@@ -48,6 +48,21 @@ const ChartsContainer = styled.div`
   margin: 2rem 0;
 `;
 
+const HISTORY_CHANNELS = ['temperature', 'humidity', 'pressure'];
+
+// Turn the column-per-stat /api/history response into one entry per bucket
+// (newest first), keeping the last value of each channel like groupBy5Min does
+const historyEntries = ({ time, channels }) =>
+  time
+    .map((timestamp, i) => {
+      const entry = { timestamp };
+      HISTORY_CHANNELS.forEach(channel => {
+        entry[channel] = channels[channel].last[i];
+      });
+      return entry;
+    })
+    .reverse();
+
 const TelemetryPage = () => {
   const [currentTelemetry, setCurrentTelemetry] = useState(null);
   const [historicalData, setHistoricalData] = useState([]);
@@ -57,12 +72,12 @@ const TelemetryPage = () => {
   useEffect(() => {
     const loadData = async () => {
       try {
-        const [logsRes, telemetryRes] = await Promise.all([
-          fetchLogs(),
+        const [historyRes, telemetryRes] = await Promise.all([
+          fetchHistory({ bucket: '5m', channels: HISTORY_CHANNELS.join(',') }),
           fetchTelemetry()
         ]);
         
-        setHistoricalData(logsRes.data);
+        setHistoricalData(historyEntries(historyRes.data));
         setCurrentTelemetry(telemetryRes.data);
       } catch (error) {
         console.error('Error loading data:', error);
@@ -74,14 +89,13 @@ const TelemetryPage = () => {
     loadData();
   }, []);
 
-  // Set up real-time updates
+  // Real-time updates pushed by the backend
   useEffect(() => {
-    const interval = setInterval(async () => {
-      try {
-        const response = await fetchTelemetry();
+    const unsubscribe = subscribeStream({
+      telemetry: (data) => {
         const newEntry = {
           timestamp: new Date().toISOString(),
-          ...response.data
+          ...data
         };
         setHistoricalData(prev => {
           if (prev.length === 0) return [newEntry];
@@ -108,13 +122,11 @@ const TelemetryPage = () => {
             return prev;
           }
         });
-        setCurrentTelemetry(response.data);
-      } catch (error) {
-        console.error('Error fetching telemetry:', error);
-      }
-    }, 5000); // every 5 seconds
+        setCurrentTelemetry(data);
+      },
+    });
 
-    return () => clearInterval(interval);
+    return unsubscribe;
   }, []);
 
   if (isLoading) return <PageContainer>Loading...</PageContainer>;
@@ -1,7 +1,9 @@
 import axios from 'axios';
 
+const API_BASE_URL = 'http://localhost:5000/api';
+
 export const api = axios.create({
-  baseURL: 'http://localhost:5000/api',
+  baseURL: API_BASE_URL,
 });
 
 // Add Firebase auth token to requests
@@ -25,5 +27,30 @@ api.interceptors.response.use(
 
 // Data fetching functions for your satellite dashboard
 export const fetchTelemetry = () => api.get('/telemetry');
-export const fetchLogs = () => api.get('/logs');
-export const fetchGyro = () => api.get('/gyro');
\ No newline at end of file
+// params: { limit, before_id, since_id } - keyset cursors come back in the
+// X-Next-Before-Id / X-Next-Since-Id response headers
+export const fetchLogs = (params) => api.get('/logs', { params });
+export const fetchGyro = () => api.get('/gyro');
+// params: { from, to, bucket, channels } - per-bucket min/max/mean/count/last
+export const fetchHistory = (params) => api.get('/history', { params });
+
+// Push updates over Server-Sent Events instead of polling.
+// handlers maps channel name ('telemetry' | 'gyro' | 'log') to a callback that
+// receives the parsed event data. The browser reconnects automatically and
+// sends Last-Event-ID, so the server replays anything missed in between.
+// onGap is called if the client fell too far behind to be caught up and
+// should refetch instead. Returns a function that closes the stream.
+export const subscribeStream = (handlers, { onGap } = {}) => {
+  const channels = Object.keys(handlers).join(',');
+  const source = new EventSource(`${API_BASE_URL}/stream?channels=${channels}`);
+
+  Object.entries(handlers).forEach(([channel, handler]) => {
+    source.addEventListener(channel, (event) => handler(JSON.parse(event.data)));
+  });
+  if (onGap) {
+    source.addEventListener('gap', () => onGap());
+  }
+  source.onerror = (error) => console.error('Stream error:', error);
+
+  return () => source.close();
+};